@@ -0,0 +1,21 @@
+import sys,os
+sys.path.insert(0,os.path.join(sys.path[0],'..'))
+from xenoGI import parameters,xenoGI,Score
+
+# Converts a binary scores file written in the original format (by
+# xenoGI versions before format version 2) to the current binary
+# format, which can be memory mapped. Expects to be run in a xenoGI
+# working directory.
+
+if __name__ == "__main__":
+
+    paramFN = sys.argv[1]
+    inScoresFN = sys.argv[2]
+    outScoresFN = sys.argv[3]
+
+    paramD = parameters.createParametersD(parameters.baseParamStr,paramFN)
+    strainNamesT = xenoGI.readStrainInfoFN(paramD['strainInfoFN'])
+
+    scoreTypeL = ['rawSc','synSc','coreSynSc']
+    scoresO = Score.Score.readScoresBinary(strainNamesT,scoreTypeL,inScoresFN)
+    scoresO.writeScoresBinary(strainNamesT,scoreTypeL,outScoresFN)
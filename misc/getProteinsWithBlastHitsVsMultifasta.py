@@ -15,7 +15,6 @@ if __name__ == "__main__":
 
     paramD = parameters.createParametersD(parameters.baseParamStr,paramFN)
     genesO = genomes.genes(paramD['geneInfoFN'])
-    genesO.initializeGeneNumToNameD(paramD['geneInfoFN'])
     strainNamesT = xenoGI.readStrainInfoFN(strainInfoFN)
     
     evalueThresh = paramD['evalueThresh']
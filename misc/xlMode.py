@@ -55,7 +55,7 @@ file."""
         allGenomesStrainNamesL.remove('randomSampleAabrh')
 
     # get list of all around best reciprocal hits for this sample
-    randomSampleAabrhL = scores.createAabrhL(paramD['blastFilePath'],sampleGenomesStrainNamesL,paramD['evalueThresh'],paramD['alignCoverThresh'],paramD['percIdentThresh'],paramD['randomSampleAabrhFN'])
+    randomSampleAabrhL = scores.createAabrhL(paramD['blastFilePath'],sampleGenomesStrainNamesL,paramD['evalueThresh'],paramD['alignCoverThresh'],paramD['percIdentThresh'],paramD['randomSampleAabrhFN'],paramD['blastHitCacheDir'])
     
     # write all to a single file
     fastaDir = os.path.split(paramD['fastaFilePath'])[0]
@@ -107,44 +107,27 @@ def writeFastaLine(f,gene,seqD):
     f.write(seqD[gene]+"\n")
 
 def getCoreGenes(allGenomesStrainNamesL,blastDir,randomSampleAabrhL,orthoL,paramD):
-    # for every strain in all genomes, we find all blast hits with the sampled group. 
+    """For every strain in all genomes, find the best hit of each set in
+randomSampleAabrhL, and add it to the corresponding list in orthoL. A
+set is kept only if its first gene has a best hit in every strain,
+otherwise its entry in orthoL is set to None."""
+    firstGeneAr = numpy.array([aabrhT[0] for aabrhT in randomSampleAabrhL],dtype=numpy.int64)
+    keepAr = numpy.array([ortho != None for ortho in orthoL],dtype=bool)
+    strainHitArL = []
+    randomSampleAabrhFastaStem = paramD['randomSampleAabrhFastaFN'].split(".fa")[0]
     for strain in allGenomesStrainNamesL:
-        randomSampleAabrhFastaStem = paramD['randomSampleAabrhFastaFN'].split(".fa")[0]
         blastFN = os.path.join(blastDir,randomSampleAabrhFastaStem+'_-VS-_'+strain+'.out')
-        strainHitsD = scores.getHits(blastFN,paramD['evalueThresh'],paramD['alignCoverThresh'], paramD['percIdentThresh'])
-        # now for every set, we check if the best hit of each gene is the same gene 
-        # if so, we add that gene to the orthoL and move to the next genome. else, remove the set
-        for aabrhInd in range(len(randomSampleAabrhL)):
-            # check if we've already gotten rid of the set
-            if orthoL[aabrhInd] != None:
-                gene = randomSampleAabrhL[aabrhInd][0]
-                # check if gene is in dictionary, if not get rid of set. 
-                if gene in strainHitsD:
-                    strainGene = strainHitsD[gene]
-                    # check if all genes have same hit, if so add gene to the set
-                    if orthoChecker(randomSampleAabrhL[aabrhInd], strainHitsD, strainGene):
-                        orthoL[aabrhInd].append(strainGene)
-                    else:
-                        orthoL[aabrhInd] = None
-                else:
-                    orthoL[aabrhInd] = None
-            else:
-                continue
-    return orthoL
-
-def orthoChecker(ortho, strainHitsD, strainGene):
-    """ sub-function for obtainCoreGenesWrapper function to check whether all the genes in 
-the tuple have the same hit in a genome"""
-    # check if gene is in dictionary, if so check if every gene gives the same hit. if so, return true
-    for gene in ortho:
-        if gene not in strainHitsD:
-            return False
+        queryAr,subjectAr = scores.getBestHitArrays(blastFN,paramD['evalueThresh'],paramD['alignCoverThresh'], paramD['percIdentThresh'],paramD['blastHitCacheDir'])
+        strainHitAr = scores.lookupHits(queryAr,subjectAr,firstGeneAr)
+        keepAr &= strainHitAr != -1
+        strainHitArL.append(strainHitAr)
+
+    for aabrhInd in range(len(orthoL)):
+        if keepAr[aabrhInd]:
+            orthoL[aabrhInd].extend(int(strainHitAr[aabrhInd]) for strainHitAr in strainHitArL)
         else:
-            if strainHitsD[gene] == strainGene:
-               return True
-            else:
-               return False
-
+            orthoL[aabrhInd] = None
+    return orthoL
 
 ###### Trim tree ######
 
@@ -594,7 +577,8 @@ indicate no blast similarity.
     for strain in allStrainsT:
         scaffoldFamilyRepGenesFastaStem = paramD['scaffoldFamilyRepGenesFastaFN'].split(".")[0]
         blastFN = os.path.join(blastDir,scaffoldFamilyRepGenesFastaStem+'_-VS-_'+strain+'.out')
-        for queryGene,targetGene,evalue,alCov,pIdent,score in blast.parseBlastFile(blastFN,paramD['evalueThresh'],paramD['xlMapAlignCoverThresh'], paramD['percIdentThresh']):
+        hitsAr = blast.loadBlastHits(blastFN,paramD['evalueThresh'],paramD['xlMapAlignCoverThresh'], paramD['percIdentThresh'],paramD['blastHitCacheDir'])
+        for queryGene,targetGene,evalue in zip(hitsAr['queryGene'].tolist(),hitsAr['subjectGene'].tolist(),hitsAr['evalue'].tolist()):
             queryLocFam = gene2LocFamNumD[queryGene]
             if evalue < evalueAr[targetGene]:
                 evalueAr[targetGene] = evalue
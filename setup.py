@@ -25,7 +25,7 @@ setup(
     author = "Eliot Bush",
     author_email = "bush@hmc.edu",
     url = "https://github.com/ecbush/xenoGI",
-    install_requires=['biopython','parasail'],
+    install_requires=['biopython','numpy','parasail','scipy'],
     include_package_data=True,
     classifiers=(
         "Programming Language :: Python :: 3",
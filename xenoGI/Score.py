@@ -1,17 +1,60 @@
 import numpy,glob,os,struct,statistics,ctypes
 from multiprocessing import RawArray
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
 from . import blast
 
+# binary scores file format
+scoresBinaryMagic = b'xenoGIsc'
+scoresBinaryVersion = 2
+scoreTypeNameSize = 16
+
+# number of edges to process at a time when looping over the edge
+# index in chunks
+edgeChunkSize = 2**20
+genePairHashMultiplier = 0x9E3779B97F4A7C15 # odd 64 bit constant for multiplicative hashing
+emptyHashKey = 2**64-1 # marks an empty slot in the sharedScore hash table
+
+def packGenePairs(gn1Ar,gn2Ar):
+    '''Pack two arrays of gene numbers into a single uint64 array, with
+gn1 in the high 32 bits. Sorting on the result sorts by gn1, then gn2.'''
+    return (numpy.asarray(gn1Ar).astype(numpy.uint64) << numpy.uint64(32)) | numpy.asarray(gn2Ar).astype(numpy.uint64)
+
+def uniqueGenePairs(queryAr,subjectAr):
+    '''Given arrays of genes in pairs (e.g. the query and subject genes
+of blast hits), put the lower gene number first in each pair and
+remove repeats. Returns two uint32 arrays gn1Ar and gn2Ar with the
+remaining pairs in order of their first occurence.'''
+    if len(queryAr) > 0 and max(queryAr.max(),subjectAr.max()) >= 2**32:
+        raise ValueError("Error creating Score object. At least one gene has been given a number too large for the array data type we are using.")
+    keyAr = packGenePairs(numpy.minimum(queryAr,subjectAr),numpy.maximum(queryAr,subjectAr))
+    uniqueKeyAr,firstIndAr = numpy.unique(keyAr,return_index=True)
+    keyAr = uniqueKeyAr[numpy.argsort(firstIndAr)]
+    return (keyAr >> numpy.uint64(32)).astype(numpy.uint32),(keyAr & numpy.uint64(2**32-1)).astype(numpy.uint32)
+
+def getEdgeRecordDtype(scoreTypeL):
+    '''Return the numpy dtype for one edge in the original binary scores format:
+g1, g2 and edge as 8 byte ints followed by each score as an 8 byte
+float, all little endian.'''
+    return numpy.dtype([('g1','<i8'),('g2','<i8'),('edge','<i8')]+[(scoreType,'<f8') for scoreType in scoreTypeL])
+
 class Score:
 
     def __init__(self):
         '''Create an object for storing scores.'''
         
-        self.endNodesToEdgeD = {}
         self.numEdges = 0 # to start out
         self.strainPairScoreLocationD = {}
         self.scoreD = {}
 
+        # Edge index. This is a compressed sparse row representation
+        # where each edge is stored once, under its lower numbered
+        # gene. The edges of gene g1 are at positions
+        # endNodesIndptrAr[g1] to endNodesIndptrAr[g1+1] in
+        # endNodesGn2Ar (the other gene, sorted) and endNodesEdgeAr
+        # (the edge number).
+        self.createEdgeIndex(numpy.zeros(0,dtype=numpy.uint32),numpy.zeros(0,dtype=numpy.uint32))
+
     def initializeDataAttributes(self,blastFnL,paramD,strainNamesT):
         '''This method takes a new, empty object and fills the data attributes
 by reading through blast files to identify pairs of genes with
@@ -20,14 +63,13 @@ edges. Also creates the array for storing raw scores, initialized to
 included here depend on what is found in the blast files in blastFnL.
 
         '''
-        self.fillEndNodesToEdgeD(blastFnL,paramD,strainNamesT)
-        self.numEdges=len(self.endNodesToEdgeD)
+        self.fillEdgeIndex(blastFnL,paramD,strainNamesT)
         self.initializeScoreArray('rawSc')
 
-    def fillEndNodesToEdgeD(self,blastFnL,paramD,strainNamesT):
+    def fillEdgeIndex(self,blastFnL,paramD,strainNamesT):
         '''Run through blast files, finding all pairs of genes with signicant
-similarity. Use these to fill endNodesToEdgeD. Also keep track of the
-edge numbers associated with particular strain pairs and save in
+similarity. Use these to create the edge index. Also keep track of
+the edge numbers associated with particular strain pairs and save in
 strainPairScoreLocationD.
         '''
 
@@ -36,9 +78,12 @@ strainPairScoreLocationD.
         alignCoverThresh = paramD['alignCoverThresh']
         percIdentThresh =  paramD['percIdentThresh']
         blastFileJoinStr = paramD['blastFileJoinStr']
+        hitCacheDir = paramD['blastHitCacheDir']
         
         blastFnByPairD = self.getBlastFnByPairD(blastFnL,blastFileJoinStr,strainNamesT)
 
+        gn1ArL = []
+        gn2ArL = []
         edgeNum=0
         for strainPair in blastFnByPairD:
             pairT = blastFnByPairD[strainPair]
@@ -49,24 +94,21 @@ strainPairScoreLocationD.
             # pairT may have two blast files (e.g for strain 1 vs 2
             # and also for 2 vs 1), or may only have one (e.g. for
             # strain 1 vs strain 1).
+            queryArL = []
+            subjectArL = []
             for fn in pairT:
-                for g1,g2,evalue,alCov,pident,score in blast.parseBlastFile(fn,evalueThresh,alignCoverThresh,percIdentThresh):
-                    
-                    # because we have blast files going both ways
-                    # (e.g. strain 1 vs strain 2 and also strain 2 vs
-                    # strain 1), we check if we've added this
-                    # particular gene pair already. If so, no need to
-                    # do so again.
-                    
-                    # make sure g1 is the lower gene number (we do this so
-                    # we only store in one orientation in dict).
-                    if g1 > g2: g2,g1 = g1,g2
-
-                    if (g1,g2) not in self.endNodesToEdgeD:
-                        # we haven't got it yet, add it
-                        self.endNodesToEdgeD[(g1,g2)] = edgeNum
-                        edgeNum += 1
-                    
+                hitsAr = blast.loadBlastHits(fn,evalueThresh,alignCoverThresh,percIdentThresh,hitCacheDir)
+                queryArL.append(hitsAr['queryGene'])
+                subjectArL.append(hitsAr['subjectGene'])
+
+            # because we have blast files going both ways (e.g. strain
+            # 1 vs strain 2 and also strain 2 vs strain 1), a gene pair
+            # may be present more than once. Put lower gene number
+            # first, and keep only the first occurence of each pair.
+            gn1Ar,gn2Ar = uniqueGenePairs(numpy.concatenate(queryArL),numpy.concatenate(subjectArL))
+            gn1ArL.append(gn1Ar)
+            gn2ArL.append(gn2Ar)
+            edgeNum += len(gn1Ar)
                 
             strainPairEnd = edgeNum
 
@@ -74,7 +116,9 @@ strainPairScoreLocationD.
             # strainPair. Keys for this dict are tuples of train
             # number, e.g. (1,2) Always lower number first.
             self.strainPairScoreLocationD[strainPair] = (strainPairSt,strainPairEnd)
-            
+
+        if gn1ArL != []:
+            self.createEdgeIndex(numpy.concatenate(gn1ArL),numpy.concatenate(gn2ArL))
 
     def getBlastFnByPairD(self,blastFnL,blastFileJoinStr,strainNamesT):
         '''Get the set of blast files and organize by the pair of strains
@@ -102,6 +146,57 @@ compared against itself then we have only one file name in the list.
                 blastFnByPairD[key] = [fileStr]
             
         return blastFnByPairD
+
+    def createEdgeIndex(self,gn1ByEdgeAr,gn2ByEdgeAr):
+        '''Given arrays with the two end nodes of every edge (indexed by
+edge number, with gn1 <= gn2), create the edge index attributes and
+set numEdges.
+        '''
+        numEdges = len(gn1ByEdgeAr)
+        if numEdges > 2**32:
+            raise ValueError("Error creating Score object. Data set has too many score pairs for the data type we're using in the edge index (uint32).")
+        
+        gn1ByEdgeAr = numpy.asarray(gn1ByEdgeAr,dtype=numpy.uint32)
+        gn2ByEdgeAr = numpy.asarray(gn2ByEdgeAr,dtype=numpy.uint32)
+        numNodes = int(gn2ByEdgeAr.max())+1 if numEdges > 0 else 0
+
+        # sort edges by gn1, then gn2
+        order = numpy.argsort(packGenePairs(gn1ByEdgeAr,gn2ByEdgeAr),kind='stable')
+        
+        self.numEdges = numEdges
+        self.endNodesIndptrAr = numpy.zeros(numNodes+1,dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(gn1ByEdgeAr,minlength=numNodes),out=self.endNodesIndptrAr[1:])
+        self.endNodesGn2Ar = gn2ByEdgeAr[order]
+        self.endNodesEdgeAr = order.astype(numpy.uint32)
+
+    def appendEdges(self,otherScoresO):
+        '''Add the edges in otherScoresO to self, along with their
+scores. The new edges are numbered after the ones already in self,
+so existing edge numbers don't change. otherScoresO must not contain
+any of the strain pairs in self. Score types that self has but
+otherScoresO lacks are set to 0 for the new edges. Afterwards all
+arrays in self are writable copies, even if self was memory mapped
+from a file.
+        '''
+        for strainPair in otherScoresO.strainPairScoreLocationD:
+            if strainPair in self.strainPairScoreLocationD:
+                raise ValueError("Error appending edges. Strain pair "+str(strainPair)+" is already present.")
+
+        oldNumEdges = self.numEdges
+        gn1ByEdgeAr,gn2ByEdgeAr = self.getEndNodeArrays()
+        otherGn1ByEdgeAr,otherGn2ByEdgeAr = otherScoresO.getEndNodeArrays()
+
+        for scoreType in self.scoreD:
+            if scoreType in otherScoresO.scoreD:
+                otherScoreAr = otherScoresO.scoreD[scoreType]
+            else:
+                otherScoreAr = numpy.zeros(otherScoresO.numEdges,dtype=ctypes.c_double)
+            self.scoreD[scoreType] = numpy.concatenate((self.scoreD[scoreType],otherScoreAr))
+
+        for strainPair,(stInd,endInd) in otherScoresO.strainPairScoreLocationD.items():
+            self.strainPairScoreLocationD[strainPair] = (stInd+oldNumEdges,endInd+oldNumEdges)
+
+        self.createEdgeIndex(numpy.concatenate((gn1ByEdgeAr,otherGn1ByEdgeAr)),numpy.concatenate((gn2ByEdgeAr,otherGn2ByEdgeAr)))
                 
     def initializeScoreArray(self,scoreType):
         '''Create array for storing scores.'''
@@ -115,15 +210,57 @@ list of tuples. Each tuple will be two strains in numeric form.'''
     def isEdgePresentByEndNodes(self,g1,g2):
         '''See if g1 and g2 have an edge in our data structure. Return
 boolean.'''
-        if g1 > g2: g2,g1 = g1,g2
-        if (g1,g2) in self.endNodesToEdgeD: return True
-        else: return False
+        return self.endNodesToEdge(g1,g2) != None
         
     def endNodesToEdge(self,g1,g2):
         '''Given two genes, return the number of the edge between them. If
 there isn't any, return None.'''
-        edge = self.endNodesToEdgeD[(g1,g2)]
-        return edge
+        if g1 > g2: g2,g1 = g1,g2
+        if g1 < 0 or g2 >= len(self.endNodesIndptrAr)-1:
+            return None
+        st = self.endNodesIndptrAr[g1]
+        end = self.endNodesIndptrAr[g1+1]
+        ind = st + numpy.searchsorted(self.endNodesGn2Ar[st:end],g2)
+        if ind < end and self.endNodesGn2Ar[ind] == g2:
+            return int(self.endNodesEdgeAr[ind])
+        else:
+            return None
+
+    def endNodesToEdgeArray(self,gn1Ar,gn2Ar):
+        '''Vectorized version of endNodesToEdge. Given arrays of genes,
+return an int64 array with the edge between each pair, or -1 where
+there is no edge.
+        '''
+        gn1Ar = numpy.asarray(gn1Ar,dtype=numpy.int64)
+        gn2Ar = numpy.asarray(gn2Ar,dtype=numpy.int64)
+        loAr = numpy.minimum(gn1Ar,gn2Ar)
+        hiAr = numpy.maximum(gn1Ar,gn2Ar)
+        outAr = numpy.full(len(loAr),-1,dtype=numpy.int64)
+
+        validIndAr = numpy.flatnonzero((loAr >= 0) & (hiAr < len(self.endNodesIndptrAr)-1))
+        loAr = loAr[validIndAr]
+        hiAr = hiAr[validIndAr]
+        regionStAr = self.endNodesIndptrAr[loAr]
+        regionEndAr = self.endNodesIndptrAr[loAr+1]
+
+        # binary search within each region simultaneously. stAr ends
+        # up at the first position in the region where gn2 >= hiAr.
+        stAr = regionStAr.copy()
+        endAr = regionEndAr.copy()
+        while True:
+            activeAr = stAr < endAr
+            if not activeAr.any():
+                break
+            midAr = (stAr + endAr) // 2
+            midGn2Ar = self.endNodesGn2Ar[numpy.where(activeAr,midAr,0)]
+            goRightAr = activeAr & (midGn2Ar < hiAr)
+            stAr = numpy.where(goRightAr,midAr+1,stAr)
+            endAr = numpy.where(activeAr & ~goRightAr,midAr,endAr)
+
+        foundAr = stAr < regionEndAr
+        foundAr[foundAr] = self.endNodesGn2Ar[stAr[foundAr]] == hiAr[foundAr]
+        outAr[validIndAr[foundAr]] = self.endNodesEdgeAr[stAr[foundAr]]
+        return outAr
 
     def addScoreByEdge(self,edge,sc,scoreType):
         '''Given a score on an edge, store it in the score array corresponding
@@ -135,11 +272,9 @@ to scoreType.
         '''Given a score between two genes store it in the score array
 corresponding to scoreType.'''
 
-        if g1 > g2: g2,g1 = g1,g2 # make sure g1 is lower gene num
-
-        if self.isEdgePresentByEndNodes(g1,g2):
-            # we can only add scores for those edges that already exist
-            edge = self.endNodesToEdge(g1,g2)
+        # we can only add scores for those edges that already exist
+        edge = self.endNodesToEdge(g1,g2)
+        if edge != None:
             self.addScoreByEdge(edge,sc,scoreType)
         # if the edge isn't already present, do nothing.
             
@@ -149,19 +284,49 @@ corresponding to scoreType.'''
 
     def getScoreByEndNodes(self,g1,g2,scoreType):
         '''Given two genes get the score corresponding to scoreType.'''
-
-        if g1 > g2: g2,g1 = g1,g2 # make sure g1 is lower gene num
         edge = self.endNodesToEdge(g1,g2)
+        if edge == None:
+            raise KeyError((g1,g2))
         return self.getScoreByEdge(edge,scoreType)
 
+    def getScoreByEndNodesArray(self,gn1Ar,gn2Ar,scoreType):
+        '''Vectorized version of getScoreByEndNodes. Given arrays of genes,
+return an array of scores of type scoreType, with nan where a pair
+has no edge.'''
+        edgeAr = self.endNodesToEdgeArray(gn1Ar,gn2Ar)
+        foundAr = edgeAr >= 0
+        outAr = numpy.full(len(edgeAr),numpy.nan)
+        outAr[foundAr] = self.scoreD[scoreType][edgeAr[foundAr]]
+        return outAr
+
     def iterateEdges(self):
         '''Returns an iterator which goes over edges by edge number.'''
         return range(self.numEdges)
 
     def iterateEdgesByEndNodes(self):
-        '''Returns an iterator which goes over edges by end nodes.'''
-        return self.endNodesToEdgeD.keys()
-
+        '''Returns an iterator which goes over edges by end nodes, yielding
+(gn1,gn2) tuples with gn1 <= gn2.'''
+        for st in range(0,self.numEdges,edgeChunkSize):
+            gn1Ar,gn2Ar,edgeAr = self.getEdgeIndexChunk(st,st+edgeChunkSize)
+            yield from zip(gn1Ar.tolist(),gn2Ar.tolist())
+
+    def getEdgeIndexChunk(self,st,end):
+        '''Return arrays of gn1, gn2 and edge for positions st to end in the
+edge index.'''
+        end = min(end,self.numEdges)
+        posAr = numpy.arange(st,end)
+        gn1Ar = numpy.searchsorted(self.endNodesIndptrAr,posAr,side='right')-1
+        return gn1Ar,self.endNodesGn2Ar[st:end],self.endNodesEdgeAr[st:end]
+
+    def getEndNodeArrays(self):
+        '''Return two arrays, indexed by edge number, giving the lower and
+higher numbered gene at the ends of each edge.'''
+        gn1ByEdgeAr = numpy.empty(self.numEdges,dtype=numpy.uint32)
+        gn1ByEdgeAr[self.endNodesEdgeAr] = numpy.repeat(numpy.arange(len(self.endNodesIndptrAr)-1,dtype=numpy.uint32),numpy.diff(self.endNodesIndptrAr))
+        gn2ByEdgeAr = numpy.empty(self.numEdges,dtype=numpy.uint32)
+        gn2ByEdgeAr[self.endNodesEdgeAr] = self.endNodesGn2Ar
+        return gn1ByEdgeAr,gn2ByEdgeAr
+    
     def iterateScoreByStrainPair(self,strainPair,scoreType):
         '''Returns an iterator which gives all scores of type scoreType associated with a
 particular strainPair.'''
@@ -185,7 +350,16 @@ form).'''
         if self.numEdges != other.numEdges:
             return False
 
-        if sorted(self.endNodesToEdgeD.items()) != sorted(other.endNodesToEdgeD.items()):
+        # gene numbers past the last one with an edge don't matter
+        numNodes = len(self.endNodesIndptrAr)
+        otherNumNodes = len(other.endNodesIndptrAr)
+        if numNodes < otherNumNodes:
+            if not numpy.array_equal(self.endNodesIndptrAr,other.endNodesIndptrAr[:numNodes]) or not (other.endNodesIndptrAr[numNodes:] == self.numEdges).all():
+                return False
+        elif not numpy.array_equal(self.endNodesIndptrAr[:otherNumNodes],other.endNodesIndptrAr) or not (self.endNodesIndptrAr[otherNumNodes:] == self.numEdges).all():
+            return False
+        
+        if not numpy.array_equal(self.endNodesGn2Ar,other.endNodesGn2Ar) or not numpy.array_equal(self.endNodesEdgeAr,other.endNodesEdgeAr):
             return False
 
         if sorted(self.strainPairScoreLocationD.items()) != sorted(other.strainPairScoreLocationD.items()):
@@ -218,21 +392,21 @@ form).'''
             stInd,endInd = self.strainPairScoreLocationD[key]
             f.write("\t".join(map(str,[strainNum1,strainNum2,stInd,endInd]))+"\n")
 
-        genesO.initializeGeneNumToNameD(geneInfoFN,strainNamesT)
-            
         # write header
         f.write("# Scores: "+"\t".join(['gene1','gene2','edge']+scoreTypeL)+'\n')
 
-        for gene1Num,gene2Num in self.endNodesToEdgeD:
-            edge = self.endNodesToEdgeD[(gene1Num,gene2Num)]
-            outStrL=[]
-            outStrL.append(genesO.numToName(gene1Num))
-            outStrL.append(genesO.numToName(gene2Num))
-            outStrL.append(str(edge))
-            for scoreType in scoreTypeL:
-                outStrL.append(format(self.getScoreByEndNodes(gene1Num,gene2Num,scoreType),".6f"))
+        for st in range(0,self.numEdges,edgeChunkSize):
+            gn1Ar,gn2Ar,edgeAr = self.getEdgeIndexChunk(st,st+edgeChunkSize)
+            scoreLL = [self.scoreD[scoreType][edgeAr].tolist() for scoreType in scoreTypeL]
+            for i,(gene1Num,gene2Num,edge) in enumerate(zip(gn1Ar.tolist(),gn2Ar.tolist(),edgeAr.tolist())):
+                outStrL=[]
+                outStrL.append(genesO.numToName(gene1Num))
+                outStrL.append(genesO.numToName(gene2Num))
+                outStrL.append(str(edge))
+                for scoreL in scoreLL:
+                    outStrL.append(format(scoreL[i],".6f"))
 
-            f.write("\t".join(outStrL)+'\n')
+                f.write("\t".join(outStrL)+'\n')
 
         f.close()
 
@@ -270,9 +444,11 @@ form).'''
         # now we move to loading scores. The number of edges will be maxEndInd
 
         # Set up the arrays
-        scoresO.numEdges = maxEndInd
+        numEdges = maxEndInd
+        gn1ByEdgeAr = numpy.zeros(numEdges,dtype=numpy.uint32)
+        gn2ByEdgeAr = numpy.zeros(numEdges,dtype=numpy.uint32)
         for scoreType in scoreTypeL:
-            scoresO.initializeScoreArray(scoreType)
+            scoresO.scoreD[scoreType] = numpy.zeros(numEdges,dtype=ctypes.c_double)
 
         separaterLineL = s.split()
         scoreTypeL=separaterLineL[5:] # the types of scores are listed in this separator line
@@ -287,60 +463,132 @@ form).'''
             g2 = int(lineL[1].split('_')[0])
             
             edge = int(lineL[2])
-            scoresO.endNodesToEdgeD[(g1,g2)] = edge
+            gn1ByEdgeAr[edge] = g1
+            gn2ByEdgeAr[edge] = g2
 
             scoreL=lineL[3:]
             for i,sc in enumerate(scoreL):
                 scoresO.addScoreByEdge(edge,float(sc),scoreTypeL[i])
 
         f.close()
+        scoresO.createEdgeIndex(gn1ByEdgeAr,gn2ByEdgeAr)
         return scoresO
 
     def writeScoresBinary(self,strainNamesT,scoreTypeL,scoresFN):
-        '''Write scores to scoresFN as a binary file.'''
+        '''Write scores to scoresFN as a binary file (format version
+2). The file begins with a header of 8 byte little endian ints: the
+magic bytes, format version, numEdges, number of nodes in the edge
+index, number of strain pairs and number of score types. Then come 4
+ints (strainNum1, strainNum2, stInd, endInd) for each strain pair and
+a 16 byte name for each score type. The rest of the file is
+contiguous little endian arrays: endNodesIndptrAr (int64),
+endNodesGn2Ar and endNodesEdgeAr (uint32), and then one float64 array
+for each score type, indexed by edge. Each array starts at an offset
+which is a multiple of its itemsize (the two uint32 arrays together
+take 8 bytes per edge, so the float64 arrays are 8 byte aligned), so
+the file can be memory mapped by readScoresBinary.
+        '''
+        numNodes = len(self.endNodesIndptrAr) - 1
+        
+        with open(scoresFN,'wb') as f:
+            f.write(scoresBinaryMagic)
+            for val in [scoresBinaryVersion,self.numEdges,numNodes,len(self.strainPairScoreLocationD),len(scoreTypeL)]:
+                f.write(val.to_bytes(8,'little'))
+
+            # a block of bytes for each strain pair location
+            for key in self.strainPairScoreLocationD:
+                strainName1,strainName2 = key
+                strainNum1 = strainNamesT.index(strainName1)
+                strainNum2 = strainNamesT.index(strainName2)
+                stInd,endInd = self.strainPairScoreLocationD[key]
+                for val in [strainNum1,strainNum2,stInd,endInd]:
+                    f.write(val.to_bytes(8,'little'))
 
-        f=open(scoresFN,'wb')
+            for scoreType in scoreTypeL:
+                f.write(scoreType.encode('ascii').ljust(scoreTypeNameSize,b'\0'))
 
-        # first 8 bytes are int, telling us how many edges
-        f.write(self.numEdges.to_bytes(8,'little'))
+            # the arrays
+            numpy.ascontiguousarray(self.endNodesIndptrAr,dtype='<i8').tofile(f)
+            numpy.ascontiguousarray(self.endNodesGn2Ar,dtype='<u4').tofile(f)
+            numpy.ascontiguousarray(self.endNodesEdgeAr,dtype='<u4').tofile(f)
+            for scoreType in scoreTypeL:
+                numpy.ascontiguousarray(self.scoreD[scoreType],dtype='<f8').tofile(f)
+        
+    def readScoresBinary(strainNamesT,scoreTypeL,scoresFN):
+        '''Read scores from a binary file. Files in format version 2 (see
+writeScoresBinary) are memory mapped rather than read, so loading is
+fast, and pages are shared between processes reading the same
+file. The arrays of an object loaded this way are read only. Files in
+the original format are also accepted.
+        '''
+        with open(scoresFN,'rb') as f:
+            isVersion2 = f.read(len(scoresBinaryMagic)) == scoresBinaryMagic
 
-        # next 8 bytes are int telling us how many strain pairs there are
-        numStrainPairs = len(self.strainPairScoreLocationD)
-        f.write(numStrainPairs.to_bytes(8,'little'))
+        if not isVersion2:
+            return Score.readScoresBinaryV1(strainNamesT,scoreTypeL,scoresFN)
+        
+        scoresO=Score()
+        bufAr = numpy.memmap(scoresFN,dtype=numpy.uint8,mode='r')
+
+        # header
+        pos = len(scoresBinaryMagic)
+        headerAr = bufAr[pos:pos+5*8].view('<i8')
+        version,numEdges,numNodes,numStrainPairs,numScoreTypes = map(int,headerAr)
+        pos += 5*8
+        if version != scoresBinaryVersion:
+            raise ValueError("Scores file "+scoresFN+" has unsupported format version "+str(version)+".")
+
+        # the index locations where scores from different strain
+        # pairs will be found
+        strainPairAr = bufAr[pos:pos+numStrainPairs*4*8].view('<i8').reshape(numStrainPairs,4)
+        pos += numStrainPairs*4*8
+        for strainNum1,strainNum2,stInd,endInd in strainPairAr.tolist():
+            strainName1 = strainNamesT[strainNum1]
+            strainName2 = strainNamesT[strainNum2]
+            key = tuple(sorted([strainName1,strainName2]))
+            scoresO.strainPairScoreLocationD[key] = (stInd,endInd)
 
-        # write a block of bytes for each strain pair location
-        for key in self.strainPairScoreLocationD:
-            strainName1,strainName2 = key
-            strainNum1 = strainNamesT.index(strainName1)
-            strainNum2 = strainNamesT.index(strainName2)
-            stInd,endInd = self.strainPairScoreLocationD[key]
-            f.write(strainNum1.to_bytes(8,'little'))
-            f.write(strainNum2.to_bytes(8,'little'))
-            f.write(stInd.to_bytes(8,'little'))
-            f.write(endInd.to_bytes(8,'little'))
-            
-        # write a block of bytes for each edge.
-        # g1 g2 edge
-        for g1,g2 in self.endNodesToEdgeD:
-            edge = self.endNodesToEdgeD[(g1,g2)]
-            f.write(g1.to_bytes(8,'little'))
-            f.write(g2.to_bytes(8,'little'))
-            f.write(edge.to_bytes(8,'little'))
-            for scoreType in scoreTypeL:
-                val = float(self.getScoreByEndNodes(g1,g2,scoreType))
-                f.write(struct.pack('<d',val))
+        fileScoreTypeL = []
+        for i in range(numScoreTypes):
+            fileScoreTypeL.append(bufAr[pos:pos+scoreTypeNameSize].tobytes().rstrip(b'\0').decode('ascii'))
+            pos += scoreTypeNameSize
+
+        # the arrays, as views on the memory map
+        def nextArray(dtype,length):
+            nonlocal pos
+            dtype = numpy.dtype(dtype)
+            ar = bufAr[pos:pos+length*dtype.itemsize].view(dtype)
+            pos += length*dtype.itemsize
+            return ar
         
-        f.close()
+        scoresO.numEdges = numEdges
+        scoresO.endNodesIndptrAr = nextArray('<i8',numNodes+1)
+        scoresO.endNodesGn2Ar = nextArray('<u4',numEdges)
+        scoresO.endNodesEdgeAr = nextArray('<u4',numEdges)
+        for scoreType in fileScoreTypeL:
+            scoreAr = nextArray('<f8',numEdges)
+            if scoreType in scoreTypeL:
+                scoresO.scoreD[scoreType] = scoreAr
+
+        for scoreType in scoreTypeL:
+            if scoreType not in scoresO.scoreD:
+                raise ValueError("Scores file "+scoresFN+" does not contain score type "+scoreType+".")
         
-    def readScoresBinary(strainNamesT,scoreTypeL,scoresFN):
-        '''Read scores from a binary files.'''
+        return scoresO
+        
+    def readScoresBinaryV1(strainNamesT,scoreTypeL,scoresFN):
+        '''Read scores from a binary file in the original format. This has
+numEdges and the number of strain pairs as 8 byte ints, then 4 ints
+(strainNum1, strainNum2, stInd, endInd) for each strain pair, then for
+each edge g1, g2 and edge as 8 byte ints followed by each of the
+scores in scoreTypeL as 8 byte floats.'''
 
         scoresO=Score()
         f=open(scoresFN,'rb')
 
         # read first 8 bytes to get numEdges
         b = f.read(8)
-        scoresO.numEdges = int.from_bytes(b,'little')
+        numEdges = int.from_bytes(b,'little')
 
         # read next 8 bytes to get the number of strain pairs
         b = f.read(8)
@@ -359,54 +607,76 @@ form).'''
             scoresO.strainPairScoreLocationD[key] = (stInd,endInd)
             
         # initialize score arrays
+        gn1ByEdgeAr = numpy.zeros(numEdges,dtype=numpy.uint32)
+        gn2ByEdgeAr = numpy.zeros(numEdges,dtype=numpy.uint32)
         for scoreType in scoreTypeL:
-            scoresO.initializeScoreArray(scoreType)
+            scoresO.scoreD[scoreType] = numpy.zeros(numEdges,dtype=ctypes.c_double)
         
-        # loop over blocks of bytes where each block is an edge
-        for i in range(scoresO.numEdges):
-            g1 = int.from_bytes(f.read(8),'little')
-            g2 = int.from_bytes(f.read(8),'little')
-            edge = int.from_bytes(f.read(8),'little')
-            
-            scoresO.endNodesToEdgeD[(g1,g2)] = edge
-
-            # fill array
+        # read blocks of bytes where each block is an edge, a chunk at
+        # a time
+        edgeRecordDtype = getEdgeRecordDtype(scoreTypeL)
+        numRead = 0
+        while numRead < numEdges:
+            recordAr = numpy.frombuffer(f.read(min(edgeChunkSize,numEdges-numRead)*edgeRecordDtype.itemsize),dtype=edgeRecordDtype)
+            edgeAr = recordAr['edge']
+            gn1ByEdgeAr[edgeAr] = recordAr['g1']
+            gn2ByEdgeAr[edgeAr] = recordAr['g2']
             for scoreType in scoreTypeL:
-                scoresO.scoreD[scoreType][edge] = struct.unpack('<d',f.read(8))[0]
+                scoresO.scoreD[scoreType][edgeAr] = recordAr[scoreType]
+            numRead += len(recordAr)
             
         f.close()
+        scoresO.createEdgeIndex(gn1ByEdgeAr,gn2ByEdgeAr)
         return scoresO
     
     ## Below are functions that create various optional
     ## attributes. These attributes are not saved in the file format,
     ## and so must be calculated each time we intend to use them.
 
-    def createNodeConnectD(self):
-        '''Create an attribute nodeConnectD. Keys corresponds to gene. Value
-is a list of the genes which a given gene connects to. This attribute
-is not saved in our file formats. It must be recalculated before it
-will be used (e.g. in family formation).
+    def createNodeConnectArrays(self):
+        '''Create a compressed sparse row adjacency for genes, in attributes
+nodeConnectIndptrAr, nodeConnectAr and nodeConnectEdgeAr. The genes
+connected to gene g (sorted) are at positions nodeConnectIndptrAr[g]
+to nodeConnectIndptrAr[g+1] in nodeConnectAr, and the corresponding
+edges are at the same positions in nodeConnectEdgeAr. Unlike the edge
+index, every edge appears under both of its genes (self edges appear
+once). These attributes are not saved in our file formats. They must
+be recalculated before they will be used (e.g. in family formation).
         '''
-
-        self.nodeConnectD = {}
-
-        # loop over endNodesToEdgeD populating nodeConnectD
-        for gn1,gn2 in self.endNodesToEdgeD:
-            if gn1 not in self.nodeConnectD:
-                self.nodeConnectD[gn1] = [gn2]
-            else:
-                self.nodeConnectD[gn1].append(gn2)
-            if gn2 not in self.nodeConnectD:
-                self.nodeConnectD[gn2] = [gn1]
-            else:
-                self.nodeConnectD[gn2].append(gn1)
+        gn1ByEdgeAr,gn2ByEdgeAr = self.getEndNodeArrays()
+        edgeAr = numpy.arange(self.numEdges,dtype=numpy.uint32)
+        notSelfAr = gn1ByEdgeAr != gn2ByEdgeAr
+        rowAr = numpy.concatenate((gn1ByEdgeAr,gn2ByEdgeAr[notSelfAr]))
+        colAr = numpy.concatenate((gn2ByEdgeAr,gn1ByEdgeAr[notSelfAr]))
+        edgeAr = numpy.concatenate((edgeAr,edgeAr[notSelfAr]))
+        
+        numNodes = len(self.endNodesIndptrAr)-1
+        order = numpy.argsort(packGenePairs(rowAr,colAr),kind='stable')
+        self.nodeConnectIndptrAr = numpy.zeros(numNodes+1,dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(rowAr,minlength=numNodes),out=self.nodeConnectIndptrAr[1:])
+        self.nodeConnectAr = colAr[order]
+        self.nodeConnectEdgeAr = edgeAr[order]
 
     def getConnectionsGene(self,gene):
-        '''Return a list containing all the genes connected to gene.'''
-        if gene in self.nodeConnectD:
-            return self.nodeConnectD[gene]
-        else:
+        '''Return a list containing all the genes connected to gene, or None
+if it has no connections.'''
+        if gene >= len(self.nodeConnectIndptrAr)-1:
             return None
+        st = self.nodeConnectIndptrAr[gene]
+        end = self.nodeConnectIndptrAr[gene+1]
+        if st == end:
+            return None
+        return self.nodeConnectAr[st:end].tolist()
+
+    def getConnectedComponents(self):
+        '''Find the connected components of the gene graph defined by our
+edges (using the arrays from createNodeConnectArrays). Returns an array
+with a component label for each gene from 0 up to the highest gene
+with an edge.'''
+        numNodes = len(self.nodeConnectIndptrAr)-1
+        adjacencyO = csr_matrix((numpy.ones(len(self.nodeConnectAr),dtype=numpy.int8),self.nodeConnectAr,self.nodeConnectIndptrAr),shape=(numNodes,numNodes))
+        numComponents,labelAr = connected_components(adjacencyO,directed=False)
+        return labelAr
         
     def createNodeEdgeL(self,geneNamesO):
         '''Create an attribute nodeEdgeL. Index in this list corresponds to
@@ -416,31 +686,28 @@ be recalculated before it will be used.'''
 
         self.nodeEdgeL = [[] for gn in geneNamesO.iterGeneNums()]
 
-        # loop over endNodesToEdgeD populating nodeEdgeL
-        for gn1,gn2 in self.endNodesToEdgeD:
-            edge = self.endNodesToEdge(gn1,gn2)
-            self.nodeEdgeL[gn1].append(edge)
-            self.nodeEdgeL[gn2].append(edge)
+        # loop over edges populating nodeEdgeL
+        for st in range(0,self.numEdges,edgeChunkSize):
+            gn1Ar,gn2Ar,edgeAr = self.getEdgeIndexChunk(st,st+edgeChunkSize)
+            for gn1,gn2,edge in zip(gn1Ar.tolist(),gn2Ar.tolist(),edgeAr.tolist()):
+                self.nodeEdgeL[gn1].append(edge)
+                self.nodeEdgeL[gn2].append(edge)
 
     def getConnectionsEdge(self,gene):
         '''Return a list containing all the edges connected to gene.'''
         return self.nodeEdgeL[gene]
 
     def createEdgeToEndNodeL(self):
-        '''Create an attribute edgeToEndNodeL where the index is edge number,
-and the value is a tuple giving the two genes on either end of the
-edge. This attribute is not saved in our file formats. It must be
-recalculated before it will be used.
+        '''Create attributes edgeToGn1Ar and edgeToGn2Ar where the index is
+edge number, and the values give the two genes on either end of the
+edge. These attributes are not saved in our file formats. They must be
+recalculated before they will be used.
         '''
-        self.edgeToEndNodeL = [None for x in range(len(self.endNodesToEdgeD))]
-        
-        for endPairT in self.endNodesToEdgeD:
-            edge = self.endNodesToEdgeD[endPairT]
-            self.edgeToEndNodeL[edge] = endPairT
+        self.edgeToGn1Ar,self.edgeToGn2Ar = self.getEndNodeArrays()
 
     def getEndNodesByEdge(self,edge):
         '''Given and edge, return the numbers for the two genes on either end.'''
-        return self.edgeToEndNodeL[edge]
+        return int(self.edgeToGn1Ar[edge]),int(self.edgeToGn2Ar[edge])
 
     def createAabrhScoreSummaryD(self,strainNamesT,aabrhL,genesO):
         '''Given raw scores and set of all around best reciprocal hits,
@@ -490,7 +757,10 @@ class sharedScore:
 
     def __init__(self):
         '''Create an object for storing scores which will efficiently share
-memory across processes.'''
+memory across processes. Edges are found with an open addressing hash
+table. Each slot holds a gene pair packed into a uint64 key (lower
+gene in the high 32 bits) and the corresponding edge number. Collisions
+are resolved by linear probing.'''
 
         self.scoreD = {}
     
@@ -502,154 +772,124 @@ sharedScores object.
         hashArrayScaleFactor = paramD['hashArrayScaleFactor']
         
         numEdges = scoresO.numEdges
-        self.hashArrayLen = hashArrayScaleFactor * numEdges
-        
-        ## Preliminary processing
-        tempHashL=[[] for i in range(self.hashArrayLen)]
-        maxGnNum=0 # get maximum numeric value used to represent a gene
-        for gn1,gn2 in scoresO.iterateEdgesByEndNodes():
-            edge = scoresO.endNodesToEdge(gn1,gn2)
-            hs = self.hashByGenePair(gn1,gn2)
-            tempHashL[hs].append((gn1,gn2,edge))
-            
-            if max(gn1,gn2) > maxGnNum:
-                maxGnNum = max(gn1,gn2)
-            
-        # get length for collisionAr
-        collisionArLen = 0
-        maxEdgesPerHash = 0
-        for L in tempHashL:
-            L.sort() # sort on gn1
-            if len(L) > 0:
-                # add extra 1 because first block of this region will
-                # hold the length of the region
-                collisionArLen += len(L)
-            if len(L) > maxEdgesPerHash:
-                maxEdgesPerHash = len(L)
-        self.collisionArLen = collisionArLen
-                
+        # table length is a power of two at least hashArrayScaleFactor
+        # times the number of edges, always leaving one empty slot so
+        # probing terminates
+        tableLen = 2**max(1,int(max(numEdges + 1, hashArrayScaleFactor * numEdges) - 1).bit_length())
+
         ## some checks
         
-        # make sure data isn't too big. Assumes hash and gene arrays are c_uint32 (32
+        # make sure data isn't too big. Assumes edge arrays are c_uint32 (32
         # bit, unsigned)
         maxPossibleGeneOrEdgeNumber = 2**32-1
         if numEdges-1 > maxPossibleGeneOrEdgeNumber:
             raise ValueError("Error creating sharedScore object. Data set has too many score pairs for the data type we're using in our shared score arrays (c_uint32).")
 
-        if maxEdgesPerHash > 2**16:
-            raise ValueError("Error creating sharedScore object. The maximum number of score pairs per hash exceeds what lenOfRegionA can hold.")
-
-        if maxGnNum > maxPossibleGeneOrEdgeNumber:
-            raise ValueError("Error creating sharedScore object. At least one gene has been given a number too large for the array data type we are using.")
-
-
         ## create arrays
-
         rawScoreAr = RawArray(ctypes.c_double, numEdges)
-        hasEdgeAr = RawArray(ctypes.c_bool, self.hashArrayLen) # tells if any edges at given hash
-        hashAr = RawArray(ctypes.c_uint32, self.hashArrayLen) # stores index to col Ars
-        lenOfRegionAr = RawArray(ctypes.c_uint16, self.hashArrayLen) # stores length of region holding stuff from a given hash
-        colGn1Ar = RawArray(ctypes.c_uint32, self.collisionArLen)
-        colGn2Ar = RawArray(ctypes.c_uint32, self.collisionArLen)
-        colEdgeAr = RawArray(ctypes.c_uint32, self.collisionArLen)
+        keyAr = RawArray(ctypes.c_uint64, tableLen)
+        edgeAr = RawArray(ctypes.c_uint32, tableLen)
+        self.insertArrays(rawScoreAr,keyAr,edgeAr)
         
         ## fill rawScoreAr
-        for edge in scoresO.iterateEdges():
-            sc = scoresO.getScoreByEdge(edge,'rawSc')
-            rawScoreAr[edge] = sc
-
-        ## fill hash and collision Ars
-        colAr_i = 0 # index into col Ars, e.g. colGn1Ar
-        for hs in range(len(tempHashL)):
-            if tempHashL[hs] == []:
-                hasEdgeAr[hs] = False
-            else:
-                hasEdgeAr[hs] = True
-                lenOfRegionAr[hs] = len(tempHashL[hs])
-                hashAr[hs] = colAr_i
-                for gn1,gn2,edge in tempHashL[hs]:
-                    colGn1Ar[colAr_i] = gn1
-                    colGn2Ar[colAr_i] = gn2
-                    colEdgeAr[colAr_i] = edge
-                    colAr_i += 1
-
-        self.insertArrays(rawScoreAr,hasEdgeAr,hashAr,lenOfRegionAr,colGn1Ar,colGn2Ar,colEdgeAr,self.hashArrayLen)
+        self.npScoreD['rawSc'][:] = scoresO.scoreD['rawSc']
+
+        ## fill hash table
+        self.keyNpAr.fill(emptyHashKey)
+        gn1ByEdgeAr,gn2ByEdgeAr = scoresO.getEndNodeArrays()
+        keyByEdgeAr = packGenePairs(gn1ByEdgeAr,gn2ByEdgeAr)
+        slotAr = self.hashByKeyArray(keyByEdgeAr)
+        pendingAr = numpy.arange(numEdges,dtype=numpy.int64) # edges not yet placed
+
+        # insert all edges in parallel. In each round, every pending
+        # edge tries its current slot. Where several want the same
+        # empty slot, the lowest numbered edge gets it. The rest move
+        # on to the next slot.
+        while len(pendingAr) > 0:
+            candSlotAr = slotAr[pendingAr]
+            isEmptyAr = self.keyNpAr[candSlotAr] == emptyHashKey
+            uniqSlotAr,firstIndAr = numpy.unique(numpy.where(isEmptyAr,candSlotAr,-1),return_index=True)
+            firstIndAr = firstIndAr[uniqSlotAr != -1]
+            placedAr = pendingAr[firstIndAr]
+            self.keyNpAr[slotAr[placedAr]] = keyByEdgeAr[placedAr]
+            self.edgeNpAr[slotAr[placedAr]] = placedAr
+
+            placedMaskAr = numpy.zeros(len(pendingAr),dtype=bool)
+            placedMaskAr[firstIndAr] = True
+            pendingAr = pendingAr[~placedMaskAr]
+            slotAr[pendingAr] = (slotAr[pendingAr] + 1) & (tableLen - 1)
+
+    def hashByKeyArray(self,keyAr):
+        '''Given an array of packed gene pair keys, return an int64 array of
+their home slots in the table. This is multiplicative (Fibonacci)
+hashing, taking the top bits of the product.'''
+        hAr = keyAr * numpy.uint64(genePairHashMultiplier) # wraps mod 2**64
+        return (hAr >> numpy.uint64(self.hashShift)).astype(numpy.int64)
 
     def hashByGenePair(self,gn1,gn2):
-        '''Hash to an int, modulo array len.'''
-        # python hash works better than cantor pairing func
-        return hash((gn1,gn2)) % self.hashArrayLen
+        '''Return the home slot of a gene pair. Gives the same result as
+hashByKeyArray.'''
+        h = (((gn1 << 32) | gn2) * genePairHashMultiplier) & 0xFFFFFFFFFFFFFFFF
+        return h >> self.hashShift
 
-    def insertArrays(self,rawScoreAr,hasEdgeAr,hashAr,lenOfRegionAr,colGn1Ar,colGn2Ar,colEdgeAr,hashArrayLen):
+    def insertArrays(self,rawScoreAr,keyAr,edgeAr):
         '''Attach the input arrays to self.'''
         self.scoreD['rawSc'] = rawScoreAr
-        self.hasEdgeAr = hasEdgeAr
-        self.hashAr = hashAr
-        self.lenOfRegionAr = lenOfRegionAr
-        self.colGn1Ar = colGn1Ar
-        self.colGn2Ar = colGn2Ar
-        self.colEdgeAr = colEdgeAr
-        self.hashArrayLen = hashArrayLen
+        self.keyAr = keyAr
+        self.edgeAr = edgeAr
+        self.tableLen = len(keyAr)
+        self.hashShift = 64 - (self.tableLen.bit_length() - 1)
+
+        # numpy views on the same memory, for bulk lookups
+        self.npScoreD = {'rawSc':numpy.frombuffer(rawScoreAr,dtype=numpy.float64)}
+        self.keyNpAr = numpy.frombuffer(keyAr,dtype=numpy.uint64)
+        self.edgeNpAr = numpy.frombuffer(edgeAr,dtype=numpy.uint32)
 
     def returnArrays(self):
         '''Return all our arrays.'''
-        return self.scoreD['rawSc'],self.hasEdgeAr,self.hashAr,self.lenOfRegionAr,self.colGn1Ar,self.colGn2Ar,self.colEdgeAr,self.hashArrayLen
+        return self.scoreD['rawSc'],self.keyAr,self.edgeAr
         
     def endNodesToEdge(self,gn1,gn2):
         '''Given two genes, return the number of the edge between them. If
-there isn't any, return None.'''
-
-        hs = self.hashByGenePair(gn1,gn2)
+there isn't any, return None. gn1 must be the lower numbered gene.'''
 
-        if not self.hasEdgeAr[hs]:
-            # no score pairs here
-            return None
-        else:
-            # one or more gene pairs are stored in a region
-            # corresponding to this hash. check if any of them are the
-            # gene pair we're after.
-            stInd = self.hashAr[hs]
-            regionLen = self.lenOfRegionAr[hs]
-            return self.searchCollisionArrays(gn1,gn2,stInd,regionLen)
-
-    def searchCollisionArrays(self,gn1,gn2,stInd,regionLen):
-        '''Search the collision arrays for a match to gn1,gn2. If found, return index,
-    otherwise return None.
-        '''
-
-        # find the first occurence of gn1, if any
-        # The colGn1Ar is sorted in numerical order between stInd and stInd+regionLen
-        endInd = stInd + regionLen
-        searchStart = self.binarySearchGn1Array(gn1,stInd,endInd)
-        if searchStart == None:
-            return None
-
-        for i in range(searchStart,endInd):
-            if self.colGn1Ar[i] != gn1:
-                # it's no longer gn1, thus we won't find it
+        key = (gn1 << 32) | gn2
+        slot = self.hashByGenePair(gn1,gn2)
+        while True:
+            slotKey = self.keyAr[slot]
+            if slotKey == key:
+                return self.edgeAr[slot]
+            elif slotKey == emptyHashKey:
                 return None
-            elif self.colGn2Ar[i] == gn2:
-                # self.colGn1Ar[i] == gn1 since we got this far
-                return self.colEdgeAr[i]
-        return None
-        
-    def binarySearchGn1Array(self,gn1,st,end):
-        '''Find the first occurrence of gn1 in self.colGn1Ar using binary
-search. (colGn1Ar can be assumed to be sorted over the region st to
-end).
-        '''
-        while st < end:
-            mid = (st + end) // 2
-            if self.colGn1Ar[mid] < gn1:
-                st = mid + 1
-            elif self.colGn1Ar[mid] > gn1:
-                end = mid
-            elif mid > 0 and self.colGn1Ar[mid-1] == gn1:
-                end = mid
-            else:
-                return mid
-
-        return None
+            slot = (slot + 1) & (self.tableLen - 1)
+
+    def endNodesToEdgeArray(self,gn1Ar,gn2Ar):
+        '''Vectorized version of endNodesToEdge. gn1Ar must hold the lower
+numbered gene of each pair. Returns an int64 array of edge numbers,
+with -1 for pairs that have no edge.'''
+
+        keyAr = packGenePairs(gn1Ar,gn2Ar)
+        slotAr = self.hashByKeyArray(keyAr)
+
+        # first probe for every pair
+        slotKeyAr = self.keyNpAr[slotAr]
+        foundAr = slotKeyAr == keyAr
+        edgeAr = numpy.where(foundAr,self.edgeNpAr[slotAr].astype(numpy.int64),-1)
+        pendingAr = numpy.flatnonzero(~foundAr & (slotKeyAr != emptyHashKey)) # indices into keyAr
+        slotAr = slotAr[pendingAr]
+
+        # continue probing the rest in parallel, dropping each one once
+        # we hit its key or an empty slot. Probe sequences are short,
+        # so this loop runs only a few times.
+        while len(pendingAr) > 0:
+            slotAr = (slotAr + 1) & (self.tableLen - 1)
+            slotKeyAr = self.keyNpAr[slotAr]
+            foundAr = slotKeyAr == keyAr[pendingAr]
+            edgeAr[pendingAr[foundAr]] = self.edgeNpAr[slotAr[foundAr]]
+            continueAr = ~foundAr & (slotKeyAr != emptyHashKey)
+            pendingAr = pendingAr[continueAr]
+            slotAr = slotAr[continueAr]
+        return edgeAr
 
     def getScoreByEdge(self,edge,scoreType):
         '''Given an edge get the score corresponding to scoreType.'''
@@ -664,3 +904,16 @@ end).
             return None
         else:
             return self.getScoreByEdge(edge,scoreType)
+
+    def getScoreByEndNodesArray(self,gn1Ar,gn2Ar,scoreType):
+        '''Vectorized version of getScoreByEndNodes. Returns a float array
+of scores, with nan for pairs that have no edge.'''
+        gn1Ar = numpy.asarray(gn1Ar,dtype=numpy.uint32)
+        gn2Ar = numpy.asarray(gn2Ar,dtype=numpy.uint32)
+        lowAr = numpy.minimum(gn1Ar,gn2Ar) # make sure lower gene num is first
+        highAr = numpy.maximum(gn1Ar,gn2Ar)
+        edgeAr = self.endNodesToEdgeArray(lowAr,highAr)
+        scAr = numpy.full(len(edgeAr),numpy.nan)
+        presentAr = edgeAr != -1
+        scAr[presentAr] = self.npScoreD[scoreType][edgeAr[presentAr]]
+        return scAr
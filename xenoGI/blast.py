@@ -1,11 +1,21 @@
-import sys, os, subprocess, glob
+import sys, os, subprocess, glob, numpy, warnings, hashlib, shutil
 from . import trees
 from multiprocessing import Pool
 from Bio import Phylo
 
 def runBlast(dbFileL_1,dbFileL_2,paramD):
     '''Run blast comparing every database in dbFileL_1 against every
-database in dbFileL_2.
+database in dbFileL_2. Each comparison is first written to a temporary
+file, which is renamed to the output file once blast has succeeded,
+and the comparison is then recorded in the completed pairs file in the
+blast directory. Comparisons already recorded there (with the same
+fasta files and blast command line) are skipped. Query files with more
+than blastQueryChunkSize proteins are split into chunks which are run
+as separate jobs. Jobs are run largest first, and failed jobs are
+retried up to blastNumRetries times. If blastCombinedDb is True, each
+query is run once against a database combining everything in
+dbFileL_2, and the output is then split into per pair files (see
+runBlastCombinedDb).
     '''
 
     # if directory for blast doesn't exist yet, make it
@@ -13,20 +23,42 @@ database in dbFileL_2.
     if glob.glob(blastDir)==[]:
         os.mkdir(blastDir)
 
-    clineL =  makeBlastClineList(dbFileL_1,dbFileL_2,paramD)
+    backendO = getSearchBackend(paramD)
+    blastCLineT = backendO.getCLineT(paramD['evalueThresh'])
+    if paramD['blastCombinedDb']:
+        signatureCLineT = blastCLineT + ('combinedDb',)
+    else:
+        signatureCLineT = blastCLineT
+    pairL = makeBlastPairL(dbFileL_1,dbFileL_2,paramD)
+    completedD = readCompletedPairs(blastDir,pairL,signatureCLineT)
+    pairL = [pairT for pairT in pairL if completedD.get(os.path.split(pairT[2])[-1]) != pairSignature(pairT,signatureCLineT)]
 
-    if clineL != []:
+    if pairL != []:
         # we need to run some
-        
-        # format the databases
-        uniqueDbL=list(set(dbFileL_1+dbFileL_2))
-        formatDb(uniqueDbL,paramD['blastExecutDirPath'])
+        chunkDir = os.path.join(blastDir,blastQueryChunkDirName)
+        queryChunkD = makeQueryChunks(set(query for query,db,outFN in pairL),paramD['blastQueryChunkSize'],chunkDir)
+
+        completedFN = os.path.join(blastDir,completedBlastPairsFN)
+        with open(completedFN,'a') as completedF:
+            if paramD['blastCombinedDb']:
+                runBlastCombinedDb(pairL,dbFileL_2,queryChunkD,blastDir,backendO,signatureCLineT,completedF,paramD)
+            else:
+                # format the databases
+                uniqueDbL=list(set(db for query,db,outFN in pairL))
+                backendO.formatDb(uniqueDbL)
+
+                jobL = makeBlastJobL(pairL,queryChunkD,backendO,blastCLineT,paramD['blastNumThreads'])
+                finishGroup = lambda pairIndex,numChunks: finishBlastPair(pairL[pairIndex],numChunks,signatureCLineT,completedF)
+                runBlastJobs(jobL,len(pairL),finishGroup,paramD)
 
-        with Pool(processes=paramD['numProcesses']) as p:
-            for stderr in p.imap_unordered(subprocessWrapper, clineL):
-                pass # ignore stderr
+        # chunks are only needed while blast runs
+        for chunkL in queryChunkD.values():
+            if len(chunkL) > 1:
+                for chunkFN in chunkL:
+                    os.remove(chunkFN)
+        if os.path.isdir(chunkDir) and os.listdir(chunkDir) == []:
+            os.rmdir(chunkDir)
 
-            
 def getDbFileL(fastaFilePath,strainNamesT):
     '''Obtains and returns a list of all fasta files that should be run
 through blast. Only keeps those that are in stainNamesT.
@@ -42,68 +74,140 @@ through blast. Only keeps those that are in stainNamesT.
                 dbFileL.append(dbFile)
     return dbFileL
     
-def formatDb(dbFileL,blastExecutDirPath):
-    '''Format fasta files in fastaDir for blast by calling the formatdb
-executable.'''
-    for dbFileName in dbFileL:
-        makeblastdbExecutable = os.path.join(blastExecutDirPath,'makeblastdb')
-        subprocess.call([makeblastdbExecutable, '-dbtype' ,'prot', '-in', dbFileName],stdout=subprocess.PIPE)
-    return
-
-def makeBlastClineList(dbFileL_1, dbFileL_2,paramD):
-    '''Create a list of lists, where the sublists have the command line
-needed to run blastp on a pair of databases.'''
+def makeBlastPairL(dbFileL_1,dbFileL_2,paramD):
+    '''Create a list of (query,db,outFN) tuples, one for each pair of
+databases to compare.'''
 
     blastFilePath = paramD['blastFilePath']
-    blastExecutDirPath = paramD['blastExecutDirPath']
     blastFileJoinStr = paramD['blastFileJoinStr']
     
-    # catch blast clines from old params files which don't have
-    # trailing whitespace (can get rid of this eventually).
-    if paramD['blastCLine'][-1] != ' ':
-        blastCLine = paramD['blastCLine'] + ' ' + str(paramD['evalueThresh'])
-    else:
-        blastCLine = paramD['blastCLine'] + str(paramD['evalueThresh'])
-
-    # get a tuple of the blastp command line args for use below
-    blastCLineL = processCline(blastCLine)
-    blastCLineL[0] = os.path.join(blastExecutDirPath,blastCLineL[0])
-    blastCLineT = tuple(blastCLineL)
-
     # get blast file dir and extension
     splitT = os.path.split(blastFilePath)
     blastDir,rest = splitT
     blastExtension = rest.split("*")[-1]
 
-    # check if fasta files modified more recently than blast files
-    shouldBlast = determineShouldBlast(dbFileL_1[0],dbFileL_2[0],blastFilePath,blastFileJoinStr)
-
-    clineL=[]
+    pairL=[]
     for query in dbFileL_1:
         for db in dbFileL_2:
+            outFN = os.path.join( blastDir, fastaStem(query) + blastFileJoinStr + fastaStem(db) + blastExtension )
+            pairL.append((query,db,outFN))
+    return pairL
 
-            # split of paths and extensions
-            qstem = os.path.split(query)[-1]
-            if "_prot.fa" in qstem:
-                qstem = qstem.split("_prot.fa")[0]
-            else:
-                # just remove extension
-                qstem = os.path.splitext(qstem)[0]
-                
-            dbstem = os.path.split(db)[-1]
-            if "_prot.fa" in dbstem:
-                dbstem = dbstem.split("_prot.fa")[0]
-            else:
-                dbstem = os.path.splitext(dbstem)[0]
-                
-            outFN = os.path.join( blastDir, qstem + blastFileJoinStr + dbstem + blastExtension )
-                
-            # only add to list if this blast file doesn't already exist
-            if not os.path.isfile(outFN) or shouldBlast:
-                L = list(blastCLineT) + ['-query',query,'-db',db,'-out',outFN]
-                clineL.append(L)
-                    
-    return clineL
+def fastaStem(fastaFN):
+    '''Strip the path and the _prot.fa ending (or just the extension if
+there isn't one) from a fasta file name.'''
+    stem = os.path.split(fastaFN)[-1]
+    if "_prot.fa" in stem:
+        return stem.split("_prot.fa")[0]
+    else:
+        # just remove extension
+        return os.path.splitext(stem)[0]
+
+## Search backends
+
+# Each backend knows how to format databases and build command lines
+# for one search program. Whatever the program, the output must be
+# tabular with the eleven columns parseBlastLines expects (qseqid
+# sseqid evalue qlen qstart qend slen sstart send pident score).
+
+class ncbiBackend:
+    '''Search with NCBI blastp, using blastCLine and
+blastExecutDirPath.'''
+    
+    maxTargetSeqsOption = '-max_target_seqs'
+    defaultMaxTargetSeqs = 500
+    
+    def __init__(self,paramD):
+        self.executDirPath = paramD['blastExecutDirPath']
+        self.cLine = paramD['blastCLine']
+
+    def formatDb(self,dbFileL):
+        '''Format fasta files for blast by calling the makeblastdb
+executable.'''
+        for dbFileName in dbFileL:
+            makeblastdbExecutable = os.path.join(self.executDirPath,'makeblastdb')
+            runFormatDb([makeblastdbExecutable, '-dbtype' ,'prot', '-in', dbFileName],dbFileName)
+
+    def formattedDbFNL(self,dbFileName):
+        '''Return a list of the files made by formatting dbFileName (empty
+if it hasn't been formatted).'''
+        return glob.glob(dbFileName+'.*')
+
+    def getCLineT(self,evalueThresh):
+        '''Return a tuple with the blastp command line arguments (except
+query, db, out and threads), with evalueThresh as the e-value cutoff.'''
+    
+        # catch blast clines from old params files which don't have
+        # trailing whitespace (can get rid of this eventually).
+        if self.cLine[-1] != ' ':
+            blastCLine = self.cLine + ' ' + str(evalueThresh)
+        else:
+            blastCLine = self.cLine + str(evalueThresh)
+
+        # get a tuple of the blastp command line args for use below
+        blastCLineL = processCline(blastCLine)
+        blastCLineL[0] = os.path.join(self.executDirPath,blastCLineL[0])
+        return tuple(blastCLineL)
+
+    def jobCLine(self,cLineT,query,db,outFN,numThreads):
+        '''Return the full command line to search query against db (a
+fasta file which has been formatted), writing to outFN.'''
+        if numThreads > 1:
+            threadL = ['-num_threads',str(numThreads)]
+        else:
+            threadL = []
+        return list(cLineT) + threadL + ['-query',query,'-db',db,'-out',outFN]
+
+class diamondBackend:
+    '''Search with DIAMOND blastp, using diamondPath and
+diamondCLine. This is much faster than NCBI blastp on large data sets,
+and in its sensitive modes finds nearly the same hits.'''
+
+    maxTargetSeqsOption = '--max-target-seqs'
+    defaultMaxTargetSeqs = 25
+    
+    def __init__(self,paramD):
+        self.executPath = paramD['diamondPath']
+        self.cLine = paramD['diamondCLine']
+
+    def formatDb(self,dbFileL):
+        '''Make a DIAMOND database (fasta file name + .dmnd) for each
+fasta file.'''
+        for dbFileName in dbFileL:
+            runFormatDb([self.executPath,'makedb','--in',dbFileName,'--db',dbFileName],dbFileName)
+
+    def formattedDbFNL(self,dbFileName):
+        '''Return a list of the files made by formatting dbFileName (empty
+if it hasn't been formatted).'''
+        return glob.glob(dbFileName+'.dmnd')
+
+    def getCLineT(self,evalueThresh):
+        '''Return a tuple with the diamond command line arguments (except
+query, db, out and threads), with evalueThresh as the e-value
+cutoff.'''
+        return tuple([self.executPath] + self.cLine.split() + ['--evalue',str(evalueThresh)])
+
+    def jobCLine(self,cLineT,query,db,outFN,numThreads):
+        '''Return the full command line to search query against db (a
+fasta file which has been formatted), writing to outFN.'''
+        return list(cLineT) + ['--threads',str(numThreads),'--query',query,'--db',db+'.dmnd','--out',outFN]
+
+def runFormatDb(cline,dbFileName):
+    '''Run cline, which formats dbFileName. If it fails, raise an
+exception giving its error output.'''
+    pipes=subprocess.Popen(cline, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = pipes.communicate()
+    if pipes.returncode != 0:
+        raise Exception("Formatting the database "+dbFileName+" failed:\n"+" ".join(cline)+"\n"+stderr.decode(errors='replace'))
+
+searchBackendD = {'ncbi':ncbiBackend,'diamond':diamondBackend}
+
+def getSearchBackend(paramD):
+    '''Return a search backend object of the type given by
+paramD['searchBackend'].'''
+    if paramD['searchBackend'] not in searchBackendD:
+        raise ValueError("Unknown searchBackend "+str(paramD['searchBackend'])+". It should be one of: "+", ".join(searchBackendD)+".")
+    return searchBackendD[paramD['searchBackend']](paramD)
 
 def processCline(cline):
     '''Process the command line parameter so that the output format
@@ -113,83 +217,502 @@ section can be passed in to subprocess as a unit.
     L = cline.split('"') # " make emacs happy.
     return L[0].split() + [L[1]] + L[2].split()
     
-def determineShouldBlast(dbFile1,dbFile2,blastFilePath,blastFileJoinStr):
-    '''Compare a blast and a fasta file. If the fasta file was edited
-    more recently, return True, otherwise False.
-    '''
+## Scheduling blast jobs
 
-    dbStem1 = os.path.split(dbFile1)[-1]
-    dbStem1 = dbStem1.split("_prot.fa")[0] 
+# name of the file in the blast directory where we record completed
+# comparisons, and of the directory for query chunks
+completedBlastPairsFN = 'completedPairs.txt'
+blastQueryChunkDirName = 'queryChunks'
 
-    dbStem2 = os.path.split(dbFile2)[-1]
-    dbStem2 = dbStem2.split("_prot.fa")[0] 
+def pairSignature(pairT,blastCLineT):
+    '''Return a string identifying the inputs of a comparison: the size
+and modification time of the query and db fasta files, and a hash of
+the blast command line.'''
+    query,db,outFN = pairT
+    qStatO = os.stat(query)
+    dbStatO = os.stat(db)
+    clineHash = hashlib.md5(repr(blastCLineT).encode()).hexdigest()
+    return ",".join(map(str,[qStatO.st_size,qStatO.st_mtime_ns,dbStatO.st_size,dbStatO.st_mtime_ns,clineHash]))
 
-    # get dirs and extensions
-    blastDir,rest = os.path.split(blastFilePath)
-    blastExtension = rest.split("*")[-1]
+def readCompletedPairs(blastDir,pairL,blastCLineT):
+    '''Read the completed pairs file in blastDir, returning a dict keyed
+by output file name (without path) with the signature of the inputs it
+was made from. Later lines override earlier ones. If there is no such
+file yet (e.g. the blast files were made by an older version), we
+create it, taking any existing output file newer than its fasta files
+to be complete.'''
+    completedFN = os.path.join(blastDir,completedBlastPairsFN)
+    completedD = {}
+    if os.path.isfile(completedFN):
+        with open(completedFN,'r') as f:
+            for s in f:
+                L = s.rstrip("\n").split("\t")
+                if len(L) == 2:
+                    completedD[L[0]] = L[1]
+        # a pair whose output file is gone must be rerun
+        for pairT in pairL:
+            if not os.path.isfile(pairT[2]):
+                completedD.pop(os.path.split(pairT[2])[-1],None)
+    else:
+        with open(completedFN,'w') as f:
+            for pairT in pairL:
+                query,db,outFN = pairT
+                if os.path.isfile(outFN) and os.path.getmtime(outFN) > max(os.path.getmtime(query),os.path.getmtime(db)):
+                    signature = pairSignature(pairT,blastCLineT)
+                    completedD[os.path.split(outFN)[-1]] = signature
+                    f.write(os.path.split(outFN)[-1]+"\t"+signature+"\n")
+    return completedD
+
+def makeQueryChunks(queryS,blastQueryChunkSize,chunkDir):
+    '''For each query fasta in queryS with more than blastQueryChunkSize
+sequences, split it into chunk files in chunkDir. Returns a dict keyed
+by query file, with a list of the files to use as queries in its
+place. Queries that aren't split map to a list containing only
+themselves. If blastQueryChunkSize is None, we don't split.'''
+    queryChunkD = {}
+    for query in sorted(queryS):
+        queryChunkD[query] = [query]
+        if blastQueryChunkSize == None:
+            continue
+        with open(query,'r') as f:
+            numSeqs = sum(1 for s in f if s.startswith('>'))
+        if numSeqs <= blastQueryChunkSize:
+            continue
 
-    fastaFN = dbFile1
-    blastFN = os.path.join(blastDir, dbStem1 + blastFileJoinStr + dbStem2 + blastExtension )
+        if not os.path.isdir(chunkDir):
+            os.makedirs(chunkDir)
+        chunkL = []
+        chunkF = None
+        seqCount = 0
+        with open(query,'r') as f:
+            for s in f:
+                if s.startswith('>'):
+                    if seqCount % blastQueryChunkSize == 0:
+                        if chunkF != None:
+                            chunkF.close()
+                        chunkFN = os.path.join(chunkDir,fastaStem(query)+"_chunk"+str(len(chunkL))+".fa")
+                        chunkL.append(chunkFN)
+                        chunkF = open(chunkFN,'w')
+                    seqCount += 1
+                chunkF.write(s)
+        chunkF.close()
+        queryChunkD[query] = chunkL
+    return queryChunkD
 
-    if not os.path.isfile(blastFN):
-        # hasn't been run, return True
-        return True
+def makeBlastJobL(pairL,queryChunkD,backendO,cLineT,numThreads):
+    '''Create a list of blast jobs from pairL. Each job is a tuple
+(cost,pairIndex,chunkNum,cline). The command line writes to a
+temporary file. Cost is the product of the query and db file sizes,
+and the list is sorted with the most costly first, so the big jobs
+don't end up running alone at the end.'''
+    jobL = []
+    for pairIndex,(query,db,outFN) in enumerate(pairL):
+        chunkL = queryChunkD[query]
+        dbSize = os.path.getsize(db)
+        for chunkNum,chunkFN in enumerate(chunkL):
+            tempOutFN = blastJobTempFN(outFN,chunkNum,len(chunkL))
+            cline = backendO.jobCLine(cLineT,chunkFN,db,tempOutFN,numThreads)
+            jobL.append((os.path.getsize(chunkFN)*dbSize,pairIndex,chunkNum,cline))
+    jobL.sort(key=lambda jobT: jobT[0],reverse=True)
+    return jobL
+
+def blastJobTempFN(outFN,chunkNum,numChunks):
+    '''Return the temporary output file for a blast job. These end in
+.tmp, so they don't match blastFilePath.'''
+    if numChunks == 1:
+        return outFN + '.tmp'
     else:
-        # times
-        fastaModTime = os.path.getmtime(fastaFN)
-        blastModTime = os.path.getmtime(blastFN)
+        return outFN + '.' + str(chunkNum) + '.tmp'
 
-        if fastaModTime < blastModTime:
-            return False
-        else:
-            return True
+def runBlastJobs(jobL,numGroups,finishGroup,paramD):
+    '''Run the jobs in jobL in parallel. Each job is a tuple
+(cost,groupIndex,chunkNum,cline), where a group is the set of chunks
+making up one comparison (or one query, in combined database
+mode). When all the chunks of a group are done, we call
+finishGroup(groupIndex,numChunks), which moves the output into place
+and records it, so an interrupted run only loses the groups in
+progress. Failed jobs are retried up to blastNumRetries times, after
+which we raise an exception giving blast's error output.'''
+    
+    numChunksL = [0]*numGroups
+    for cost,groupIndex,chunkNum,cline in jobL:
+        numChunksL[groupIndex] += 1
+    remainingChunksL = list(numChunksL)
+
+    numProcesses = max(1,paramD['numProcesses'] // paramD['blastNumThreads'])
+    with Pool(processes=numProcesses) as p:
+        for attempt in range(paramD['blastNumRetries']+1):
+            failedJobL = []
+            for jobT,returnCode,stderr in p.imap_unordered(runBlastJob,jobL):
+                if returnCode != 0:
+                    failedJobL.append((jobT,stderr))
+                    continue
+                cost,groupIndex,chunkNum,cline = jobT
+                remainingChunksL[groupIndex] -= 1
+                if remainingChunksL[groupIndex] == 0:
+                    finishGroup(groupIndex,numChunksL[groupIndex])
+            if failedJobL == []:
+                return
+            # retry in the same (largest first) order
+            jobL = sorted((jobT for jobT,stderr in failedJobL),key=lambda jobT: jobT[0],reverse=True)
+
+    errorStrL = [" ".join(jobT[3])+"\n"+stderr.decode(errors='replace') for jobT,stderr in failedJobL]
+    raise Exception("Blast failed on "+str(len(failedJobL))+" job(s) after "+str(paramD['blastNumRetries']+1)+" attempts:\n"+"\n".join(errorStrL))
 
-def subprocessWrapper(cline):
-    '''A wraper within which we call subprocess. Becasue we're having
-blast write to file, we dump std_out. return std_err.'''
+def runBlastJob(jobT):
+    '''Run a single blast job. Returns jobT, the return code and stderr.'''
+    cline = jobT[3]
     pipes=subprocess.Popen(cline, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     stdout, stderr = pipes.communicate()
-    return stderr
+    return jobT,pipes.returncode,stderr
+
+def finishBlastPair(pairT,numChunks,blastCLineT,completedF):
+    '''Move the temporary output of a pair into place and record it in
+completedF.'''
+    query,db,outFN = pairT
+    pairTempFN = outFN + '.tmp'
+    if numChunks > 1:
+        with open(pairTempFN,'wb') as outF:
+            for chunkNum in range(numChunks):
+                chunkTempFN = blastJobTempFN(outFN,chunkNum,numChunks)
+                with open(chunkTempFN,'rb') as chunkF:
+                    shutil.copyfileobj(chunkF,outF)
+                os.remove(chunkTempFN)
+    os.replace(pairTempFN,outFN)
+    completedF.write(os.path.split(outFN)[-1]+"\t"+pairSignature(pairT,blastCLineT)+"\n")
+    completedF.flush()
+
+## Combined database mode
+
+# name of the directory in the blast directory where we put the
+# combined database
+blastCombinedDbDirName = 'combinedDb'
+
+def runBlastCombinedDb(pairL,dbFileL,queryChunkD,blastDir,backendO,signatureCLineT,completedF,paramD):
+    '''Run the comparisons in pairL by blasting each query (or query
+chunk) once against a single database made by concatenating the files
+in dbFileL. This saves launching a separate blastp, and loading a
+separate database, for every pair. The output for each query is then
+split into per pair files, which are moved into place and recorded in
+completedF.
+
+Blast e-values depend on the size of the database searched. To
+approximate the values we'd get searching each db separately, we run
+with a looser e-value cutoff and then scale each hit's e-value by the
+fraction of the combined database's residues which come from the
+subject's db, applying evalueThresh afterwards. This ignores blast's
+length adjustment to the search space, so e-values near the threshold
+can differ slightly from those of a per pair search. Similarly, the
+max_target_seqs limit is multiplied by the number of dbs, so each
+subject db can still contribute about as many hits as before. Hits can
+also differ at the margins because of blast's heuristics.
+
+The combined database is kept between runs, and only rebuilt and
+reformatted if it is older than any of the files in dbFileL.
+    '''
+    combinedDbFN,geneToDbD,residueCountL,isRebuilt = makeCombinedDb(dbFileL,os.path.join(blastDir,blastCombinedDbDirName))
+    formattedDbFNL = backendO.formattedDbFNL(combinedDbFN)
+    if isRebuilt or formattedDbFNL == [] or min(os.path.getmtime(fn) for fn in formattedDbFNL) < os.path.getmtime(combinedDbFN):
+        backendO.formatDb([combinedDbFN])
+    totalResidues = sum(residueCountL)
+
+    # e-value cutoff such that the hits to even the smallest db which
+    # pass evalueThresh after scaling are kept
+    combinedEvalueThresh = paramD['evalueThresh'] * totalResidues / max(1,min(residueCountL))
+    cLineL = list(backendO.getCLineT(combinedEvalueThresh))
+    if backendO.maxTargetSeqsOption in cLineL:
+        ind = cLineL.index(backendO.maxTargetSeqsOption) + 1
+        cLineL[ind] = str(int(cLineL[ind]) * len(dbFileL))
+    else:
+        cLineL += [backendO.maxTargetSeqsOption,str(backendO.defaultMaxTargetSeqs * len(dbFileL))]
+
+    # group the pairs by query
+    queryL = sorted(set(query for query,db,outFN in pairL))
+    queryPairLD = {query:[] for query in queryL}
+    for pairT in pairL:
+        queryPairLD[pairT[0]].append(pairT)
+
+    jobL = []
+    for queryIndex,query in enumerate(queryL):
+        chunkL = queryChunkD[query]
+        groupOutFN = combinedDbGroupOutFN(query,blastDir)
+        for chunkNum,chunkFN in enumerate(chunkL):
+            tempOutFN = blastJobTempFN(groupOutFN,chunkNum,len(chunkL))
+            cline = backendO.jobCLine(cLineL,chunkFN,combinedDbFN,tempOutFN,paramD['blastNumThreads'])
+            jobL.append((os.path.getsize(chunkFN),queryIndex,chunkNum,cline))
+    jobL.sort(key=lambda jobT: jobT[0],reverse=True)
+
+    dbIndexD = {db:dbIndex for dbIndex,db in enumerate(dbFileL)}
+    evalueScaleL = [residueCount / totalResidues for residueCount in residueCountL]
+    def finishGroup(queryIndex,numChunks):
+        query = queryL[queryIndex]
+        groupOutFN = combinedDbGroupOutFN(query,blastDir)
+        chunkOutL = [blastJobTempFN(groupOutFN,chunkNum,numChunks) for chunkNum in range(numChunks)]
+        splitCombinedDbOutput(chunkOutL,queryPairLD[query],dbIndexD,geneToDbD,combinedDbFN,evalueScaleL,paramD['evalueThresh'])
+        for pairT in queryPairLD[query]:
+            os.replace(pairT[2]+'.tmp',pairT[2])
+            completedF.write(os.path.split(pairT[2])[-1]+"\t"+pairSignature(pairT,signatureCLineT)+"\n")
+        completedF.flush()
+        for chunkOutFN in chunkOutL:
+            os.remove(chunkOutFN)
+
+    runBlastJobs(jobL,len(queryL),finishGroup,paramD)
+
+# max number of bytes of output held in memory while splitting the
+# output of one query
+splitBufferBytes = 2**26
+
+def combinedDbGroupOutFN(query,blastDir):
+    '''Return the name (before adding chunk and .tmp endings) for the
+output of query against the combined database.'''
+    return os.path.join(blastDir,fastaStem(query)+'_combinedDb')
+
+def makeCombinedDb(dbFileL,combinedDbDir):
+    '''Concatenate the fasta files in dbFileL into a single file in
+combinedDbDir. Returns the name of that file, a dict mapping each
+sequence id (the first word of the header, which is what blast reports
+as sseqid) to the index of its db in dbFileL, a list with the number
+of residues in each db, and a boolean which is True if the file was
+(re)written. If there is already a combined file made from the same
+list of dbs, which is newer than all of them, we leave it as is.'''
+    if not os.path.isdir(combinedDbDir):
+        os.makedirs(combinedDbDir)
+    combinedDbFN = os.path.join(combinedDbDir,'combined_prot.fa')
+    # records the dbs combinedDbFN was made from. Written last, so
+    # its presence means combinedDbFN is complete.
+    dbListFN = os.path.join(combinedDbDir,'combined_prot.dbs')
+    dbListStr = "".join(db+"\n" for db in dbFileL)
+
+    isRebuilt = not isCombinedDbCurrent(combinedDbFN,dbListFN,dbListStr,dbFileL)
+    if isRebuilt:
+        if os.path.isfile(dbListFN):
+            os.remove(dbListFN)
+        outF = open(combinedDbFN,'w')
+
+    geneToDbD = {}
+    residueCountL = []
+    for dbIndex,db in enumerate(dbFileL):
+        residueCount = 0
+        with open(db,'r') as f:
+            for s in f:
+                if s.startswith('>'):
+                    geneToDbD[s[1:].split()[0]] = dbIndex
+                else:
+                    residueCount += len(s.strip())
+                if isRebuilt:
+                    outF.write(s)
+        residueCountL.append(residueCount)
+
+    if isRebuilt:
+        outF.close()
+        with open(dbListFN,'w') as f:
+            f.write(dbListStr)
+    return combinedDbFN,geneToDbD,residueCountL,isRebuilt
+
+def isCombinedDbCurrent(combinedDbFN,dbListFN,dbListStr,dbFileL):
+    '''Return True if combinedDbFN was made from the dbs in dbFileL (as
+recorded in dbListFN) and is newer than all of them.'''
+    if not os.path.isfile(combinedDbFN) or not os.path.isfile(dbListFN):
+        return False
+    with open(dbListFN,'r') as f:
+        if f.read() != dbListStr:
+            return False
+    combinedMtime = os.path.getmtime(combinedDbFN)
+    return all(os.path.getmtime(db) < combinedMtime for db in dbFileL)
+
+def splitCombinedDbOutput(chunkOutL,pairL,dbIndexD,geneToDbD,combinedDbFN,evalueScaleL,evalueThresh):
+    '''Read the output files in chunkOutL (the results of one query
+against the combined database), and write each hit to the temporary
+output file (outFN + .tmp) of the pair for its subject's db, rescaling
+the e-value and dropping hits which no longer pass evalueThresh. Hits
+to dbs not in pairL are dropped. Raises ValueError if a hit's subject
+isn't in geneToDbD (the sequences in combinedDbFN).'''
+    tempOutFND = {dbIndexD[db]:outFN+'.tmp' for query,db,outFN in pairL}
+    for tempOutFN in tempOutFND.values():
+        open(tempOutFN,'w').close()
+
+    bufferLD = {dbIndex:[] for dbIndex in tempOutFND}
+    bufferBytes = 0
+    for chunkOutFN in chunkOutL:
+        with open(chunkOutFN,'r') as f:
+            for s in f:
+                L = s.split('\t')
+                if L[1] not in geneToDbD:
+                    raise ValueError("The subject "+L[1]+" in "+chunkOutFN+" isn't in the combined database "+combinedDbFN+". It may be out of date.")
+                dbIndex = geneToDbD[L[1]]
+                if dbIndex not in bufferLD:
+                    continue
+                evalue = float(L[2]) * evalueScaleL[dbIndex]
+                if evalue > evalueThresh:
+                    continue
+                L[2] = "0.0" if evalue == 0 else "%.2e" % evalue
+                s = "\t".join(L)
+                bufferLD[dbIndex].append(s)
+                bufferBytes += len(s)
+                if bufferBytes > splitBufferBytes:
+                    flushSplitBuffers(bufferLD,tempOutFND)
+                    bufferBytes = 0
+    flushSplitBuffers(bufferLD,tempOutFND)
+
+def flushSplitBuffers(bufferLD,tempOutFND):
+    '''Append the lines in bufferLD to the corresponding files, and
+empty the buffers.'''
+    for dbIndex,lineL in bufferLD.items():
+        if lineL != []:
+            with open(tempOutFND[dbIndex],'a') as f:
+                f.writelines(lineL)
+            lineL.clear()
+
+## Parsing blast output
+
+# Fields in the structured arrays produced by the blast parsers. The
+# first eleven correspond to the columns of our custom outfmt 6
+# (qseqid sseqid evalue qlen qstart qend slen sstart send pident
+# score), with the gene names reduced to their numeric prefix. alCov
+# is computed from the alignment coordinates.
+blastHitFieldL = [('queryGene','<i8'),('subjectGene','<i8'),('evalue','<f8'),('qlen','<i4'),('qstart','<i4'),('qend','<i4'),('slen','<i4'),('sstart','<i4'),('send','<i4'),('pident','<f8'),('score','<i4'),('alCov','<f8')]
+blastHitDtype = numpy.dtype(blastHitFieldL)
+
+# change if blastHitDtype or the hit cache layout changes
+blastHitCacheVersion = 1
 
 def parseBlastFile(blastFN,evalueThresh,alignCoverThresh,percIdentThresh):
     '''Parse a single blast output file, returning all hits as a list of
 tuples. alignCoverThresh is a threshold for the length of the
 alignment relative to query and subject length. The files have the
 following fields (our custom output) qseqid sseqid evalue qlen qstart
-qend slen sstart send.
+qend slen sstart send. This is a wrapper around
+parseBlastFileArrays, kept for callers that want tuples.
+    '''
+    hitsAr = parseBlastFileArrays(blastFN,evalueThresh,alignCoverThresh,percIdentThresh)
+    return blastHitArrayToTupleL(hitsAr)
+
+def blastHitArrayToTupleL(hitsAr):
+    '''Convert a structured array of blast hits into a list of tuples
+(queryGene,subjectGene,evalue,alCov,pident,score), with python
+types.'''
+    return list(zip(hitsAr['queryGene'].tolist(),hitsAr['subjectGene'].tolist(),hitsAr['evalue'].tolist(),hitsAr['alCov'].tolist(),hitsAr['pident'].tolist(),hitsAr['score'].tolist()))
+
+def loadBlastHits(blastFN,evalueThresh,alignCoverThresh,percIdentThresh,hitCacheDir=None):
+    '''Return the hits from blastFN which pass the thresholds as a
+structured array (see parseBlastFileArrays). If hitCacheDir is given,
+first look there for a binary copy of these hits made from the current
+version of blastFN with the same thresholds. If there isn't one, parse
+the blast file and save the result for next time.
+    '''
+    if hitCacheDir == None:
+        return parseBlastFileArrays(blastFN,evalueThresh,alignCoverThresh,percIdentThresh)
+    
+    cacheFN = os.path.join(hitCacheDir,os.path.split(blastFN)[-1]+'.npz')
+    statAr,threshAr = getBlastHitCacheKey(blastFN,evalueThresh,alignCoverThresh,percIdentThresh)
+    hitsAr = readBlastHitCache(cacheFN,statAr,threshAr)
+    if hitsAr is None:
+        hitsAr = parseBlastFileArrays(blastFN,evalueThresh,alignCoverThresh,percIdentThresh)
+        writeBlastHitCache(cacheFN,statAr,threshAr,hitsAr,hitCacheDir)
+    return hitsAr
+
+def getBlastHitCacheKey(blastFN,evalueThresh,alignCoverThresh,percIdentThresh):
+    '''Return the arrays that identify a hit cache file: one with the
+cache format version and the size and modification time of blastFN,
+and another with the thresholds.'''
+    statO = os.stat(blastFN)
+    statAr = numpy.array([blastHitCacheVersion,statO.st_size,statO.st_mtime_ns],dtype=numpy.int64)
+    threshAr = numpy.array([evalueThresh,alignCoverThresh,percIdentThresh],dtype=numpy.float64)
+    return statAr,threshAr
+
+def readBlastHitCache(cacheFN,statAr,threshAr):
+    '''Load hits from cacheFN if it exists and matches statAr and
+threshAr. Otherwise return None.'''
+    if not os.path.isfile(cacheFN):
+        return None
+    try:
+        with numpy.load(cacheFN) as npzO:
+            if numpy.array_equal(npzO['statAr'],statAr) and numpy.array_equal(npzO['threshAr'],threshAr):
+                return npzO['hitsAr']
+    except (OSError,ValueError,KeyError):
+        # damaged or from an incompatible version, just reparse
+        pass
+    return None
+
+def writeBlastHitCache(cacheFN,statAr,threshAr,hitsAr,hitCacheDir):
+    '''Save hitsAr to cacheFN along with the key arrays. Writes to a
+temporary file first so that an interrupted write is never mistaken
+for a valid cache. Hits with non-numeric gene names are not cached.'''
+    if hitsAr.dtype != blastHitDtype:
+        return
+    os.makedirs(hitCacheDir,exist_ok=True)
+    tempFN = cacheFN + '.' + str(os.getpid()) + '.tmp'
+    with open(tempFN,'wb') as f:
+        numpy.savez(f,statAr=statAr,threshAr=threshAr,hitsAr=hitsAr)
+    os.replace(tempFN,cacheFN)
+
+def parseBlastFileArrays(blastFN,evalueThresh,alignCoverThresh,percIdentThresh):
+    '''Parse a whole blast output file into a structured numpy array
+with fields given by blastHitDtype. Only hits passing the evalue,
+alignment coverage and percent identity thresholds are kept. For files
+too big to hold in memory, use iterBlastFileChunks instead.
     '''
-    L=[]
     with open(blastFN,'r') as f:
-        s = f.readline()
-        while s:
-            blastLine = s.split()
-
-            # get numeric gene from front, if not present get whole name
-            queryStr = blastLine[0].split('_')[0]
-            if queryStr.isdigit():
-                queryGene = int(queryStr)
-            else:
-                queryGene = queryStr
+        return parseBlastLines(f,evalueThresh,alignCoverThresh,percIdentThresh)
 
-            subjectStr = blastLine[1].split('_')[0]
-            if subjectStr.isdigit():
-                subjectGene = int(subjectStr)
-            else:
-                subjectGene = subjectStr
-
-            evalue = float(blastLine[2])
-            if evalue < evalueThresh:
-                qlen = int(blastLine[3])
-                qstart = int(blastLine[4])
-                qend = int(blastLine[5])
-                slen = int(blastLine[6])
-                sstart = int(blastLine[7])
-                send = int(blastLine[8])
-                pident = float(blastLine[9])
-                score = int(blastLine[10])
-
-                alCov = ((qend-qstart) + (send-sstart)) / (qlen+slen)
-                if alCov > alignCoverThresh and pident > percIdentThresh:
-                    L.append((queryGene,subjectGene,evalue,alCov,pident,score))
-            s = f.readline()
-    return L
+def iterBlastFileChunks(blastFN,evalueThresh,alignCoverThresh,percIdentThresh,chunkSizeBytes=2**28):
+    '''Parse a blast output file in chunks of roughly chunkSizeBytes,
+yielding a structured array of thresholded hits for each chunk (see
+parseBlastFileArrays). Chunks always end on a line boundary.
+    '''
+    with open(blastFN,'r') as f:
+        while True:
+            lineL = f.readlines(chunkSizeBytes)
+            if lineL == []:
+                break
+            yield parseBlastLines(lineL,evalueThresh,alignCoverThresh,percIdentThresh)
+
+def parseBlastLines(lines,evalueThresh,alignCoverThresh,percIdentThresh):
+    '''Parse lines of blast output (an open file or a list of strings)
+into a structured array with fields given by blastHitDtype, applying
+the thresholds as vectorized masks. Gene names are reduced to the
+numeric part before the first '_'. If any name lacks such a numeric
+prefix, the gene fields are object arrays holding the int where
+possible and the string prefix otherwise (as parseBlastFile has always
+done).
+    '''
+    # gene names are read as python strings, everything else goes
+    # straight into numeric columns.
+    readDtype = numpy.dtype([('queryGene',object),('subjectGene',object)]+blastHitFieldL[2:11])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore") # loadtxt warns on empty input
+        rawAr = numpy.loadtxt(lines,dtype=readDtype,delimiter='\t',usecols=range(11),ndmin=1)
+
+    # do the arithmetic in int64/float64 as python would
+    alCovAr = ((rawAr['qend'].astype(numpy.int64)-rawAr['qstart']) + (rawAr['send'].astype(numpy.int64)-rawAr['sstart'])) / (rawAr['qlen'].astype(numpy.int64)+rawAr['slen'])
+    
+    keepAr = (rawAr['evalue'] < evalueThresh) & (alCovAr > alignCoverThresh) & (rawAr['pident'] > percIdentThresh)
+    rawAr = rawAr[keepAr]
+
+    queryPrefixL = [geneName.split('_',1)[0] for geneName in rawAr['queryGene'].tolist()]
+    subjectPrefixL = [geneName.split('_',1)[0] for geneName in rawAr['subjectGene'].tolist()]
+    if all(map(str.isdigit,queryPrefixL)) and all(map(str.isdigit,subjectPrefixL)):
+        hitsAr = numpy.zeros(len(rawAr),dtype=blastHitDtype)
+        hitsAr['queryGene'] = numpy.array(queryPrefixL,dtype=numpy.int64)
+        hitsAr['subjectGene'] = numpy.array(subjectPrefixL,dtype=numpy.int64)
+    else:
+        hitsAr = numpy.zeros(len(rawAr),dtype=numpy.dtype(readDtype.descr+[('alCov','<f8')]))
+        hitsAr['queryGene'] = geneNamesToNums(queryPrefixL)
+        hitsAr['subjectGene'] = geneNamesToNums(subjectPrefixL)
+
+    for field,fieldType in blastHitFieldL[2:11]:
+        hitsAr[field] = rawAr[field]
+    hitsAr['alCov'] = alCovAr[keepAr]
+    return hitsAr
+
+def geneNamesToNums(geneStrL):
+    '''Given a list of gene name prefixes from blast output, return a
+list with the numeric gene where the prefix is numeric, and the prefix
+string otherwise.'''
+    outL = []
+    for geneStr in geneStrL:
+        if geneStr.isdigit():
+            outL.append(int(geneStr))
+        else:
+            outL.append(geneStr)
+    return outL
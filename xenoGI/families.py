@@ -25,6 +25,10 @@ ROOT =  new_DTLOR_DP.NodeType.ROOT
 REARRANGEMENT =  new_DTLOR_DP.NodeType.REARRANGEMENT
 ORIGIN_EVENT =  new_DTLOR_DP.NodeType.ORIGIN_EVENT
 
+# shared by the worker processes in refineFamilies. Set once per
+# worker by refineFamiliesInit.
+refineFamiliesDataT = None
+
 #### Main function
 
 def createFamiliesO(speciesRtreeO,strainNamesT,scoresO,genesO,aabrhHardCoreL,paramD,outputSummaryF):
@@ -36,7 +40,6 @@ originFamilies object.
     # define some variables
     initFamilyFN = paramD['initFamilyFN']
     originFamilyFN =  paramD['originFamilyFN']
-    geneInfoFN = paramD['geneInfoFN']
     numProcesses = paramD['numProcesses']
     D=int(paramD["duplicationCost"])
     T=int(paramD["transferCost"])
@@ -52,7 +55,6 @@ originFamilies object.
     
     initialFamiliesO,locusMapD = createInitialFamiliesO(paramD,genesO,aabrhHardCoreL,scoresO,speciesRtreeO,outputSummaryF)
     
-    genesO.initializeGeneNumToNameD(geneInfoFN,set(strainNamesT)) # needed for writeFamilies
     writeFamilies(initialFamiliesO,initFamilyFN,genesO,strainNamesT,paramD)
     print("Initial families:",file=outputSummaryF)
     writeFamilyFormationSummary(initialFamiliesO,outputSummaryF)
@@ -258,38 +260,30 @@ def createBlastFamilySetL(scoresO,genesO,strainNamesT,outputSummaryF,maxBlastFam
                     indicated by significant BLAST score 
                     (that appear in scoresO)
     '''
-   
-    def getConnectedComponent(temp, gene, visited): 
-        visited.add(gene)
-        temp.add(gene) 
-  
-        # Repeat for all vertices adjacent 
-        # to this gene
-        neighbors=scoresO.getConnectionsGene(gene)
-        if neighbors:
-            for i in neighbors: 
-                if i not in visited:     
-                    # Update the list 
-                    temp = getConnectedComponent(temp, i, visited) 
-        
-        return temp
 
     # main for createBlastFamilySetL
     if strainNamesT == None:
         allGenesL=list(genesO.iterGenes())
     else:
         allGenesL=list(genesO.iterGenes(strainNamesT))
-    scoresO.createNodeConnectD() 
-    connectedGenes=list(scoresO.nodeConnectD.keys())
+    scoresO.createNodeConnectArrays()
+    labelAr = scoresO.getConnectedComponents()
+
+    # get the genes in each component, grouped by label
+    geneByLabelAr = numpy.argsort(labelAr,kind='stable')
+    labelStAr = numpy.searchsorted(labelAr[geneByLabelAr],numpy.arange(labelAr.max()+2 if len(labelAr) > 0 else 1))
+    
+    # components are ordered by the first of their genes to appear in
+    # allGenesL. Genes beyond the last one with an edge are
+    # singletons.
     connecComponentSetL=[]
-    visited=set()
-    for gene in allGenesL: 
-        if gene in scoresO.nodeConnectD:
-            if gene not in visited: 
-                temp =set()
-                newFam=getConnectedComponent(temp, gene, visited)
-                
-                connecComponentSetL.append(newFam) 
+    visitedLabelS=set()
+    for gene in allGenesL:
+        if gene < len(labelAr):
+            label = labelAr[gene]
+            if label not in visitedLabelS:
+                visitedLabelS.add(label)
+                connecComponentSetL.append(set(geneByLabelAr[labelStAr[label]:labelStAr[label+1]].tolist()))
         else:
             fam=set()
             fam.add(gene)
@@ -339,137 +333,69 @@ def splitClusterFailsafe(fullClusterS,scoresO,maxBlastFamSize):
     '''Split fullClusterS by setting higher and higher thresholds for
 homology. Find a threshold that is as low as possible, but still
 splits fullClusterS such that no subclusters are larger than
-maxBlastFamSize.
-
+maxBlastFamSize. We do this in a single sweep, adding edges to a
+union-find structure from highest raw score to lowest, and stopping
+just before the first edge that would create a cluster that is too
+big. Assumes scoresO.createNodeConnectArrays has been run.
     '''
-    splitClusterBinSearchSteps = 25 # max value of steps we'll allow
-    
-    connecT = getConnectionT(fullClusterS,scoresO)
-
-    lind = 0
-    hind = len(connecT)-1
+    clusterGenesAr = numpy.array(sorted(fullClusterS),dtype=numpy.int64)
+    gn1Ar,gn2Ar,rawScAr = getClusterEdgeArrays(clusterGenesAr,scoresO)
 
-    bestInd = splitBinSearch(connecT,lind,hind,fullClusterS,maxBlastFamSize,splitClusterBinSearchSteps)
-    splitClusterL = buildClusterLFromConnecT(connecT[bestInd:],fullClusterS)
-   
-    return splitClusterL
+    # sort by descending score, breaking ties by genes
+    order = numpy.lexsort((gn2Ar,gn1Ar,-rawScAr))
+    ind1L = numpy.searchsorted(clusterGenesAr,gn1Ar[order]).tolist()
+    ind2L = numpy.searchsorted(clusterGenesAr,gn2Ar[order]).tolist()
     
-def getConnectionT(fullClusterS,scoresO):
-    '''Get a tuple representation of the network for this cluster. Each
-    element is ((node1,node2),rawSc), and we sort of rawSc.
-    '''
-    connecD={}
-    for gene1 in fullClusterS:
-        neighborL=scoresO.getConnectionsGene(gene1)
-        for gene2 in neighborL:
-            if gene1 != gene2:
-                # must eliminate self connections
-                keyT=tuple(sorted([gene1,gene2]))
-                connecD[keyT] = scoresO.getScoreByEndNodes(keyT[0],keyT[1],'rawSc')
-    connecT = tuple(sorted(connecD.items(),key=lambda x: x[1]))
-    return connecT
-
-def splitBinSearch(connecT,lind,hind,fullClusterS,maxBlastFamSize,step):
-    '''Find the lowest index into connecT where the network made from that
-point forward has no clusters larger than maxBlastFamSize.
-
-    '''
-    mind = int((lind+hind)/2)
-    # base case
-    if mind==lind or mind==hind:
-        return hind
-    elif step == 0:
-        return hind
-    else:
-        splitClusterL = buildClusterLFromConnecT(connecT[mind:],fullClusterS)
-        if isSplitClusterLSmallEnough(splitClusterL,maxBlastFamSize):
-            hind=mind
+    # union-find over indices into clusterGenesAr
+    parentL = list(range(len(clusterGenesAr)))
+    sizeL = [1] * len(clusterGenesAr)
+
+    def find(ind):
+        while parentL[ind] != ind:
+            parentL[ind] = parentL[parentL[ind]] # path halving
+            ind = parentL[ind]
+        return ind
+
+    for ind1,ind2 in zip(ind1L,ind2L):
+        root1 = find(ind1)
+        root2 = find(ind2)
+        if root1 == root2:
+            continue
+        if sizeL[root1] + sizeL[root2] > maxBlastFamSize:
+            # the threshold is just above this edge's score
+            break
+        if sizeL[root1] < sizeL[root2]:
+            root1,root2 = root2,root1
+        parentL[root2] = root1
+        sizeL[root1] += sizeL[root2]
+
+    # collect the clusters, ordered by their lowest gene
+    rootToClusterD = {}
+    for ind,gene in enumerate(clusterGenesAr.tolist()):
+        root = find(ind)
+        if root in rootToClusterD:
+            rootToClusterD[root].add(gene)
         else:
-            lind=mind
-        # recurse.
-        return splitBinSearch(connecT,lind,hind,fullClusterS,maxBlastFamSize,step-1)
-        
-def isSplitClusterLSmallEnough(splitClusterL,maxBlastFamSize):
-    '''Test if the clusters in splitClusterL are below
-maxBlastFamSize. Return True if they all are, False if any are too
-big.
-    '''
-    for clusterS in splitClusterL:
-        if len(clusterS)>maxBlastFamSize:
-            return False
-    return True
-    
-def buildClusterLFromConnecT(connecT,fullClusterS):
-    '''Build the clusters implied by connecL (which has already been
-reduced by thresholding). fullClusterS gives the full set of genes we
-must divide.
-
-    '''
-    ## functions
-    def getNodeConnectD(connecT):
-        '''Take all the connections in connecT, and put them in a node based
-    representaiton in nodeConnectD.'''
-
-        nodeConnectD = {}
-        for (gn1,gn2),_ in connecT:
-
-            if gn1 not in nodeConnectD:
-                nodeConnectD[gn1] = set([gn2])
-            else:
-                nodeConnectD[gn1].add(gn2)
-
-            if gn2 not in nodeConnectD:
-                nodeConnectD[gn2] = set([gn1])
-            else:
-                nodeConnectD[gn2].add(gn1)
-
-        return nodeConnectD
-
-    def getConnectedComponent(visitedS,clusterS,nodeConnectD,gene):
-        '''Get all the genes connected to gene in nodeConnectD'''
-        visitedS.add(gene)
-        clusterS.add(gene) 
-
-        # Repeat for all vertices adjacent to this gene
-        neighborsL= nodeConnectD[gene]
-        for neighbGene in neighborsL: 
-            if neighbGene not in visitedS:     
-                # Update the list 
-                clusterS = getConnectedComponent(visitedS,clusterS,nodeConnectD,neighbGene) 
-
-        return clusterS
-
-    ## buildClusterLFromConnecT main
-    nodeConnectD = getNodeConnectD(connecT)
+            rootToClusterD[root] = set([gene])
+   
+    return list(rootToClusterD.values())
     
-    splitClusterL = [] # for output
-    visitedS=set()
-    for gene in fullClusterS: 
-        if gene in nodeConnectD:
-            if gene not in visitedS: 
-                tempClusterS=set()
-                tempClusterS=getConnectedComponent(visitedS,tempClusterS,nodeConnectD,gene)
-                
-                splitClusterL.append(tempClusterS) 
-        else:
-            fam=set()
-            fam.add(gene)
-            splitClusterL.append(fam)
-        
-    # check if there is redundancy
-    L=[]
-    S=set()
-    for clusterS in splitClusterL:
-        L.extend(clusterS)
-        S.update(clusterS)
-
-    if len(L) != len(S):
-        print("inner---")
-        print(len(L))
-        print(len(S))
-
-    return splitClusterL
-
+def getClusterEdgeArrays(clusterGenesAr,scoresO):
+    '''Given a sorted array of the genes in a connected cluster, return
+arrays gn1Ar, gn2Ar and rawScAr for all the edges between them (each
+edge once, self connections excluded).'''
+    stAr = scoresO.nodeConnectIndptrAr[clusterGenesAr]
+    countAr = scoresO.nodeConnectIndptrAr[clusterGenesAr+1] - stAr
+
+    # positions in the adjacency arrays of all neighbors of these genes
+    posAr = numpy.repeat(stAr - numpy.cumsum(countAr) + countAr,countAr) + numpy.arange(countAr.sum())
+    rowGeneAr = numpy.repeat(clusterGenesAr,countAr)
+    neighborAr = scoresO.nodeConnectAr[posAr].astype(numpy.int64)
+    edgeAr = scoresO.nodeConnectEdgeAr[posAr]
+
+    # each edge appears under both its genes. keep one.
+    keepAr = rowGeneAr < neighborAr
+    return rowGeneAr[keepAr],neighborAr[keepAr],scoresO.scoreD['rawSc'][edgeAr[keepAr]]
 
 def addGeneToSplitClusterL(splitClusterL,gn1,gn2):
     '''Given a connection pair, gn1,gn2, add to connecL, creating a new
@@ -1455,16 +1381,16 @@ originFamiliesO.
             geneToOfamD[geneNum] = origFamO.famNum
                             
     ## Refine
-    geneProximityD = genomes.createGeneProximityD(geneOrderD,geneProximityRange)
+    genePositionsO = genomes.genePositions(geneOrderD,geneProximityRange)
 
-    # make argument list
-    argumentL = []
-    for candIfamO in refineCandidateIfamS:
-        argumentL.append((candIfamO,geneOrderD,geneProximityRangeRefineFamilies,geneToOfamD,originFamiliesO,upperNumMprThreshold,speciesRtreeO,paramD,genesO,geneProximityD,proximityThreshold,rscThreshold))
+    # the large objects needed by every candidate are sent to each
+    # worker once, via the initializer. Only the candidate ifams
+    # themselves go in the argument list.
+    refineDataT = (geneOrderD,geneProximityRangeRefineFamilies,geneToOfamD,originFamiliesO,upperNumMprThreshold,speciesRtreeO,paramD,genesO,genePositionsO,proximityThreshold,rscThreshold)
 
     # run on multiple processors
-    with Pool(processes=paramD['numProcesses']) as p:
-        for ifamNum,bestMprOrigFormatD in p.imap_unordered(getBestMprOrigForamatD, argumentL):
+    with Pool(processes=paramD['numProcesses'],initializer=refineFamiliesInit,initargs=(refineDataT,)) as p:
+        for ifamNum,bestMprOrigFormatD in p.imap_unordered(getBestMprOrigForamatD, refineCandidateIfamS):
             # put output bestMprs back in ifam objects
             ifam = initialFamiliesO.getFamily(ifamNum)
             ifam.addMprD(bestMprOrigFormatD)
@@ -1491,16 +1417,21 @@ originFamiliesO.
 
     return initialFamiliesO,originFamiliesO
 
-def getBestMprOrigForamatD(argumentL):
-    '''Given a candidate ifam, find the best MPR given nearbyOfamL.'''
+def refineFamiliesInit(refineDataT):
+    '''Initializer for each separate process in refineFamilies. Stores
+the objects shared by all candidate ifams in a global.'''
+    global refineFamiliesDataT
+    refineFamiliesDataT = refineDataT
 
-    # Note: passing the largish objects in argumentL could become a problem with large datasets
+def getBestMprOrigForamatD(candIfamO):
+    '''Given a candidate ifam, find the best MPR given nearbyOfamL. The
+remaining inputs come from the global refineFamiliesDataT.'''
 
-    candIfamO,geneOrderD,geneProximityRangeRefineFamilies,geneToOfamD,originFamiliesO,upperNumMprThreshold,speciesRtreeO,paramD,genesO,geneProximityD,proximityThreshold,rscThreshold = argumentL
+    geneOrderD,geneProximityRangeRefineFamilies,geneToOfamD,originFamiliesO,upperNumMprThreshold,speciesRtreeO,paramD,genesO,genePositionsO,proximityThreshold,rscThreshold = refineFamiliesDataT
 
     nearbyOfamL = getNearbyOfamL(candIfamO,geneOrderD,geneProximityRangeRefineFamilies,geneToOfamD,originFamiliesO)
 
-    bestMprOrigFormatD,bestOfamL = getBestOfamsFromCandIfam(candIfamO,upperNumMprThreshold,speciesRtreeO,paramD,max(originFamiliesO.familiesD.keys()),genesO,nearbyOfamL,geneProximityD,proximityThreshold,rscThreshold)
+    bestMprOrigFormatD,bestOfamL = getBestOfamsFromCandIfam(candIfamO,upperNumMprThreshold,speciesRtreeO,paramD,max(originFamiliesO.familiesD.keys()),genesO,nearbyOfamL,genePositionsO,proximityThreshold,rscThreshold)
 
     return candIfamO.famNum,bestMprOrigFormatD
         
@@ -1536,7 +1467,7 @@ get a collection of other ofams that are nearby to these.'''
 
     return nearbyWithoutTargetL
 
-def getBestOfamsFromCandIfam(candIfamO,upperNumMprThreshold,speciesRtreeO,paramD,maxOfamNum,genesO,nearbyOfamL,geneProximityD,proximityThreshold,rscThreshold):
+def getBestOfamsFromCandIfam(candIfamO,upperNumMprThreshold,speciesRtreeO,paramD,maxOfamNum,genesO,nearbyOfamL,genePositionsO,proximityThreshold,rscThreshold):
     '''Given an inital families object with multiple MPRs, determine the
 best MPR by running island formation with nearby ofams. In the case
 that there are more MPRs than upperNumMprThreshold, we randomly sample
@@ -1562,7 +1493,7 @@ from the space of MPRs.
         for node in locIslByNodeD:
             if locIslByNodeD[node] != []:
                 subRtreeO = speciesRtreeO.subtree(node)
-                argT = (locIslByNodeD[node],geneProximityD,proximityThreshold,rscThreshold,subRtreeO,testFamiliesO)
+                argT = (locIslByNodeD[node],genePositionsO,proximityThreshold,rscThreshold,subRtreeO,testFamiliesO)
                 testAllLocIslandsL.extend(islands.mergeLocIslandsAtNode(argT))
 
         if len(testAllLocIslandsL) < bestNumIslands:
@@ -1626,11 +1557,6 @@ def createFamiliesOFromListOfFamilies(ofamL,speciesRtreeO):
 def writeFamilies(familiesO,familyFN,genesO,strainNamesT,paramD):
     '''Write all gene families to familyFN, one family per line.'''
 
-    geneInfoFN = paramD['geneInfoFN']
-
-    # get the num to name dict, only for strains we're looking at.
-    genesO.initializeGeneNumToNameD(geneInfoFN,set(strainNamesT))
-    
     with open(familyFN,'w') as f:
         for fam in familiesO.iterFamilies():
             f.write(fam.fileStr(genesO)+'\n')
@@ -1,27 +1,35 @@
 def load(filename):
     """Load fasta or multifasta, return list of tuples (header,seq)."""
-    f=open(filename,"r")
+    return list(iterLoad(filename))
+
+def iterLoad(filename,raw=False,bufferSize=2**20):
+    """Iterate through a fasta or multifasta, yielding tuples
+(header,seq) one record at a time, so memory use doesn't grow with the
+size of the file. The file is read in blocks of bufferSize bytes. The
+header includes the leading '>'. All whitespace is removed from
+seq. If raw is True, header and seq are bytes rather than strings,
+which avoids decoding them."""
     header=None
-    outL=[]
     tempSeqL=[]
-    while True:
-        Str=f.readline()
-        if Str=="":
-            outSeq="".join(tempSeqL)
-            tempSeqL=[]
-            outSeq="".join(outSeq.split()) # remove all whitespace
-            outL.append((header,outSeq))
-            break
-        if Str[0]==">":
-            # this is new header, put together previous header,seq, and move one
-            if header!=None:
-                outSeq="".join(tempSeqL)
-                tempSeqL=[]
-                outSeq="".join(outSeq.split()) # remove all whitespace
-                outL.append((header,outSeq))
-            header=Str[:-1]
-        else:
-            # this is a seq line,
-            tempSeqL.append(Str)
-    f.close()
-    return(outL)    
+    with open(filename,"rb",buffering=bufferSize) as f:
+        for Str in f:
+            if Str[:1]==b">":
+                # this is new header, yield previous header,seq, and move on
+                if header!=None:
+                    yield makeRecord(header,tempSeqL,raw)
+                    tempSeqL=[]
+                header=Str.rstrip(b"\r\n")
+            else:
+                # this is a seq line
+                tempSeqL.append(Str)
+    yield makeRecord(header,tempSeqL,raw)
+
+def makeRecord(header,tempSeqL,raw):
+    """Put together a (header,seq) tuple from a header and a list of seq
+lines (as bytes)."""
+    seq=b"".join(b"".join(tempSeqL).split()) # remove all whitespace
+    if raw:
+        return header,seq
+    if header!=None:
+        header=header.decode()
+    return header,seq.decode()
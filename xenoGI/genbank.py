@@ -1,27 +1,80 @@
-import os,sys
+import os,sys,shutil,numpy
 from Bio import SeqIO
+from multiprocessing import Pool
+from . import genomes
+
+# directory (within the fasta directory) for temporary output while
+# parsing
+genbankParseTempDirName = 'genbankParseTemp'
+
+def parseGenbank(paramD,fastaOutFileDir,genbankFileList,fileNameMapD,startGeneNum=0):
+    '''Parse all the genbank (gbff) files in genbankFileList. Genes are
+numbered starting at startGeneNum. If startGeneNum is greater than 0,
+we are adding genomes to an existing data set, and the geneInfo and
+geneOrder files are appended to rather than overwritten. Any genes
+numbered startGeneNum or above already in them (left by an earlier
+attempt which failed) are removed first, so this is safe to rerun.
+
+Parsing is done in parallel in two phases. First each file is parsed
+(and checked) into temporary files, with its genes numbered from
+0. Then, knowing how many genes each file has, we give each file an
+offset so that genes are numbered consecutively in the order of
+genbankFileList, and renumber the temporary output. The result is the
+same as parsing the files one after another. We also write the gene
+info table (see genomes.writeGeneInfoTable) and the packed sequence
+store (see writeSeqStore).'''
 
-def parseGenbank(paramD,fastaOutFileDir,genbankFileList,fileNameMapD):
-    '''Parse all the genbank (gbff) files in genbankFileList.'''
-    
     if genbankFileList == []:
         raise ValueError("List of genbank files to parse is empty.")
 
     dnaBasedGeneTrees = paramD['dnaBasedGeneTrees']
-    
-    geneInfoFile = open(paramD['geneInfoFN'], 'w')
-    geneOrderOutFile = open(paramD['geneOrderFN'], 'w')
-    
-    problemGenbankFileL = []
-    
-    # iterate through list of genbank files
-    geneNum =  0 # xenoGI internal gene numbering
-    for fileName in genbankFileList:
-
-        geneNum,problemGenbankFileL = parseGenbankSingleFile(geneNum,fileName,dnaBasedGeneTrees,fileNameMapD,geneInfoFile,geneOrderOutFile,fastaOutFileDir,problemGenbankFileL)
-        
-    geneInfoFile.close()
-    geneOrderOutFile.close()
+
+    tempDir = os.path.join(fastaOutFileDir,genbankParseTempDirName)
+    if not os.path.isdir(tempDir):
+        os.makedirs(tempDir)
+
+    parseArgL = []
+    for fileInd,fileName in enumerate(genbankFileList):
+        speciesName = fileNameMapD[os.path.split(fileName)[-1]]
+        parseArgL.append((fileInd,fileName,speciesName,dnaBasedGeneTrees,os.path.join(tempDir,str(fileInd))))
+
+    # parse the biggest files first for better load balance
+    parseArgL.sort(key=lambda argT: os.path.getsize(argT[1]),reverse=True)
+
+    with Pool(processes=paramD['numProcesses']) as p:
+
+        resultL = [None]*len(genbankFileList)
+        for fileInd,numGenes,problemStr in p.imap_unordered(parseGenbankSingleFile,parseArgL):
+            resultL[fileInd] = (numGenes,problemStr)
+        parseArgL.sort()
+
+        # get offsets in the order of genbankFileList
+        problemGenbankFileL = []
+        renumberArgL = []
+        geneNum = startGeneNum # xenoGI internal gene numbering
+        for (fileInd,fileName,speciesName,dnaBasedGeneTrees,tempStem),(numGenes,problemStr) in zip(parseArgL,resultL):
+            if problemStr != None:
+                problemGenbankFileL.append((fileName,problemStr))
+                continue
+            renumberArgL.append((speciesName,dnaBasedGeneTrees,tempStem,fastaOutFileDir,geneNum))
+            geneNum += numGenes
+
+        p.map(renumberGenbankOutput,renumberArgL)
+
+    # put together the geneInfo and geneOrder files
+    if startGeneNum > 0:
+        truncateGenomeFiles(paramD['geneInfoFN'],paramD['geneOrderFN'],startGeneNum)
+    fileMode = 'a' if startGeneNum > 0 else 'w'
+    with open(paramD['geneInfoFN'], fileMode) as geneInfoFile, open(paramD['geneOrderFN'], fileMode) as geneOrderOutFile:
+        for speciesName,dnaBasedGeneTrees,tempStem,fastaOutFileDir,offset in renumberArgL:
+            for tempFN,outFile in [(tempStem+"_geneInfo.txt",geneInfoFile),(tempStem+"_geneOrder.txt",geneOrderOutFile)]:
+                with open(tempFN,'r') as tempF:
+                    shutil.copyfileobj(tempF,outFile)
+    genomes.writeGeneInfoTable(paramD['geneInfoFN'])
+    fastaEndingL = ["_prot.fa","_dna.fa"] if dnaBasedGeneTrees else ["_prot.fa"]
+    for fastaEnding in fastaEndingL:
+        writeSeqStore(paramD['seqStoreStem'],fastaEnding,[argT[2] for argT in renumberArgL],startGeneNum)
+    shutil.rmtree(tempDir)
 
     # If there are any files in problemGenbankFileL, throw error
     if problemGenbankFileL != []:
@@ -29,41 +82,71 @@ def parseGenbank(paramD,fastaOutFileDir,genbankFileList,fileNameMapD):
         with open(paramD['problemGenbankFN'],'w') as problemGenbankF:
             for probT in problemGenbankFileL:
                 problemGenbankF.write("\t".join(probT)+"\n")
-    
+
         raise ValueError('Some genbank files have problems with their annotations. They are listed in ' + paramD['problemGenbankFN'] + '. Please remove and run again.\n')
-    
-def parseGenbankSingleFile(geneNum,fileName,dnaBasedGeneTrees,fileNameMapD,geneInfoFile,geneOrderOutFile,fastaOutFileDir,problemGenbankFileL):
-    '''Parse a single genbank file.
+
+def truncateGenomeFiles(geneInfoFN,geneOrderFN,startGeneNum):
+    '''Remove the strains whose genes are numbered startGeneNum or above
+from geneInfoFN and geneOrderFN. These are always at the end of the
+files.'''
+    with open(geneInfoFN,'r') as f:
+        lineL = f.readlines()
+    keepL = []
+    blockL = []
+    for s in lineL:
+        if s[0] == '#':
+            keepL.extend(blockL)
+            blockL = [s]
+        elif int(s.split('\t',1)[0]) < startGeneNum:
+            blockL.append(s)
+        else:
+            blockL = []
+            break
+    keepL.extend(blockL)
+    if len(keepL) < len(lineL):
+        with open(geneInfoFN,'w') as f:
+            f.writelines(keepL)
+
+    with open(geneOrderFN,'r') as f:
+        lineL = f.readlines()
+    # each line is a strain name followed by its contigs
+    keepL = []
+    for s in lineL:
+        fieldL = s.rstrip("\n").split('\t')
+        if len(fieldL) == 1 or int(fieldL[1].split(' ')[0]) < startGeneNum:
+            keepL.append(s)
+    if len(keepL) < len(lineL):
+        with open(geneOrderFN,'w') as f:
+            f.writelines(keepL)
+
+def parseGenbankSingleFile(argT):
+    '''Parse a single genbank file, writing protein (and if
+dnaBasedGeneTrees, dna) fasta, gene info and gene order to temporary
+files starting with tempStem. Genes are numbered from 0. While
+parsing, we check that the file has protein annotations and, if
+dnaBasedGeneTrees is True, that the dna annotations are 3x longer than
+the protein ones. Returns fileInd, the number of genes and None if all
+is well. If there's a problem, returns a string describing it in place
+of None.
     '''
-    genbankName = os.path.split(fileName)[-1]
-    speciesName = fileNameMapD[genbankName]
-
-    # verify that there are protein annotations
-    if not verifyProteinAnnotations(fileName):
-        problemGenbankFileL.append((fileName,'lacks protein annotations'))
-        return geneNum,problemGenbankFileL 
-
-    # if using dna for gene trees, verify that dna annotations 3x
-    # longer than protein
-    if dnaBasedGeneTrees and not verifyDnaAnnotations(fileName):
-        problemGenbankFileL.append((fileName,'length of dna and protein annotations do not correspond properly'))
-        return geneNum,problemGenbankFileL 
-    
+    fileInd,fileName,speciesName,dnaBasedGeneTrees,tempStem = argT
+
+    protFastaOutFile = open(tempStem + "_prot.fa", 'w')
+    if dnaBasedGeneTrees:
+        dnaFastaOutFile = open(tempStem + "_dna.fa", 'w')
+    geneInfoFile = open(tempStem + "_geneInfo.txt", 'w')
+    geneOrderOutFile = open(tempStem + "_geneOrder.txt", 'w')
+    dnaAnnotationsOk = True
+
     # start a block for this species in geneInfoFile
     geneInfoFile.write("# "+speciesName+"\n")
-    
-    inFile = open(fileName, 'rU')
-    protFastaOutName = fastaOutFileDir + speciesName + "_prot.fa"
-    protFastaOutFile = open(protFastaOutName, 'w')
 
-    if dnaBasedGeneTrees:
-        dnaFastaOutName = fastaOutFileDir + speciesName + '_dna.fa'
-        dnaFastaOutFile = open(dnaFastaOutName, 'w')
-        
     # start next line in geneOrderOutFile
     geneOrderOutFile.write(speciesName)
 
     # iterate through chromosomes in the genbank file
+    geneNum = 0
+    inFile = open(fileName, 'r')
     for record in SeqIO.parse(inFile, "genbank"):
         chrom = record.id # .id, as opposed to .name includes the version id
         # iterate through the genes on the chromosome
@@ -85,6 +168,9 @@ def parseGenbankSingleFile(geneNum,fileName,dnaBasedGeneTrees,fileNameMapD,geneI
                 aaSeq = feature.qualifiers['translation'][0]
                 if dnaBasedGeneTrees:
                     dnaSeq = str(feature.extract(record.seq))
+                    # dna should be 3x protein, plus the stop codon
+                    if (len(aaSeq) + 1) * 3 != len(dnaSeq):
+                        dnaAnnotationsOk = False
 
                 # common name
                 commonName=''
@@ -114,7 +200,7 @@ def parseGenbankSingleFile(geneNum,fileName,dnaBasedGeneTrees,fileNameMapD,geneI
                 else:
                     # if locus tag missing, base name on start and end coordinates
                     geneName = str(geneNum) + "_" + speciesName + '-' + str(start)+"_"+str(end)
-                    
+
                 # write to fastaOutFile
                 protFastaOutFile.write(">" + geneName + "\n" + aaSeq + "\n")
                 if dnaBasedGeneTrees:
@@ -129,7 +215,7 @@ def parseGenbankSingleFile(geneNum,fileName,dnaBasedGeneTrees,fileNameMapD,geneI
 
 
         if genesOnChromL != []:
-            # if not empty, write this chromosome to geneOrderFile                    
+            # if not empty, write this chromosome to geneOrderFile
             geneOrderOutFile.write("\t"+" ".join(genesOnChromL))
 
     geneOrderOutFile.write("\n") # add newline to geneOrder file, as we're done with this strain.
@@ -138,38 +224,106 @@ def parseGenbankSingleFile(geneNum,fileName,dnaBasedGeneTrees,fileNameMapD,geneI
     protFastaOutFile.close()
     if dnaBasedGeneTrees:
         dnaFastaOutFile.close()
+    geneInfoFile.close()
+    geneOrderOutFile.close()
 
-    return geneNum,problemGenbankFileL 
-
-def verifyProteinAnnotations(fileName):
-    '''Run through genbank file fileName verifying that it contains
-protein annotations. Return True if it does, False if not.'''
-    with open(fileName, 'rU') as f:
-        for record in SeqIO.parse(f, "genbank"):
-            # iterate through the genes on the chromosome
-            for feature in record.features:
-                # choose only the features that are protein coding genes
-                if feature.type == "CDS" and 'protein_id' in feature.qualifiers and 'translation' in feature.qualifiers:
-                    # at least one annotation
-                    return True
-    # made it all the way through with no annotations
-    return False
-    
-def verifyDnaAnnotations(fileName):
-    '''Run through genbank file fileName verifying that dna gene
-annotations are 3x longer than protein annotations. Return True if so
-in all cases, False otherwise.
-    '''
-    with open(fileName, 'rU') as f:
-        for record in SeqIO.parse(f, "genbank"):
-            # iterate through the genes on the chromosome
-            for feature in record.features:
-                # choose only the features that are protein coding genes
-                if feature.type == "CDS" and 'protein_id' in feature.qualifiers and 'translation' in feature.qualifiers:
-                    aaSeq = feature.qualifiers['translation'][0]
-                    dnaSeq = str(feature.extract(record.seq))
-                    if (len(aaSeq) + 1) * 3 != len(dnaSeq):
-                        return False
-    # made it all the way through so annotations ok
-    return True
-   
+    if geneNum == 0:
+        return fileInd,0,'lacks protein annotations'
+    elif not dnaAnnotationsOk:
+        return fileInd,0,'length of dna and protein annotations do not correspond properly'
+    return fileInd,geneNum,None
+
+def renumberGenbankOutput(argT):
+    '''Take the temporary output for one genbank file (with genes
+numbered from 0), and add offset to all the gene numbers. The fasta
+files are written to their final location in fastaOutFileDir, and the
+gene info and gene order files replace the temporary ones. We also
+write the sequences concatenated together, and an array of their
+lengths, as temporary input for writeSeqStore.'''
+    speciesName,dnaBasedGeneTrees,tempStem,fastaOutFileDir,offset = argT
+
+    fastaEndingL = ["_prot.fa"]
+    if dnaBasedGeneTrees:
+        fastaEndingL.append("_dna.fa")
+    for fastaEnding in fastaEndingL:
+        seqLenL = []
+        with open(tempStem + fastaEnding,'r') as inF, open(fastaOutFileDir + speciesName + fastaEnding,'w') as outF, open(tempStem + fastaEnding + ".seq",'w') as seqF:
+            for s in inF:
+                if s[0] == ">":
+                    outF.write(">" + renumberGeneName(s[1:],offset))
+                else:
+                    outF.write(s)
+                    # sequences are on a single line
+                    seq = s.rstrip("\n")
+                    seqF.write(seq)
+                    seqLenL.append(len(seq))
+        numpy.save(tempStem + fastaEnding + ".len.npy",numpy.array(seqLenL,dtype=numpy.int64))
+
+    # gene info: the block header line, then lines starting with gene
+    # number and name
+    with open(tempStem + "_geneInfo.txt",'r') as inF:
+        lineL = inF.readlines()
+    with open(tempStem + "_geneInfo.txt",'w') as outF:
+        outF.write(lineL[0])
+        for s in lineL[1:]:
+            geneNumStr,rest = s.split("\t",1)
+            outF.write(str(int(geneNumStr)+offset) + "\t" + renumberGeneName(rest,offset))
+
+    # gene order: strain name, then tab separated chromosomes of space
+    # separated genes
+    with open(tempStem + "_geneOrder.txt",'r') as inF:
+        fieldL = inF.read().rstrip("\n").split("\t")
+    with open(tempStem + "_geneOrder.txt",'w') as outF:
+        chromL = [" ".join(str(int(gene)+offset) for gene in chromStr.split(" ")) for chromStr in fieldL[1:]]
+        outF.write("\t".join([fieldL[0]] + chromL) + "\n")
+
+def writeSeqStore(seqStoreStem,fastaEnding,tempStemL,startGeneNum):
+    '''Put together the packed sequence store for fastaEnding from the
+temporary sequence and length files of tempStemL (given in gene number
+order). The store is a file with all the sequences concatenated, and
+an int64 array of offsets into it indexed by gene number (see
+genomes.loadSeqStore). If startGeneNum is greater than 0, we append to
+an existing store, first dropping any genes numbered startGeneNum or
+above (left by an earlier attempt which failed). If there isn't a
+store covering the existing genes, we don't make one (and remove any
+that's there), and sequences will be loaded from the fastas instead.'''
+    if seqStoreStem == None:
+        return
+    seqFN,offsetFN = genomes.getSeqStoreFNs(seqStoreStem,fastaEnding)
+    if startGeneNum > 0:
+        if not (os.path.isfile(seqFN) and os.path.isfile(offsetFN)):
+            return
+        oldOffsetAr = numpy.load(offsetFN)
+        if len(oldOffsetAr) < startGeneNum + 1 or os.path.getsize(seqFN) < oldOffsetAr[-1]:
+            os.remove(seqFN)
+            os.remove(offsetFN)
+            return
+        oldOffsetAr = oldOffsetAr[:startGeneNum+1]
+        with open(seqFN,'r+b') as seqF:
+            seqF.truncate(int(oldOffsetAr[-1]))
+        seqFileMode = 'ab'
+    else:
+        oldOffsetAr = numpy.zeros(1,dtype=numpy.int64)
+        seqFileMode = 'wb'
+    storeDir = os.path.dirname(seqFN)
+    if storeDir != '' and not os.path.isdir(storeDir):
+        os.makedirs(storeDir)
+
+    seqLenArL = []
+    with open(seqFN,seqFileMode) as seqF:
+        for tempStem in tempStemL:
+            with open(tempStem + fastaEnding + ".seq",'rb') as tempF:
+                shutil.copyfileobj(tempF,seqF)
+            seqLenArL.append(numpy.load(tempStem + fastaEnding + ".len.npy"))
+
+    seqLenAr = numpy.concatenate(seqLenArL) if seqLenArL != [] else numpy.zeros(0,dtype=numpy.int64)
+    offsetAr = numpy.concatenate([oldOffsetAr,oldOffsetAr[-1] + numpy.cumsum(seqLenAr)])
+    tempOffsetFN = offsetFN + '.tmp.npy'
+    numpy.save(tempOffsetFN,offsetAr.astype(numpy.int64))
+    os.replace(tempOffsetFN,offsetFN)
+
+def renumberGeneName(s,offset):
+    '''s is a string starting with a gene name (number_rest). Return it
+with offset added to the number.'''
+    geneNumStr,rest = s.split("_",1)
+    return str(int(geneNumStr)+offset) + "_" + rest
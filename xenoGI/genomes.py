@@ -1,5 +1,6 @@
 # Functions for loading genes and gene order
-import sys,glob
+import sys,os,glob,json,numpy,ctypes,shutil,tempfile
+from multiprocessing.sharedctypes import RawArray
 from . import fasta
 from . import trees
 
@@ -7,14 +8,29 @@ def loadSeq(paramD,fileEnding,genesS=None):
     '''Given paramD and the type of sequence, load the sequences and store
 in a dictionary keyed by gene number. fileEnding is a string, either
 "_prot.fa" or "_dna.fa". genesS is a set specifying a subset of genes
-we want to keep. If missing, we keep all.
+we want to keep. If missing, we keep all. Sequences come from the
+packed sequence store if there is one (see loadSeqStore), otherwise
+we parse the fasta files.
     '''
+    storeT = loadSeqStore(paramD['seqStoreStem'],fileEnding)
+    if storeT != None:
+        seqBlobAr,offsetAr = storeT
+        if genesS == None:
+            blobStr = seqBlobAr.tobytes().decode('ascii')
+            offsetL = offsetAr.tolist()
+            return {gn:blobStr[offsetL[gn]:offsetL[gn+1]] for gn in range(len(offsetL)-1) if offsetL[gn+1] > offsetL[gn]}
+        seqD={}
+        for gn in genesS:
+            if 0 <= gn < len(offsetAr)-1 and offsetAr[gn+1] > offsetAr[gn]:
+                seqD[gn] = seqBlobAr[offsetAr[gn]:offsetAr[gn+1]].tobytes().decode('ascii')
+        return seqD
+    
     fileEndingFound = False
     seqD={}
     for fn in glob.glob(paramD['fastaFilePath']):
         if fileEnding in fn:
             fileEndingFound = True # we've seen at least once
-            for header,seq in fasta.load(fn):
+            for header,seq in fasta.iterLoad(fn):
                 gn = int(header.split("_")[0][1:])
                 if genesS == None:
                     seqD[gn]=seq
@@ -26,63 +42,365 @@ we want to keep. If missing, we keep all.
         raise OSError("There are no fasta files ending in "+fileEnding)    
     return seqD
 
-class genes:
-    def __init__(self, geneInfoFN):
-        '''genes object. Keeps track of genes present (organized by strain). Also can optionally load a dictionary which allows us to interconvert from numerical to strain represenatations of a gene.'''
+def getSeqStoreFNs(seqStoreStem,fileEnding):
+    '''Return the names of the sequence and offset files of the packed
+sequence store for fileEnding ("_prot.fa" or "_dna.fa").'''
+    stem = seqStoreStem + fileEnding.split(".")[0]
+    return stem + ".seq", stem + ".idx.npy"
 
-        '''
-  For later.
- Contains only a single dictionary to convert
-one way, either from geneName to number or visa versa. The method
-flipDict inverts keys and values in the dictionary.
-        '''
+def loadSeqStore(seqStoreStem,fileEnding):
+    '''Memory map the packed sequence store made by parseGenbank for
+fileEnding ("_prot.fa" or "_dna.fa"). This consists of a file with all
+sequences concatenated, and an int64 array of offsets indexed by gene
+number, so gene gn's sequence is seqBlobAr[offsetAr[gn]:offsetAr[gn+1]]
+(genes without a sequence have zero length). Returns (seqBlobAr,
+offsetAr), or None if there is no store.'''
+    if seqStoreStem == None:
+        return None
+    seqFN,offsetFN = getSeqStoreFNs(seqStoreStem,fileEnding)
+    if not (os.path.isfile(seqFN) and os.path.isfile(offsetFN)):
+        return None
+    return loadPacked(seqFN,offsetFN)
 
-        self.geneRangeByStrainD = {}
-        self.numGenes = 0
-        self.strainGeneRangeT = ()
-        self.geneNumToNameD = None
-        self.geneInfoD = None
-        
-        self.initializeGeneRangeByStrainD(geneInfoFN)
-        self.initializeStrainGeneRangeT()
+def loadPacked(blobFN,offsetFN):
+    '''Memory map a packed file of concatenated strings (blobFN) along
+with its int64 array of offsets (offsetFN). String i is
+blobAr[offsetAr[i]:offsetAr[i+1]]. Returns (blobAr,offsetAr).'''
+    offsetAr = numpy.load(offsetFN,mmap_mode='r')
+    if offsetAr[-1] == 0:
+        # can't memory map an empty file
+        blobAr = numpy.zeros(0,dtype=numpy.uint8)
+    else:
+        blobAr = numpy.memmap(blobFN,dtype=numpy.uint8,mode='r')
+    return blobAr,offsetAr
 
-    def initializeGeneRangeByStrainD(self,geneInfoFN):
-        '''Given a geneInfo file, fill a dict keyed by strain name with values
-giving the range of gene numbers in the strain.'''
+def packBytes(bytesL):
+    '''Concatenate the bytes objects in bytesL. Returns (blobAr,offsetAr)
+in the form loadPacked does.'''
+    lenAr = numpy.fromiter((len(b) for b in bytesL),dtype=numpy.int64,count=len(bytesL))
+    offsetAr = numpy.concatenate([numpy.zeros(1,dtype=numpy.int64),numpy.cumsum(lenAr)])
+    return numpy.frombuffer(b"".join(bytesL),dtype=numpy.uint8),offsetAr
 
-        f = open(geneInfoFN,'r')
+class sharedSeq:
 
-        # handle first line, which gives first strain
-        strainName = f.readline().rstrip()[2:]
-        enteringNewSpecies = True
-        
-        while True:
-            s = f.readline()
-            if s == '':
-                break
-            elif s[0] == '#':
-
-                # save previous block
-                strainRangeEnd = geneNum+1 # make it the number after the last we saw
-                self.geneRangeByStrainD[strainName] = (strainRangeStart,strainRangeEnd)
-
-                # get set for next block
-                strainName = s.rstrip()[2:] # strainName for next block
-                enteringNewSpecies = True
-                
+    def __init__(self):
+        '''Create an object for storing sequences which will efficiently
+share memory across processes. All sequences are concatenated into
+one shared byte array, and a second array gives the offset of each
+gene's sequence in it, indexed by gene number.'''
+
+        self.seqBlobAr = None
+        self.offsetAr = None
+
+    def createArrays(self,seqD):
+        '''Creates the multiprocessing raw arrays from seqD, a dictionary of
+sequences keyed by gene number.'''
+
+        numRows = max(seqD) + 1 if len(seqD) > 0 else 0
+        lenAr = numpy.zeros(numRows,dtype=numpy.int64)
+        for gn,seq in seqD.items():
+            lenAr[gn] = len(seq)
+
+        # genes not in seqD get a zero length region, and are marked
+        # absent in presentAr so getSeq can raise KeyError.
+        offsetAr = RawArray(ctypes.c_int64, numRows+1)
+        offsetNpAr = numpy.frombuffer(offsetAr,dtype=numpy.int64)
+        offsetNpAr[0] = 0
+        numpy.cumsum(lenAr,out=offsetNpAr[1:])
+
+        presentAr = RawArray(ctypes.c_bool, numRows)
+        presentNpAr = numpy.frombuffer(presentAr,dtype=numpy.bool_)
+        presentNpAr[list(seqD.keys())] = True
+
+        seqBlobAr = RawArray(ctypes.c_char, max(1,int(offsetNpAr[-1])))
+        blobNpAr = numpy.frombuffer(seqBlobAr,dtype=numpy.uint8)
+        for gn,seq in seqD.items():
+            blobNpAr[offsetNpAr[gn]:offsetNpAr[gn+1]] = numpy.frombuffer(seq.encode('ascii'),dtype=numpy.uint8)
+
+        self.insertArrays(seqBlobAr,offsetAr,presentAr)
+
+    def createArraysFromStore(self,seqBlobAr,offsetAr):
+        '''Use the memory mapped arrays of a packed sequence store (see
+loadSeqStore). These are shared across processes by the operating
+system, so no copy is needed.'''
+        presentAr = numpy.diff(offsetAr) > 0
+        self.insertArrays(seqBlobAr,offsetAr,presentAr)
+
+    def insertArrays(self,seqBlobAr,offsetAr,presentAr):
+        '''Attach the input arrays to self.'''
+        self.seqBlobAr = seqBlobAr
+        self.offsetAr = offsetAr
+        self.presentAr = presentAr
+        self.seqBlobNpAr = numpy.frombuffer(seqBlobAr,dtype=numpy.uint8)
+        self.offsetNpAr = numpy.frombuffer(offsetAr,dtype=numpy.int64)
+
+    def returnArrays(self):
+        '''Return all our arrays.'''
+        return self.seqBlobAr,self.offsetAr,self.presentAr
+
+    def getSeq(self,gene):
+        '''Return the sequence of gene as a string.'''
+        if gene < 0 or gene >= len(self.presentAr) or not self.presentAr[gene]:
+            raise KeyError(gene)
+        return self.seqBlobNpAr[self.offsetNpAr[gene]:self.offsetNpAr[gene+1]].tobytes().decode('ascii')
+
+class sharedNeighbors:
+
+    def __init__(self):
+        '''Create an object for storing the neighbors of each gene which will
+efficiently share memory across processes. Neighbors are kept in a
+shared two dimensional array of gene numbers, one row per gene. Rows
+are padded on the right with -1.'''
+
+        self.neighborAr = None
+        self.numCols = 0
+
+    def createArrays(self,neighborTD):
+        '''Creates the multiprocessing raw array from neighborTD, a
+dictionary keyed by gene number whose values are tuples of neighboring
+genes.'''
+
+        numRows = max(neighborTD) + 1 if len(neighborTD) > 0 else 0
+        numCols = max((len(T) for T in neighborTD.values()),default=0)
+
+        neighborAr = RawArray(ctypes.c_int32, max(1,numRows*numCols))
+        self.insertArrays(neighborAr,numRows,numCols)
+        self.neighborNpAr.fill(-1)
+        for gn,neighborT in neighborTD.items():
+            self.neighborNpAr[gn,:len(neighborT)] = neighborT
+
+    def createArraysFromMatrix(self,neighborMatrixAr):
+        '''Creates the multiprocessing raw array from a two dimensional
+numpy array, which already has one row per gene padded with -1.'''
+        numRows,numCols = neighborMatrixAr.shape
+        neighborAr = RawArray(ctypes.c_int32, max(1,numRows*numCols))
+        self.insertArrays(neighborAr,numRows,numCols)
+        self.neighborNpAr[:] = neighborMatrixAr
+
+    def insertArrays(self,neighborAr,numRows,numCols):
+        '''Attach the input array to self.'''
+        self.neighborAr = neighborAr
+        self.numRows = numRows
+        self.numCols = numCols
+        self.neighborNpAr = numpy.frombuffer(neighborAr,dtype=numpy.int32)[:numRows*numCols].reshape(numRows,numCols)
+
+    def returnArrays(self):
+        '''Return our array and its dimensions.'''
+        return self.neighborAr,self.numRows,self.numCols
+
+    def getNeighbors(self,gene):
+        '''Return a tuple of the neighbors of gene, in their original
+order.'''
+        if gene >= self.numRows:
+            raise KeyError(gene)
+        rowL = self.neighborNpAr[gene].tolist()
+        return tuple(gn for gn in rowL if gn != -1)
+
+    def getNeighborArray(self):
+        '''Return the two dimensional numpy array of neighbors, with one row
+per gene number.'''
+        return self.neighborNpAr
+
+## Gene info table
+
+# the string fields of geneInfo, which are stored packed
+geneInfoStrFieldL = ['geneName','commonName','locusTag','proteinId','descrip']
+# the other fields, stored as arrays
+geneInfoArrayFieldL = ['chrom','start','end','strand']
+geneInfoTableMetaFN = 'meta.json'
+
+def getGeneInfoTableDir(geneInfoFN):
+    '''Return the directory for the gene info table made from
+geneInfoFN.'''
+    return os.path.splitext(geneInfoFN)[0] + "Table"
+
+def parseGeneInfo(geneInfoFN):
+    '''Parse geneInfoFN into the columns of a gene info table (see
+geneInfoTable). The string fields are each packed into a single
+array with an array of offsets. Chromosomes are stored as an index into
+a list of chromosome names, and start, end and strand as arrays. Gene
+numbers must be consecutive (rows are indexed by gene number). Returns
+(metaD,colD), where metaD has the first gene number, strain ranges and
+chromosome names, along with the size and modification time of
+geneInfoFN (so we can tell if a table is out of date), and colD is
+keyed by column name.'''
+    statO = os.stat(geneInfoFN)
+
+    strainRangeL = []
+    chromL = []
+    chromIndD = {}
+    strFieldD = {field:[] for field in geneInfoStrFieldL}
+    chromIndL = []
+    startL = []
+    endL = []
+    strandL = []
+    firstGeneNum = None
+    with open(geneInfoFN,'r') as f:
+        for s in f:
+            if s[0] == '#':
+                strainRangeL.append([s.rstrip()[2:],None,None])
             else:
                 geneNum,geneName,commonName,locusTag,proteinId,descrip,chrom,start,end,strand=s.rstrip().split('\t')
                 geneNum = int(geneNum)
-                if enteringNewSpecies == True:
-                    strainRangeStart = geneNum
-                enteringNewSpecies = False
+                if firstGeneNum == None:
+                    firstGeneNum = geneNum
+                if geneNum != firstGeneNum + len(startL):
+                    raise ValueError("Genes in "+geneInfoFN+" are not numbered consecutively.")
+                if strainRangeL[-1][1] == None:
+                    strainRangeL[-1][1] = geneNum
+                strainRangeL[-1][2] = geneNum + 1
+                for field,value in zip(geneInfoStrFieldL,(geneName,commonName,locusTag,proteinId,descrip)):
+                    strFieldD[field].append(value.encode())
+                if chrom not in chromIndD:
+                    chromIndD[chrom] = len(chromL)
+                    chromL.append(chrom)
+                chromIndL.append(chromIndD[chrom])
+                startL.append(int(start))
+                endL.append(int(end))
+                strandL.append(ord(strand))
+
+    colD = {}
+    for field in geneInfoStrFieldL:
+        colD[field] = packBytes(strFieldD[field])
+    colD['chrom'] = numpy.array(chromIndL,dtype=numpy.int32)
+    colD['start'] = numpy.array(startL,dtype=numpy.int64)
+    colD['end'] = numpy.array(endL,dtype=numpy.int64)
+    colD['strand'] = numpy.array(strandL,dtype=numpy.uint8)
 
-        f.close()
+    metaD = {'sourceSize':statO.st_size,'sourceMtime':statO.st_mtime_ns,'firstGeneNum':firstGeneNum if firstGeneNum != None else 0,'strainRangeL':[T for T in strainRangeL if T[1] != None],'chromL':chromL}
+    return metaD,colD
 
-        # get last strain
-        strainRangeEnd = geneNum+1
-        self.geneRangeByStrainD[strainName] = (strainRangeStart,strainRangeEnd)
-        self.numGenes = strainRangeEnd
+def writeGeneInfoTable(geneInfoFN):
+    '''Parse geneInfoFN and write it as a gene info table directory (see
+parseGeneInfo). The table is written to a temporary directory which
+is then moved into place, so other processes never see a partly
+written table. Raises OSError if the directory can't be written.'''
+    tableDir = getGeneInfoTableDir(geneInfoFN)
+    tempDir = tempfile.mkdtemp(prefix=os.path.basename(tableDir)+'.tmp.',dir=os.path.dirname(os.path.abspath(tableDir)))
+    try:
+        metaD,colD = parseGeneInfo(geneInfoFN)
+        for field in geneInfoStrFieldL:
+            blobAr,offsetAr = colD[field]
+            with open(os.path.join(tempDir,field+".seq"),'wb') as f:
+                f.write(blobAr.tobytes())
+            numpy.save(os.path.join(tempDir,field+".idx.npy"),offsetAr)
+        for field in geneInfoArrayFieldL:
+            numpy.save(os.path.join(tempDir,field+".npy"),colD[field])
+        with open(os.path.join(tempDir,geneInfoTableMetaFN),'w') as f:
+            json.dump(metaD,f)
+
+        # a directory can't be replaced by another, so we move the old
+        # table aside first. Processes which already have it open are
+        # unaffected.
+        oldDir = tempDir + '.old'
+        if os.path.isdir(tableDir):
+            try:
+                os.replace(tableDir,oldDir)
+            except FileNotFoundError:
+                # another process moved it first
+                pass
+        try:
+            os.replace(tempDir,tableDir)
+        except OSError:
+            # another process put a new table in place first
+            if not os.path.isdir(tableDir):
+                raise
+        shutil.rmtree(oldDir,ignore_errors=True)
+    finally:
+        shutil.rmtree(tempDir,ignore_errors=True)
+
+def isGeneInfoTableCurrent(geneInfoFN):
+    '''Return True if there is a complete gene info table made from the
+current geneInfoFN.'''
+    metaFN = os.path.join(getGeneInfoTableDir(geneInfoFN),geneInfoTableMetaFN)
+    try:
+        with open(metaFN,'r') as f:
+            metaD = json.load(f)
+    except OSError:
+        return False
+    statO = os.stat(geneInfoFN)
+    return metaD['sourceSize'] == statO.st_size and metaD['sourceMtime'] == statO.st_mtime_ns
+
+def loadGeneInfoTable(tableDir):
+    '''Memory map the gene info table in tableDir, returning a
+geneInfoTable object.'''
+    with open(os.path.join(tableDir,geneInfoTableMetaFN),'r') as f:
+        metaD = json.load(f)
+    colD = {}
+    for field in geneInfoStrFieldL:
+        colD[field] = loadPacked(os.path.join(tableDir,field+".seq"),os.path.join(tableDir,field+".idx.npy"))
+    for field in geneInfoArrayFieldL:
+        colD[field] = numpy.load(os.path.join(tableDir,field+".npy"),mmap_mode='r')
+    return geneInfoTable(metaD,colD)
+
+class geneInfoTable:
+    def __init__(self,metaD,colD):
+        '''Gene info table, with the columns in colD either memory mapped
+(loadGeneInfoTable) or in memory (parseGeneInfo). Fields are decoded
+when looked up.'''
+        self.firstGeneNum = metaD['firstGeneNum']
+        self.strainRangeL = [tuple(T) for T in metaD['strainRangeL']]
+        self.chromL = metaD['chromL']
+        self.strFieldD = {field:colD[field] for field in geneInfoStrFieldL}
+        self.chromAr = colD['chrom']
+        self.startAr = colD['start']
+        self.endAr = colD['end']
+        self.strandAr = colD['strand']
+
+    def row(self,geneNum):
+        '''Return the row for geneNum, raising KeyError if it's not in the
+table.'''
+        rowInd = geneNum - self.firstGeneNum
+        if rowInd < 0 or rowInd >= len(self.startAr):
+            raise KeyError(geneNum)
+        return rowInd
+
+    def getStr(self,field,geneNum):
+        '''Return string field for geneNum.'''
+        rowInd = self.row(geneNum)
+        blobAr,offsetAr = self.strFieldD[field]
+        return blobAr[offsetAr[rowInd]:offsetAr[rowInd+1]].tobytes().decode()
+
+    def getInfo(self,geneNum):
+        '''Return the fields of the geneInfo file (other than gene number)
+for geneNum, as strings.'''
+        rowInd = self.row(geneNum)
+        strL = [self.getStr(field,geneNum) for field in geneInfoStrFieldL]
+        return tuple(strL) + (self.chromL[self.chromAr[rowInd]],str(self.startAr[rowInd]),str(self.endAr[rowInd]),chr(self.strandAr[rowInd]))
+
+    def __len__(self):
+        return len(self.startAr)
+
+class genes:
+    def __init__(self, geneInfoFN):
+        '''genes object. Keeps track of genes present (organized by
+strain), and allows us to look up gene names and other information
+by gene number. This uses the gene info table for geneInfoFN, which
+we make if it's missing or out of date. If we can't write the table,
+we parse geneInfoFN into memory instead.'''
+
+        self.geneRangeByStrainD = {}
+        self.numGenes = 0
+        self.strainGeneRangeT = ()
+
+        if isGeneInfoTableCurrent(geneInfoFN):
+            self.geneInfoTableO = loadGeneInfoTable(getGeneInfoTableDir(geneInfoFN))
+        else:
+            try:
+                writeGeneInfoTable(geneInfoFN)
+                self.geneInfoTableO = loadGeneInfoTable(getGeneInfoTableDir(geneInfoFN))
+            except OSError:
+                self.geneInfoTableO = geneInfoTable(*parseGeneInfo(geneInfoFN))
+        
+        self.initializeGeneRangeByStrainD()
+        self.initializeStrainGeneRangeT()
+
+    def initializeGeneRangeByStrainD(self):
+        '''Fill a dict keyed by strain name with values giving the range of
+gene numbers in the strain.'''
+        for strainName,strainRangeStart,strainRangeEnd in self.geneInfoTableO.strainRangeL:
+            self.geneRangeByStrainD[strainName] = (strainRangeStart,strainRangeEnd)
+            self.numGenes = strainRangeEnd
 
     def initializeStrainGeneRangeT(self):
         '''The numToStrainName function works best with a tuple version of the
@@ -91,49 +409,6 @@ strain ranges. This method intializes that.'''
         strainRangeL.sort(key=lambda x: x[1]) # sort by end
         self.strainGeneRangeT = tuple(strainRangeL)
 
-    def initializeGeneNumToNameD(self,geneInfoFN,strainNamesL=None):
-        '''Given geneInfo file, fill a gene dict keyed by geneNum with value
-geneName. If strainNamesL is provided, only load from those strains
-present in it. This is an optional part of this data structure, which
-isn't loaded by default.
-        '''
-        self.geneNumToNameD = self.loadDictFromGeneInfoFile(geneInfoFN,strainNamesL,True)
-
-    def initializeGeneInfoD(self,geneInfoFN,strainNamesL=None):
-        '''Read gene info from file, returning a dict keyed by gene name with
-    information such as description, start position and so on.
-        '''
-        self.geneInfoD = self.loadDictFromGeneInfoFile(geneInfoFN,strainNamesL,False)
-
-    def loadDictFromGeneInfoFile(self,geneInfoFN,strainNamesL,onlyNames):
-        '''Reads in a dictionary from geneInfo file. Keys are geneNum. If
-onlyNames is True, then we make the values geneName, otherwise all
-other fields.'''
-
-        D = {}
-        f = open(geneInfoFN,'r')
-        while True:
-            s = f.readline()
-            if s == '':
-                break
-            elif s[0] == '#':
-                strainName = s.rstrip()[2:]
-                if strainNamesL == None or strainName in strainNamesL:
-                    keepGenes = True
-                else:
-                    keepGenes = False
-            else:
-                geneNum,geneName,commonName,locusTag,proteinId,descrip,chrom,start,end,strand=s.rstrip().split('\t')
-                if keepGenes == True:
-                    geneNum = int(geneNum)
-                    if onlyNames:
-                        D[geneNum] = geneName
-                    else:
-                        D[geneNum] = geneName,commonName,locusTag,proteinId,descrip,chrom,start,end,strand
-                        
-        f.close()
-        return D
-
     def numToStrainName(self,geneNum):
         '''Given a gene number, return the strain name corresponding. Uses
 binary search to find the where geneNum falls in strainGeneRangeT.'''
@@ -157,9 +432,8 @@ binary search to find the where geneNum falls in strainGeneRangeT.'''
                         return self.strainGeneRangeT[end][0]
 
     def numToName(self,geneNumber):
-        '''Given gene number, return gene name. Assumes self.geneNumToNameD
-has been initialized.'''
-        return self.geneNumToNameD[geneNumber]
+        '''Given gene number, return gene name.'''
+        return self.geneInfoTableO.getStr('geneName',geneNumber)
 
     def iterGenes(self,strainL=None):
         '''Iterate over genes. If strainL is None (or is not given) iterates
@@ -178,10 +452,11 @@ strains present in strainL.'''
         return range(rangeStart,rangeEnd)
 
     def numToGeneInfo(self,geneNumber):
-        '''Given gene number, return other info about gene. Assumes
-self.geneInfoD has been initialized.
+        '''Given gene number, return other info about gene: a tuple of
+geneName,commonName,locusTag,proteinId,descrip,chrom,start,end,strand
+(all strings).
         '''
-        return self.geneInfoD[geneNumber]
+        return self.geneInfoTableO.getInfo(geneNumber)
     
     def __len__(self):
         return self.numGenes
@@ -189,34 +464,73 @@ self.geneInfoD has been initialized.
     def __repr__(self):
         return "<genes object with "+str(len(self))+" genes.>"
         
-def getProximityInWindow(geneWinT,geneProximityD):
-    '''Given a window of genes, calculate the distances between first gene
-and the rest (in number of genes) and store in geneProximityD. Updates
-geneProximityD in place, returning None.
-    '''
-    gnA=geneWinT[0]
-    for i in range(1,len(geneWinT)):
-        gnB=geneWinT[i]
+class genePositions:
+    def __init__(self,geneOrderD,geneProximityRange):
+        '''Positional index of the genes in geneOrderD. For each gene we
+store the contig it's on and its position there in two int32 arrays
+indexed by gene number (genes not in geneOrderD have contig -1). Two
+genes are proximate if they're on the same contig and within
+geneProximityRange genes of each other. We also keep the genes in
+contig order, so we can find all the genes near a given one.'''
+        self.geneProximityRange = geneProximityRange
+        contigL = [geneNumT for contigT in geneOrderD.values() for geneNumT in contigT]
+        maxGeneNum = max((max(geneNumT) for geneNumT in contigL if len(geneNumT) > 0),default=-1)
 
-        if gnA<gnB: # always put lower gene number first
-            geneProximityD[(gnA,gnB)]=i
-        else:
-            geneProximityD[(gnB,gnA)]=i
-
-def createGeneProximityD(geneOrderD,geneProximityForGroup):
-    '''Go though a gene order tuple pulling out pairs of genes that are
-within geneProximityForGroup genes of each other. Store in a dict keyed by
-gene pair, with value equal to the distance between the two genes,
-measured in number of genes.'''
-    geneProximityD = {}
-    for contigT in geneOrderD.values():
-        for geneNumT in contigT:
-            for i in range(len(geneNumT)):
-                # slide over genes w/win geneProximityForGroup+1
-                # wide.
-                getProximityInWindow(geneNumT[i:i+(geneProximityForGroup+1)],geneProximityD)
-                    
-    return geneProximityD
+        # genes in contig order, and where each contig starts
+        self.orderedGeneAr = numpy.array([gn for geneNumT in contigL for gn in geneNumT],dtype=numpy.int32)
+        contigLenAr = numpy.array([len(geneNumT) for geneNumT in contigL],dtype=numpy.int64)
+        self.contigStartAr = numpy.concatenate([numpy.zeros(1,dtype=numpy.int64),numpy.cumsum(contigLenAr)])
+
+        self.contigAr = numpy.full(maxGeneNum+1,-1,dtype=numpy.int32)
+        self.posAr = numpy.zeros(maxGeneNum+1,dtype=numpy.int32)
+        contigIndAr = numpy.repeat(numpy.arange(len(contigL),dtype=numpy.int32),contigLenAr)
+        self.contigAr[self.orderedGeneAr] = contigIndAr
+        self.posAr[self.orderedGeneAr] = numpy.arange(len(self.orderedGeneAr)) - self.contigStartAr[contigIndAr]
+
+        self.initializeLists()
+
+    def initializeLists(self):
+        '''Make list versions of the contig and position arrays. Indexing
+lists is faster than arrays when checking one pair of genes at a
+time.'''
+        self.contigL = self.contigAr.tolist()
+        self.posL = self.posAr.tolist()
+
+    def __getstate__(self):
+        # only send the arrays when pickling, the lists are rebuilt
+        stateD = self.__dict__.copy()
+        del stateD['contigL']
+        del stateD['posL']
+        return stateD
+
+    def __setstate__(self,stateD):
+        self.__dict__.update(stateD)
+        self.initializeLists()
+
+    def isProximate(self,gn1,gn2,proximityThreshold):
+        '''Return True if gn1 and gn2 are different genes on the same contig
+within proximityThreshold (and geneProximityRange) genes of each
+other.'''
+        if gn1 == gn2 or gn1 >= len(self.contigL) or gn2 >= len(self.contigL):
+            return False
+        contig = self.contigL[gn1]
+        if contig == -1 or contig != self.contigL[gn2]:
+            return False
+        return abs(self.posL[gn1] - self.posL[gn2]) <= min(proximityThreshold,self.geneProximityRange)
+
+    def neighbors(self,geneAr,k):
+        '''For each gene in geneAr, find all the genes on the same contig
+within k genes of it (not including itself). Returns two arrays,
+geneAr values repeated, and the corresponding neighbors.'''
+        geneAr = numpy.asarray(geneAr,dtype=numpy.int64)
+        geneAr = geneAr[(geneAr < len(self.contigAr)) & (self.contigAr[numpy.minimum(geneAr,len(self.contigAr)-1)] != -1)]
+        contigIndAr = self.contigAr[geneAr]
+        slotAr = self.contigStartAr[contigIndAr] + self.posAr[geneAr]
+        offsetAr = numpy.concatenate([numpy.arange(-k,0),numpy.arange(1,k+1)])
+        neighborSlotAr = slotAr[:,None] + offsetAr
+        validAr = (neighborSlotAr >= self.contigStartAr[contigIndAr][:,None]) & (neighborSlotAr < self.contigStartAr[contigIndAr+1][:,None])
+        rowAr,colAr = numpy.nonzero(validAr)
+        return geneAr[rowAr],self.orderedGeneAr[neighborSlotAr[rowAr,colAr]].astype(numpy.int64)
 
 def createGeneOrderD(geneOrderFN,strainNamesL):
     '''Go though gene order file and get orderings into a set of
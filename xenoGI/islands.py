@@ -3,7 +3,7 @@ from multiprocessing import Pool
 from . import trees,genomes,analysis
 from .Island import *
 from .Family import *
-import math 
+import math,heapq,itertools,numpy
     
 ## Main function  
 
@@ -21,30 +21,53 @@ def makeLocusIslands(geneOrderD,subtreeD,speciesRtreeO,paramD,familiesO,rootFoca
     rscThresholdMerge = paramD['rscThresholdMerge']
     maxClusterSize = paramD['maxClusterSize']
     
-    geneProximityD = genomes.createGeneProximityD(geneOrderD,geneProximityRange)
+    genePositionsO = genomes.genePositions(geneOrderD,geneProximityRange)
     locIslByNodeD=createLocIslByNodeD(familiesO,speciesRtreeO)
     numIslandsAtEachNodeAtStartD = {mrca:len(L) for mrca,L in locIslByNodeD.items()}
     focalNodesL = getFocalNodesInOrderOfNumDescendants(speciesRtreeO,rootFocalClade)
 
     ##  Merge in clusters
-    locusIslandClusterL,singletonClusterL = createLocusIslandClusters(locIslByNodeD,focalNodesL,subtreeD,familiesO,geneProximityD,geneProximityRange,maxClusterSize)
-
-    # create argumentL to be passed to p.map and mergeLocIslandsAtNode
-    argumentL = []
-    for clusterL in locusIslandClusterL:
-        argumentL.append((clusterL,geneProximityD,proximityThresholdMerge,rscThresholdMerge,subtreeD[clusterL[0].mrca],familiesO))
-    p=Pool(numProcesses)
-    mergedL = p.map(mergeLocIslandsAtNode, argumentL) # run it
-
-    # update locIslByNodeD with the merged nodes
-    locIslByNodeD = updateIslandByNodeLEntries(locIslByNodeD,focalNodesL,mergedL)
-
-    ##  Merge at mrca nodes
-    argumentL = []
+    locusIslandClusterL,singletonClusterL = createLocusIslandClusters(locIslByNodeD,focalNodesL,subtreeD,familiesO,genePositionsO,geneProximityRange,maxClusterSize)
+
+    # Both rounds of merging use one pool. genePositionsO and familiesO
+    # are needed by every task, so are sent to each worker once via
+    # the initializer.
+    with Pool(processes=numProcesses,initializer=mergeLocIslandsInit,initargs=(genePositionsO,familiesO)) as p:
+
+        argumentL = []
+        for clusterL in locusIslandClusterL:
+            argumentL.append((clusterL,proximityThresholdMerge,rscThresholdMerge,subtreeD[clusterL[0].mrca]))
+        mergedL = runMergeTasks(p,argumentL)
+
+        # update locIslByNodeD with the merged nodes
+        locIslByNodeD = updateIslandByNodeLEntries(locIslByNodeD,focalNodesL,mergedL)
+
+        ##  Merge at mrca nodes
+
+        # The islands at a node are split into groups which can't merge
+        # with each other, and each group is a separate task. This
+        # keeps the root of the focal clade from being one very large
+        # task.
+        argumentL = []
+        taskNodeL = []
+        mergedAtNodeD = {}
+        for mrcaNode in focalNodesL:
+            mergedAtNodeD[mrcaNode] = []
+            for groupL in splitIndependentIslands(locIslByNodeD[mrcaNode],genePositionsO,proximityThresholdMerge,rscThresholdMerge,subtreeD[mrcaNode],familiesO):
+                if len(groupL) < 2:
+                    # nothing to merge
+                    mergedAtNodeD[mrcaNode].extend(groupL)
+                else:
+                    argumentL.append((groupL,proximityThresholdMerge,rscThresholdMerge,subtreeD[mrcaNode]))
+                    taskNodeL.append(mrcaNode)
+        for mrcaNode,groupL in zip(taskNodeL,runMergeTasks(p,argumentL)):
+            mergedAtNodeD[mrcaNode].extend(groupL)
+
+    # put islands at each node back in their original order
+    mergedL = []
     for mrcaNode in focalNodesL:
-        argumentL.append((locIslByNodeD[mrcaNode],geneProximityD,proximityThresholdMerge,rscThresholdMerge,subtreeD[mrcaNode],familiesO))
-    p=Pool(numProcesses)
-    mergedL = p.map(mergeLocIslandsAtNode, argumentL) # run it
+        posD = {liO.id:i for i,liO in enumerate(locIslByNodeD[mrcaNode])}
+        mergedL.append(sorted(mergedAtNodeD[mrcaNode],key=lambda liO: posD[liO.id]))
 
     # add the islands that were identified as singleton clusters
     mergedL.extend(singletonClusterL)
@@ -110,7 +133,7 @@ first.'''
 
 ## Cluster formation
 
-def createLocusIslandClusters(locIslByNodeD,focalNodesL,subtreeD,familiesO,geneProximityD,proximityThreshold,maxClusterSize):
+def createLocusIslandClusters(locIslByNodeD,focalNodesL,subtreeD,familiesO,genePositionsO,proximityThreshold,maxClusterSize):
     '''For every node in the focal clade, take the set of single family
 LocusIslands in locIslByNodeD. Break this up into smaller
 clusters based on the chromosomal distances between members of the
@@ -126,7 +149,7 @@ are likely to merge.'''
         subRtreeO = subtreeD[mrcaNode]
         islandsAtMrcaNodeL = locIslByNodeD[mrcaNode] 
         
-        mrcaClustersL,mrcaSingletonClustersL = createMrcaNodeClusters(islandsAtMrcaNodeL,familiesO,subRtreeO,geneProximityD,proximityThreshold,maxClusterSize)
+        mrcaClustersL,mrcaSingletonClustersL = createMrcaNodeClusters(islandsAtMrcaNodeL,familiesO,subRtreeO,genePositionsO,proximityThreshold,maxClusterSize)
 
         singletonClustersL.extend(mrcaSingletonClustersL)
         
@@ -134,7 +157,7 @@ are likely to merge.'''
     
     return locusIslandClustersL,singletonClustersL
 
-def createMrcaNodeClusters(islandsAtMrcaNodeL,familiesO,subRtreeO,geneProximityD,proximityThreshold,maxClusterSize):
+def createMrcaNodeClusters(islandsAtMrcaNodeL,familiesO,subRtreeO,genePositionsO,proximityThreshold,maxClusterSize):
     
     '''Takes in a Mrca node and other node information 
     and clusters the nodes within the mrca node that are likely 
@@ -152,7 +175,7 @@ def createMrcaNodeClusters(islandsAtMrcaNodeL,familiesO,subRtreeO,geneProximityD
         clusterL = [] 
         onDeckL = [islandsAtMrcaNodeL.pop()]
         
-        clusterL,islandsAtMrcaNodeL = populateCluster(clusterL,onDeckL,islandsAtMrcaNodeL,familiesO,subRtreeO,geneProximityD,proximityThreshold,maxClusterSize)
+        clusterL,islandsAtMrcaNodeL = populateCluster(clusterL,onDeckL,islandsAtMrcaNodeL,familiesO,subRtreeO,genePositionsO,proximityThreshold,maxClusterSize)
         
         if len(clusterL) > 1:
             mrcaClustersL.append(clusterL)
@@ -162,7 +185,7 @@ def createMrcaNodeClusters(islandsAtMrcaNodeL,familiesO,subRtreeO,geneProximityD
     return mrcaClustersL,mrcaSingletonClustersL
 
 
-def populateCluster(clusterL,onDeckL,islandsAtMrcaNodeL,familiesO,subRtreeO,geneProximityD,proximityThreshold,maxClusterSize):
+def populateCluster(clusterL,onDeckL,islandsAtMrcaNodeL,familiesO,subRtreeO,genePositionsO,proximityThreshold,maxClusterSize):
     '''Populate clusterL by searching for islands in
 islandsAtMrcaNodeL. onDeckL consists of islands that will be added to
 clusterL, but which need to be used to search first.
@@ -179,7 +202,7 @@ clusterL, but which need to be used to search first.
         for liO in islandsAtMrcaNodeL:
             locFamO = list(liO.iterLocusFamilies(familiesO))[0]
 
-            proxB = proximitySubtree(searchSeedLocFamO,locFamO,geneProximityD,proximityThreshold,subRtreeO,subRtreeO.rootNode)
+            proxB = proximitySubtree(searchSeedLocFamO,locFamO,genePositionsO,proximityThreshold,subRtreeO,subRtreeO.rootNode)
             if proxB:
                 tempFoundL.append(liO)
 
@@ -199,18 +222,18 @@ clusterL, but which need to be used to search first.
 
     return clusterL,islandsAtMrcaNodeL
 
-def proximitySubtree(lfam0,lfam1,geneProximityD,proximityThreshold,subRtreeO,node):
+def proximitySubtree(lfam0,lfam1,genePositionsO,proximityThreshold,subRtreeO,node):
     '''Given two gene families with the same mrcaNode, return boolean
 indicating whether any of their genes are within proximityThreshold of
 each other.
     '''
     if subRtreeO.isLeaf(node):
         # node is strain in this species subtree
-        return proximity(lfam0,lfam1,geneProximityD,proximityThreshold,node)
+        return proximity(lfam0,lfam1,genePositionsO,proximityThreshold,node)
     else:
         outB = False
         for childNode in subRtreeO.children(node):
-            tempB = proximitySubtree(lfam0,lfam1,geneProximityD,proximityThreshold,subRtreeO,childNode)
+            tempB = proximitySubtree(lfam0,lfam1,genePositionsO,proximityThreshold,subRtreeO,childNode)
             outB = outB or tempB
         return outB
 
@@ -233,87 +256,156 @@ locIslByNodeD, then add the contents of mergedL.'''
 
 ## Iterative merging
 
+def runMergeTasks(p,argumentL):
+    '''Run mergeLocIslandsAtNodeShared on each task in argumentL using
+pool p, returning the results in the order of argumentL. We estimate
+the cost of a task as the square of its number of islands, and start
+the most expensive first for better load balance.'''
+    orderL = sorted(range(len(argumentL)),key=lambda i: len(argumentL[i][0])**2,reverse=True)
+    mergedL = [None]*len(argumentL)
+    for i,merged in p.imap_unordered(mergeLocIslandsAtNodeIndexed,((i,argumentL[i]) for i in orderL)):
+        mergedL[i] = merged
+    return mergedL
+
+def mergeLocIslandsAtNodeIndexed(indexedArgT):
+    '''Run mergeLocIslandsAtNodeShared on a task, returning its index along
+with the result.'''
+    i,argT = indexedArgT
+    return i,mergeLocIslandsAtNodeShared(argT)
+
+def splitIndependentIslands(locusIslandL,genePositionsO,proximityThreshold,rscThreshold,subRtreeO,familiesO):
+    '''Split locusIslandL into groups that can be merged
+independently. Islands are only merged when the score between their
+end locus families is at least rscThreshold. The ends of a merged
+island are ends of the islands it was made from. So if no end families
+of two sets of islands score that high, islands from the two sets will
+never merge. Families that aren't proximate in any strain get the same
+(low) score, so the groups are neighborhoods of islands on the
+genome. Returns a list of groups, each in the order of locusIslandL.'''
+
+    if len(locusIslandL) < 2:
+        return [locusIslandL]
+
+    lFamNumL = getEndLocusFamilies(locusIslandL)
+    costDiffD = costDiffDict((lFamNumL,familiesO,genePositionsO,proximityThreshold,subRtreeO))
+    if costDiffD.defaultCostDiff >= rscThreshold:
+        # any pair might merge
+        return [locusIslandL]
+
+    # join islands with high scoring ends (union find)
+    islandIndD = {}
+    for i,liO in enumerate(locusIslandL):
+        islandIndD[liO.locusFamilyL[0]] = i
+        islandIndD[liO.locusFamilyL[-1]] = i
+    parentL = list(range(len(locusIslandL)))
+    def find(i):
+        while parentL[i] != i:
+            parentL[i] = parentL[parentL[i]]
+            i = parentL[i]
+        return i
+    for (lfNum1,lfNum2),cdsc in costDiffD.items():
+        if cdsc >= rscThreshold:
+            root1 = find(islandIndD[lfNum1])
+            root2 = find(islandIndD[lfNum2])
+            if root1 != root2:
+                parentL[max(root1,root2)] = min(root1,root2)
+
+    groupD = {}
+    for i,liO in enumerate(locusIslandL):
+        groupD.setdefault(find(i),[]).append(liO)
+    return list(groupD.values())
+
+def mergeLocIslandsInit(genePositionsIn,familiesIn):
+    '''Initializer for each separate process merging locus
+islands. Stores the objects shared by all tasks in a global.'''
+    global mergeLocIslandsDataT
+    mergeLocIslandsDataT = (genePositionsIn,familiesIn)
+
+def mergeLocIslandsAtNodeShared(argT):
+    '''Run mergeLocIslandsAtNode, taking genePositionsO and familiesO
+from the global mergeLocIslandsDataT.'''
+    locusIslandL,proximityThreshold,rscThreshold,subRtreeO = argT
+    genePositionsO,familiesO = mergeLocIslandsDataT
+    return mergeLocIslandsAtNode((locusIslandL,genePositionsO,proximityThreshold,rscThreshold,subRtreeO,familiesO))
+
 def mergeLocIslandsAtNode(argT):
     '''Given a list of locus islands at one node (locusIslandL)
 iteratively merge until there are no more pairwise scores above
 threshold. rscThreshold represents the threshold below which we no
-longer merge islands.
+longer merge islands. At each step we merge the pair with the highest
+score.
     '''
 
-    locusIslandL,geneProximityD,proximityThreshold,rscThreshold,subRtreeO,familiesO = argT
+    locusIslandL,genePositionsO,proximityThreshold,rscThreshold,subRtreeO,familiesO = argT
     
     if len(locusIslandL) < 2:
         # nothing to merge
         return locusIslandL
 
     # Pre-calculate costDiff scores between all families in locusIslandL
-    lFamNumL = []
-    for liO in locusIslandL:
-        # we only need to consider first and last loc fams
-        lFamNumL.append(liO.locusFamilyL[0]) # add first
-        if len(liO) > 1:
-            # this li has more than one loc fam, add last as well
-            lFamNumL.append(liO.locusFamilyL[-1])
-        
-    costDiffD = costDiffDict((lFamNumL,familiesO,geneProximityD,proximityThreshold,subRtreeO))
-    
-    # create initial scoreD
-    scoreD = createScoreD(locusIslandL,costDiffD)
+    lFamNumL = getEndLocusFamilies(locusIslandL)
+    costDiffD = costDiffDict((lFamNumL,familiesO,genePositionsO,proximityThreshold,subRtreeO))
+
+    # Scores between pairs of islands are kept in a heap, ordered by
+    # score and then by when they were added, so ties go to the
+    # earliest. Merging changes an island's ends, and thus its
+    # scores. Rather than removing its old scores from the heap, we
+    # give the island a new version, and skip scores made with an old
+    # version when they come off the heap. Scores below rscThreshold
+    # can never be merged, so aren't added.
+    locIslandD = {liO.id:liO for liO in locusIslandL}
+    versionD = {liO.id:0 for liO in locusIslandL}
+    scoreHeapL = []
+    counterIt = itertools.count()
+    for i in range(len(locusIslandL)-1):
+        for j in range(i+1,len(locusIslandL)):
+            pushScore(scoreHeapL,locusIslandL[i],locusIslandL[j],costDiffD,versionD,counterIt,rscThreshold)
 
     # Merge
-    while True:
-        sc,locIslandPairT,orientation=maxScore(scoreD)
-        if sc < rscThreshold:
-            break
+    while scoreHeapL:
+        negSc,count,li0ID,li1ID,li0Version,li1Version,orientation = heapq.heappop(scoreHeapL)
+        if versionD.get(li0ID) != li0Version or versionD.get(li1ID) != li1Version:
+            continue # out of date
 
-        ind0,li0 = searchLocIslandsByID(locusIslandL,locIslandPairT[0])
-        ind1,li1 = searchLocIslandsByID(locusIslandL,locIslandPairT[1])
+        li0 = locIslandD[li0ID]
+        li0.merge(locIslandD[li1ID],orientation)
 
-        li0.merge(li1,orientation)
+        # delete li1, and invalidate old scores for li0
+        del locIslandD[li1ID]
+        del versionD[li1ID]
+        versionD[li0ID] += 1
 
-        # delete li1
-        del locusIslandL[ind1]
+        # calculate new scores for li0 against all other islands
+        for liO in locusIslandL:
+            if liO.id in locIslandD and liO.id != li0ID:
+                pushScore(scoreHeapL,li0,liO,costDiffD,versionD,counterIt,rscThreshold)
 
-        # remove all scores in scoreD that involve li0 or li1
-        delScores(scoreD,li0.id,li1.id)
+    return [liO for liO in locusIslandL if liO.id in locIslandD]
 
-        # calculate new scores for li0 against all other islands
-        addScores(scoreD,li0,locusIslandL,costDiffD)
-        
-    return locusIslandL
-
-def maxScore(scoreD):
-    '''Find the entry with the highest score in scoreD, and return the
-corresponding key.'''
-    bestSc=-float('inf')
-    bestLocIslandPairT=()
-    bestOrientation = 0
-    for locIslandPairT,(sc,orientation) in scoreD.items():
-        if sc > bestSc:
-            bestSc=sc
-            bestLocIslandPairT = locIslandPairT
-            bestOrientation = orientation
-    return bestSc,bestLocIslandPairT,bestOrientation
-
-def delScores(scoreD,li0ID,li1ID):
-    '''Given two locus island ids from newly merged nodes, delete any entries in
-score D that come from them.'''
-    # find ones to delete
-    toDelL=[]
-    for key in scoreD.keys():
-        if li0ID in key or li1ID in key:
-            toDelL.append(key)
-
-    # now delete them
-    for key in toDelL:
-        del scoreD[key]
-
-def addScores(scoreD,li0,locusIslandL,costDiffD):
-    '''Get scores for locus island li0 against all other locus islands and add to
-scoreD.'''
-    for locIsl in locusIslandL:
-        if locIsl.id != li0.id:
-            storeScore(li0,locIsl,costDiffD,scoreD)
+def getEndLocusFamilies(locusIslandL):
+    '''Return a list of the first and last locus families of the islands
+in locusIslandL. These are the only ones we need to consider when
+scoring.'''
+    lFamNumL = []
+    for liO in locusIslandL:
+        lFamNumL.append(liO.locusFamilyL[0]) # add first
+        if len(liO) > 1:
+            # this li has more than one loc fam, add last as well
+            lFamNumL.append(liO.locusFamilyL[-1])
+    return lFamNumL
+
+def pushScore(scoreHeapL,li0,li1,costDiffD,versionD,counterIt,rscThreshold):
+    '''Calculate the score between li0 and li1, and if it's at least
+rscThreshold, push it onto scoreHeapL along with the current versions
+of the islands. We follow convention that the lower island id comes
+first.'''
+    if li0.id > li1.id:
+        li0,li1 = li1,li0
+    score,orientation=rscore(li0,li1,costDiffD)
+    # rscore returns different things depending on order
+    # so we must be consistent with what we do here.
+    if score >= rscThreshold:
+        heapq.heappush(scoreHeapL,(-score,next(counterIt),li0.id,li1.id,versionD[li0.id],versionD[li1.id],orientation))
 
 def searchLocIslandsByID(listOfLocIslands,id):
     '''Search for a locus island with id equal to id. Return the index of the
@@ -325,93 +417,105 @@ first we find, and None if their isn't one.
 
 ## Scoring
 
+class costDiffD(dict):
+    '''Dictionary of costDiff scores between pairs of locus families,
+keyed by (locusFamNum1,locusFamNum2). Pairs which aren't proximate in
+any strain all have the same score, defaultCostDiff. These aren't
+stored, and missing keys give defaultCostDiff.'''
+    def __init__(self,defaultCostDiff):
+        super().__init__()
+        self.defaultCostDiff = defaultCostDiff
+
+    def __missing__(self,key):
+        return self.defaultCostDiff
+
 def costDiffDict(argT):
     '''Create a dictionary of costDiff scores between all pairs of locus
-families in lFamNumL.'''
-
-    lFamNumL,familiesO,geneProximityD,proximityThreshold,subRtreeO=argT
-
-    cdD={}
-    for i in range(len(lFamNumL)-1):
-        lf1 = familiesO.getLocusFamily(lFamNumL[i])
-        for j in range(i+1,len(lFamNumL)):
-            lf2 = familiesO.getLocusFamily(lFamNumL[j])
-            cdsc = costDiff(lf1,lf2,geneProximityD,proximityThreshold,subRtreeO)
-            cdD[(lf1.locusFamNum,lf2.locusFamNum)] = cdsc
-            cdD[(lf2.locusFamNum,lf1.locusFamNum)] = cdsc
+families in lFamNumL. costDiff is the difference in rcost depending on
+whether we assume the root of subRtreeO is not proximate or
+proximate, where rcost is a parsimony based cost of evolutionary
+rearrangement, charging 1 for each change in proximity.
+
+We find the pairs of families which are proximate in each strain
+using the positional gene index. We then do the parsimony calculation
+for all these pairs at once, with arrays, going up the tree in
+postorder. Pairs proximate in no strain all have the same score, which
+we calculate once.'''
+
+    lFamNumL,familiesO,genePositionsO,proximityThreshold,subRtreeO=argT
+
+    leafL = list(subRtreeO.leaves())
+    leafIndD = {leaf:i for i,leaf in enumerate(leafL)}
+
+    # genes of each family at the leaves, and the index of their
+    # family and leaf
+    geneL = []
+    famIndL = []
+    leafIndL = []
+    for famInd,lfNum in enumerate(lFamNumL):
+        lfO = familiesO.getLocusFamily(lfNum)
+        for strain in lfO.iterStrains():
+            if strain in leafIndD:
+                for gene in lfO.iterGenesByStrain(strain):
+                    geneL.append(gene)
+                    famIndL.append(famInd)
+                    leafIndL.append(leafIndD[strain])
+    geneAr = numpy.array(geneL,dtype=numpy.int64)
+    geneToFamIndD = dict(zip(geneL,famIndL))
+    geneToLeafIndD = dict(zip(geneL,leafIndL))
+
+    # proximate pairs of families at each leaf
+    k = min(proximityThreshold,genePositionsO.geneProximityRange)
+    gn1Ar,gn2Ar = genePositionsO.neighbors(geneAr,k)
+    pairL = []
+    for gn1,gn2 in zip(gn1Ar.tolist(),gn2Ar.tolist()):
+        famInd2 = geneToFamIndD.get(gn2)
+        if famInd2 != None and famInd2 != geneToFamIndD[gn1]:
+            famInd1 = geneToFamIndD[gn1]
+            pairL.append((min(famInd1,famInd2),max(famInd1,famInd2),geneToLeafIndD[gn1]))
+
+    # pairT for each proximate pair, with a final column for pairs
+    # which aren't proximate anywhere
+    pairT = tuple(sorted(set((famInd1,famInd2) for famInd1,famInd2,leafInd in pairL)))
+    pairIndD = {pair:i for i,pair in enumerate(pairT)}
+    proxAr = numpy.zeros((len(leafL),len(pairT)+1),dtype=bool)
+    for famInd1,famInd2,leafInd in pairL:
+        proxAr[leafInd,pairIndD[(famInd1,famInd2)]] = True
+
+    # rcost for root proximate (T) and not proximate (F) at each node
+    costTD = {}
+    costFD = {}
+    for node in reversed(subRtreeO.preorder()):
+        if subRtreeO.isLeaf(node):
+            # 0 if the state matches the data at this strain, 1 otherwise
+            costTD[node] = (~proxAr[leafIndD[node]]).astype(numpy.int64)
+            costFD[node] = proxAr[leafIndD[node]].astype(numpy.int64)
+        else:
+            costTD[node] = numpy.zeros(len(pairT)+1,dtype=numpy.int64)
+            costFD[node] = numpy.zeros(len(pairT)+1,dtype=numpy.int64)
+            for childNode in subRtreeO.children(node):
+                costTD[node] += numpy.minimum(costTD[childNode],1+costFD[childNode])
+                costFD[node] += numpy.minimum(costFD[childNode],1+costTD[childNode])
+                del costTD[childNode],costFD[childNode]
+    costDiffAr = costFD[subRtreeO.rootNode] - costTD[subRtreeO.rootNode]
+
+    cdD = costDiffD(int(costDiffAr[-1]))
+    for (famInd1,famInd2),cdsc in zip(pairT,costDiffAr[:-1].tolist()):
+        cdD[(lFamNumL[famInd1],lFamNumL[famInd2])] = cdsc
+        cdD[(lFamNumL[famInd2],lFamNumL[famInd1])] = cdsc
     return cdD
 
-def costDiff(lfam1,lfam2,geneProximityD,proximityThreshold,subRtreeO):
-    '''Given two LocusFamilies calculate the difference in rcost depending on
-whether we assume the root is not proximate or proximate.
-    '''
-    memoD = {}
-    t=rcost(lfam1,lfam2,geneProximityD,proximityThreshold,subRtreeO,subRtreeO.rootNode,True,memoD)
-    f=rcost(lfam1,lfam2,geneProximityD,proximityThreshold,subRtreeO,subRtreeO.rootNode,False,memoD)
-    return(f-t)
-
-def createScoreD(locusIslandL,costDiffD):
-    '''Create dictionary of scores between all locus islands at a single node
-(and thus with the same mrca).'''
-    scoreD={}
-    for i in range(len(locusIslandL)-1):
-        for j in range(i+1,len(locusIslandL)):
-            storeScore(locusIslandL[i],locusIslandL[j],costDiffD,scoreD)
-    return scoreD
-
-def storeScore(li0,li1,costDiffD,scoreD):
-    '''Calculate and store score in scoreD. We follow convention that key
-in scoreD should always have the lower island id first.'''
-    if li0.id < li1.id:
-        key = li0.id,li1.id
-        score,orientation=rscore(li0,li1,costDiffD)
-        # rscore returns different things depending on order
-        # so we must be consistent with what we do in key.
-    else:
-        key = li1.id,li0.id
-        score,orientation=rscore(li1,li0,costDiffD)
-        
-    scoreD[key]=(score,orientation)
-    
-def proximity(lfam1,lfam2,geneProximityD,proximityThreshold,strain):
+def proximity(lfam1,lfam2,genePositionsO,proximityThreshold,strain):
     '''Return True if any of the genes at strain from lfam1 are within
 proximityThreshold of genes at that strain for lfam2. proximityThreshold
 is measured in genes, e.g. 1 means the adjacent gene.
     '''
     for gn1 in lfam1.iterGenesByStrain(strain):
         for gn2 in lfam2.iterGenesByStrain(strain):
-            if gn1<gn2: key = (gn1,gn2)
-            else: key = (gn2,gn1)
-            if key in geneProximityD and geneProximityD[key] <= proximityThreshold:
+            if genePositionsO.isProximate(gn1,gn2,proximityThreshold):
                 return True
     return False
   
-def rcost(lfam1,lfam2,geneProximityD,proximityThreshold,subRtreeO,node,rootProximate,memoD):
-    '''Memoized, parsimony based calculation of cost of evolutionary rearrangement
-given lfam1 and lfam2 begin at root of subRtreeO. Assume either
-proximate (nearby) or not proximate at root. This is specificed by the
-argument rootProximate. Charge 1 for each rearrangment.
-    '''
-    memoKey = (lfam1.locusFamNum,lfam2.locusFamNum,node,rootProximate)
-    if memoKey in memoD:
-        return memoD[memoKey]
-    elif subRtreeO.isLeaf(node):
-        prox=proximity(lfam1,lfam2,geneProximityD,proximityThreshold,node)
-        if (prox and rootProximate) or (not prox and not rootProximate):
-            # state given by rootProximate matches adjacency info in our data
-            output = 0
-        else:
-            output = 1
-    else:
-        output = 0
-        for childNode in subRtreeO.children(node):
-            temp = rcost(lfam1,lfam2,geneProximityD,proximityThreshold,subRtreeO,childNode,rootProximate,memoD)
-            chTemp = 1 + rcost(lfam1,lfam2,geneProximityD,proximityThreshold,subRtreeO,childNode,not rootProximate,memoD)
-            output += min(temp,chTemp)
-        
-    memoD[memoKey] = output
-    return output
-
 def rscore(li0,li1,costDiffD):
     '''Returns rearrangement score and orientation between LocusIslands
 li0 and li1. Considers all four ways these locus islands could join
@@ -8,6 +8,17 @@ import os
 
 baseParamStr = """
 
+#### Stage cache ####
+
+# directory where we record, for each stage (parseGenbank, runBlast,
+# calcScores etc.), a hash of its input files and of the parameters it
+# depends on. A stage is skipped if these are unchanged since it was
+# last run, and its output files are still present. Changing a
+# parameter only causes the stages which depend on it (and those
+# downstream of them) to be rerun. Set to None to always run every
+# stage.
+stageCacheDir = 'stageCache'
+
 #### Genbank ####
 # output from parsing genbank files
 
@@ -23,6 +34,11 @@ strainInfoFN = 'strainInfo.txt'
 # unix style file path to fasta files
 fastaFilePath = 'fasta/*.fa'
 
+# stem for the packed sequence store, which holds all sequences in one
+# memory mapped file with an index by gene number, so they can be
+# fetched without parsing the fastas. Set to None to not make one.
+seqStoreStem = 'fasta/seqStore'
+
 # listing of files with problems
 problemGenbankFN = 'problemGenbankFiles.txt'
 
@@ -36,6 +52,18 @@ blastFilePath = 'blast/*.out'
 # and outfiles)
 blastCLine = 'blastp -matrix BLOSUM62 -gapopen 11 -gapextend 1 -seg yes -outfmt "6 qseqid sseqid evalue qlen qstart qend slen sstart send pident score" -evalue '
 
+# program used for the all vs. all protein search. 'ncbi' uses blastp
+# (with blastCLine and blastExecutDirPath), 'diamond' uses DIAMOND
+# (with diamondPath and diamondCLine) which is much faster on large
+# data sets. Either way the output goes in blastFilePath.
+searchBackend = 'ncbi'
+
+# DIAMOND executable and command line (except for evalue, threads as
+# well as db, query and out files). The output format must give the
+# same columns as blastCLine.
+diamondPath = 'diamond'
+diamondCLine = 'blastp --sensitive --max-target-seqs 500 --outfmt 6 qseqid sseqid evalue qlen qstart qend slen sstart send pident score'
+
 # Blast e-value threshold
 evalueThresh = 1e-8
 
@@ -49,6 +77,34 @@ percIdentThresh = 0.35
 # string to join the two strains compared in filename for blast
 blastFileJoinStr = '_-VS-_'
 
+# query fasta files with more than this many proteins are split into
+# chunks which are blasted as separate jobs, so that one large genome
+# doesn't leave a single long job running at the end. Set to None to
+# never split.
+blastQueryChunkSize = 2000
+
+# number of times to retry a blast job which fails before giving up
+blastNumRetries = 2
+
+# number of threads each blast job uses. The number of jobs run at once
+# is numProcesses divided by this.
+blastNumThreads = 1
+
+# If True, instead of running a separate blast for every pair of
+# strains, we blast each strain once against a database combining all
+# the strains, and then split the output into the usual per pair
+# files. This is much faster with many strains. E-values are rescaled
+# to approximate a search against the subject strain alone, so hits
+# with e-values near evalueThresh can differ slightly from the per
+# pair search.
+blastCombinedDb = False
+
+# directory where parsed blast hits are cached in binary form (one
+# file per blast output file). These are reused as long as the blast
+# file and the thresholds above are unchanged. Set to None to always
+# parse the blast text.
+blastHitCacheDir = 'blast/hitCache'
+
 #### Scores ####
 
 # Note: for scores output files, if the extension we use here is
@@ -80,9 +136,16 @@ numSynToTake = 3
 # each direction.
 coreSynWsize = 20
 
+# Core synteny scores are computed in chunks of edges. If this is
+# True, the chunks are spread over numProcesses processes. Otherwise
+# they are done in the main process.
+parallelCoreSynScores = False
+
 # This helps determine the size of the arrays for our hash table of
-# scores. It should be a value >= to 1. If one, it means the hash
-# arrays have as many entries as there are score pairs.
+# scores. It should be a value >= 1. The table has at least
+# hashArrayScaleFactor times as many slots as there are score pairs
+# (rounded up to a power of two), so its load factor is at most
+# 1/hashArrayScaleFactor.
 hashArrayScaleFactor = 2
 
 #### Making species trees ####
@@ -196,7 +259,7 @@ islandOutFN = 'islands.out'
 islandFormationSummaryFN = 'islandFormationSummary.out'
 
 # geneProximityRange tells us how far out we want to go from each gene
-# in recording proximity for geneProximityD
+# in considering proximity during island formation
 geneProximityRange = 2
 
 # In deciding whether to merge two islands, we judge partly based on
@@ -209,7 +272,7 @@ proximityThresholdMerge = 1
 rscThresholdMerge = 0
 
 # maxClusterSize is the maximum size that we make clusters of islands
-# in the first step of the merging process
+# in the first step of the merging process. None means no limit.
 maxClusterSize = 50
 
 #### Reconciliation ####
@@ -1,55 +1,159 @@
-import parasail,statistics,sys
+import parasail,statistics,sys,numpy,glob
 from multiprocessing import set_start_method, Pool
 from . import genomes,blast,trees,Score
 
 #### Global variables for use with multithreading
 
 sharedScoresO = Score.sharedScore()
+sharedSeqO = genomes.sharedSeq()
+sharedNeighborsO = genomes.sharedNeighbors()
+sharedCoreSyntenyO = genomes.sharedNeighbors() # holds aabrh numbers rather than genes
+rawScoreParamT = None # (gapOpen,gapExtend,matrix), set in each rawSc worker
+synScoreBatchSize = 2**13 # edges per call to synScoreArray
+rawScoreTasksPerProcess = 8 # rawSc work is split into this many tasks per process
+coreSynScoreBatchSize = 2**15 # edges per call to coreSynScoreArray
 
 #### raw similarity scores
 
 def calcRawScores(paramD,scoresO):
-    '''Get a global alignment based raw score for every edge in scoresO.'''
+    '''Get a global alignment based raw score for every edge in scoresO.
+
+We first get the self alignment score of every gene, once. Then edges
+are grouped by their lower numbered gene, so a single query profile
+for that gene can be used against all its partners. Work is divided
+into tasks by the estimated number of dynamic programming cells (the
+product of sequence lengths), and the tasks are handed out largest
+first.
+    '''
 
     numProcesses = paramD['numProcesses']
     gapOpen = paramD['gapOpen']
     gapExtend = paramD['gapExtend']
     matrix = paramD['matrix']
     
-    # load sequences
-    seqD=genomes.loadSeq(paramD,"_prot.fa")
-
-    # make list of sets of arguments to be passed to p.map. There
-    # should be numProcesses sets.
-    argumentL = [([],seqD,gapOpen, gapExtend, matrix) for i in range(numProcesses)]
-
-    i=0
-    for g1,g2 in scoresO.iterateEdgesByEndNodes():
-        edgeNum = scoresO.endNodesToEdge(g1,g2)
-        edgeT = edgeNum,g1,g2
-        argumentL[i%numProcesses][0].append(edgeT)
-        i+=1
+    # get sequences in arrays which can be shared. These are passed to
+    # each worker once, via the initializer, rather than with every
+    # group of edges. We use the packed sequence store if there is
+    # one, otherwise load the fastas into shared arrays.
+    storeT = genomes.loadSeqStore(paramD['seqStoreStem'],"_prot.fa")
+    if storeT == None:
+        seqD=genomes.loadSeq(paramD,"_prot.fa")
+        sharedSeqO.createArrays(seqD)
+        del seqD
+    else:
+        sharedSeqO.createArraysFromStore(*storeT)
+    seqBlobAr,offsetAr,presentAr = sharedSeqO.returnArrays()
+    seqLenAr = numpy.diff(numpy.frombuffer(offsetAr,dtype=numpy.int64))
 
+    gn1ByEdgeAr,gn2ByEdgeAr = scoresO.getEndNodeArrays()
+    numTasks = numProcesses * rawScoreTasksPerProcess
+    
+    # self score tasks, for all genes with an edge
+    edgeGenesAr = numpy.union1d(gn1ByEdgeAr,gn2ByEdgeAr)
+    selfArgumentL = splitByCost(edgeGenesAr,seqLenAr[edgeGenesAr]**2,numTasks)
+
+    # edge tasks. Sort edges by gn1, and within that by length of gn2
+    # (so partners of similar size are aligned together). Tasks are
+    # only split between gn1 groups.
+    orderAr = numpy.lexsort((seqLenAr[gn2ByEdgeAr],gn1ByEdgeAr)).astype(numpy.uint32)
+    cellsAr = seqLenAr[gn1ByEdgeAr[orderAr]] * seqLenAr[gn2ByEdgeAr[orderAr]]
+    edgeArgumentL = splitByCost(orderAr,cellsAr,numTasks,gn1ByEdgeAr[orderAr])
+    
     # run in multiple processes
-    with Pool(processes=numProcesses) as p:
+    with Pool(processes=numProcesses,initializer=rawScoreGroupInit,initargs=(seqBlobAr,offsetAr,presentAr,gapOpen,gapExtend,matrix)) as p:
+
+        # self scores
+        selfScoreAr = numpy.zeros(len(seqLenAr),dtype=numpy.int64)
+        for geneAr,scAr in p.imap_unordered(selfScoreGroup, selfArgumentL):
+            selfScoreAr[geneAr] = scAr
+
+        # max possible score for an edge is the shorter seq against
+        # itself (in ties, the second)
+        argumentL = []
+        for edgeAr in edgeArgumentL:
+            gn1Ar = gn1ByEdgeAr[edgeAr]
+            gn2Ar = gn2ByEdgeAr[edgeAr]
+            maxScAr = numpy.where(seqLenAr[gn1Ar] < seqLenAr[gn2Ar],selfScoreAr[gn1Ar],selfScoreAr[gn2Ar])
+            argumentL.append((edgeAr,gn1Ar,gn2Ar,maxScAr))
+        
         # store the results to scoresO as they come in
-        for scoresL in p.imap_unordered(rawScoreGroup, argumentL):
-            for edgeNum,sc in scoresL:
-                scoresO.addScoreByEdge(edgeNum,sc,'rawSc')
+        for edgeAr,scAr in p.imap_unordered(rawScoreGroup, argumentL):
+            scoresO.addScoreByEdge(edgeAr,scAr,'rawSc')
 
     return scoresO
 
+def splitByCost(itemAr,costAr,numTasks,groupAr=None):
+    '''Split itemAr into consecutive pieces of roughly equal total cost,
+giving about numTasks pieces. If groupAr is given, pieces are only
+split where the value in groupAr changes. Returns a list of the pieces
+sorted by decreasing cost, so that the largest are started first.'''
+    if len(itemAr) == 0:
+        return []
+    cumCostAr = numpy.cumsum(costAr,dtype=numpy.float64)
+    targetCost = cumCostAr[-1] / numTasks
+
+    # possible split points
+    if groupAr is None:
+        splitPointAr = numpy.arange(1,len(itemAr))
+    else:
+        splitPointAr = numpy.flatnonzero(groupAr[1:] != groupAr[:-1]) + 1
+
+    # for each multiple of targetCost, the split point closest to it
+    splitCostAr = cumCostAr[splitPointAr-1] # cost before each split point
+    cutL = [0]
+    for i in range(1,numTasks):
+        j = numpy.searchsorted(splitCostAr,i*targetCost)
+        if j == len(splitPointAr) or (j > 0 and i*targetCost - splitCostAr[j-1] < splitCostAr[j] - i*targetCost):
+            j -= 1
+        if j >= 0 and splitPointAr[j] > cutL[-1]:
+            cutL.append(int(splitPointAr[j]))
+    cutL.append(len(itemAr))
+
+    pieceL = []
+    for st,end in zip(cutL[:-1],cutL[1:]):
+        pieceCost = cumCostAr[end-1] - (cumCostAr[st-1] if st > 0 else 0)
+        pieceL.append((pieceCost,st,itemAr[st:end]))
+    pieceL.sort(key=lambda x: (-x[0],x[1]))
+    return [piece for _,_,piece in pieceL]
+
+def rawScoreGroupInit(seqBlobAr,offsetAr,presentAr,gapOpen,gapExtend,matrix):
+    '''Initializer for each separate process doing the rawSc
+calculation. Loads the global sharedSeqO object with shared arrays,
+and stores the alignment parameters.'''
+    global rawScoreParamT
+    sharedSeqO.insertArrays(seqBlobAr,offsetAr,presentAr)
+    rawScoreParamT = (gapOpen,gapExtend,eval(matrix)) # turn matrix from string to parasail matrix object
+
+def selfScoreGroup(geneAr):
+    '''Given an array of genes, return it along with an array of the
+score of each gene's sequence aligned against itself.'''
+    gapOpen,gapExtend,matrix = rawScoreParamT
+    scL = []
+    for gn in geneAr.tolist():
+        seq = sharedSeqO.getSeq(gn)
+        profile = parasail.profile_create_32(seq,matrix)
+        scL.append(parasail.nw_striped_profile_32(profile,seq,gapOpen,gapExtend).score)
+    return geneAr,numpy.array(scL,dtype=numpy.int64)
+
 def rawScoreGroup(argT):
-    '''Given a dictionary of sequences and a list of gene pairs, go
-through each pair and get a needleman wunch based score.
+    '''Given arrays of edges, their end genes and the maximum possible
+score for each, get a needleman wunch based score. Sequences come from
+the global sharedSeqO object. Edges with the same gn1 should be
+adjacent, since we make one query profile for each run of gn1.
     '''
-    edgeL,seqD,gapOpen,gapExtend,matrix = argT
-    matrix = eval(matrix) # turn it from string to parasail matrix object
+    edgeAr,gn1Ar,gn2Ar,maxScAr = argT
+    gapOpen,gapExtend,matrix = rawScoreParamT
     scoresL = []
-    for edgeNum,g1,g2 in edgeL:
-        scaled = rawScore(seqD[g1],seqD[g2],gapOpen,gapExtend,matrix)
-        scoresL.append((edgeNum,scaled))
-    return scoresL
+    profileGn = None
+    for g1,g2,mx in zip(gn1Ar.tolist(),gn2Ar.tolist(),maxScAr.tolist()):
+        if g1 != profileGn:
+            s1 = sharedSeqO.getSeq(g1)
+            profile = parasail.profile_create_32(s1,matrix)
+            profileGn = g1
+        s2 = sharedSeqO.getSeq(g2)
+        sc = parasail.nw_striped_profile_32(profile,s2,gapOpen,gapExtend).score
+        scoresL.append(scaleRawScore(sc,mx,len(s1),len(s2),gapOpen,gapExtend))
+    return edgeAr,numpy.array(scoresL,dtype=numpy.float64)
    
 def rawScore(s1,s2,gapOpen, gapExtend, matrix):
     '''Calculate score between a pair of protein sequences, based on a
@@ -71,11 +175,18 @@ based on the max and min possible scores for these sequences.'''
     sc = r_s1s2.score
     mx = r_self.score # max possible is shorter seq against itself.
     
+    return scaleRawScore(sc,mx,len(s1),len(s2),gapOpen,gapExtend)
+
+def scaleRawScore(sc,mx,len1,len2,gapOpen,gapExtend):
+    '''Scale the alignment score sc to be between 0 and 1. mx is the max
+possible score (the shorter sequence against itself), and len1 and
+len2 are the sequence lengths.'''
+    
     # lowest possible score, if we have gaps opposite all residues and
     # two opens. Note parasail does not count gap extend for the
     # residue where a gap is opened, hence the -2 in the extend
     # formula below.
-    mn = - ( 2 * gapOpen + ( (len(s1)+len(s2) -2 ) * gapExtend ) )
+    mn = - ( 2 * gapOpen + ( (len1+len2 -2 ) * gapExtend ) )
     scaled = (sc - mn) / (mx - mn)
     
     return scaled
@@ -83,10 +194,12 @@ based on the max and min possible scores for these sequences.'''
 
 #### synteny scores
 
-def calcSynScores(scoresO,geneOrderD,paramD):
+def calcSynScores(scoresO,geneOrderD,paramD,edgeAr=None):
     '''Calculate the synteny score between two genes and add to edge
 attributes of scoresO. We only bother making synteny scores for those
-genes that have an edge in scoresO.
+genes that have an edge in scoresO. If edgeAr is given, we only
+calculate scores for the edges in it, and leave the rest of the synSc
+array as it is.
     '''
 
     synWSize = paramD['synWSize']
@@ -94,29 +207,31 @@ genes that have an edge in scoresO.
     numProcesses = paramD['numProcesses']
     
     neighborTD = createNeighborD(geneOrderD,synWSize)
-    scoresO.initializeScoreArray('synSc') # array to store final synSc result in
+    if edgeAr is None:
+        scoresO.initializeScoreArray('synSc') # array to store final synSc result in
+        edgeAr = numpy.arange(scoresO.numEdges,dtype=numpy.uint32)
     
     ## Prepare argument list
     
     # make list of groups of arguments to be passed to p.imap. There
-    # should be numProcesses groups.
-    argumentL = [[[],neighborTD,numSynToTake] for i in range(numProcesses)]
-
-    i=0
-    for gn1,gn2 in scoresO.iterateEdgesByEndNodes():
-        argumentL[i%numProcesses][0].append((gn1,gn2))
-        i+=1
+    # should be numProcesses groups. Edges are passed as arrays.
+    gn1ByEdgeAr,gn2ByEdgeAr = scoresO.getEndNodeArrays()
+    gn1Ar = gn1ByEdgeAr[edgeAr]
+    gn2Ar = gn2ByEdgeAr[edgeAr]
+    argumentL = [(edgeAr[i::numProcesses],gn1Ar[i::numProcesses],gn2Ar[i::numProcesses],numSynToTake) for i in range(numProcesses)]
 
     ## prepare raw arrays to share
     sharedScoresO.createArrays(scoresO,paramD)
+    sharedNeighborsO.createArrays(neighborTD)
+    del neighborTD
 
-    rawScoreAr,hasEdgeAr,hashAr,lenOfRegionAr,colGn1Ar,colGn2Ar,colEdgeAr,hashArrayLen = sharedScoresO.returnArrays()
+    rawScoreAr,hashKeyAr,hashEdgeAr = sharedScoresO.returnArrays()
+    neighborAr,numNeighborRows,numNeighborCols = sharedNeighborsO.returnArrays()
     
     ## Run
-    with Pool(processes=numProcesses,initializer=synScoreGroupInit,initargs=(rawScoreAr,hasEdgeAr,hashAr,lenOfRegionAr,colGn1Ar,colGn2Ar,colEdgeAr,hashArrayLen)) as p:
-        for synScoresL in p.imap_unordered(synScoreGroup, argumentL):
-            for gn1,gn2,sc in synScoresL:
-                scoresO.addScoreByEndNodes(gn1,gn2,sc,'synSc')
+    with Pool(processes=numProcesses,initializer=synScoreGroupInit,initargs=(rawScoreAr,hashKeyAr,hashEdgeAr,neighborAr,numNeighborRows,numNeighborCols)) as p:
+        for edgeAr,synScAr in p.imap_unordered(synScoreGroup, argumentL):
+            scoresO.addScoreByEdge(edgeAr,synScAr,'synSc')
 
     return scoresO
 
@@ -142,37 +257,89 @@ direction.
 
     return neighborTD
 
-def synScoreGroupInit(rawScoreAr,hasEdgeAr,hashAr,lenOfRegionAr,colGn1Ar,colGn2Ar,colEdgeAr,hashArrayLen):
+def synScoreGroupInit(rawScoreAr,hashKeyAr,hashEdgeAr,neighborAr,numNeighborRows,numNeighborCols):
     '''Initializer for each separate process doing the synSc
-calculation. Loads the global sharedScoresO object with shared
-arrays.'''
-    sharedScoresO.insertArrays(rawScoreAr,hasEdgeAr,hashAr,lenOfRegionAr,colGn1Ar,colGn2Ar,colEdgeAr,hashArrayLen)
+calculation. Loads the global sharedScoresO and sharedNeighborsO
+objects with shared arrays.'''
+    sharedScoresO.insertArrays(rawScoreAr,hashKeyAr,hashEdgeAr)
+    sharedNeighborsO.insertArrays(neighborAr,numNeighborRows,numNeighborCols)
 
     
 def synScoreGroup(argsT):
-    '''Given an argument list, including pairs of genes, calculate synteny
-    scores. This function is intended to be called by p.map.
+    '''Given an argument list, including arrays of edges and their end
+genes, calculate synteny scores. This function is intended to be
+called by p.map. Edges are processed in batches of synScoreBatchSize
+with synScoreArray.
     '''
 
-    edgeL,neighborTD,numSynToTake = argsT
-    
-    outL=[]
-    for gn1,gn2 in edgeL:
-        outL.append(synScore(sharedScoresO,gn1,gn2,neighborTD,numSynToTake))
+    edgeAr,gn1Ar,gn2Ar,numSynToTake = argsT
+
+    neighborAr = sharedNeighborsO.getNeighborArray()
+    synScAr = numpy.empty(len(edgeAr),dtype=numpy.float64)
+    for st in range(0,len(edgeAr),synScoreBatchSize):
+        end = st + synScoreBatchSize
+        synScAr[st:end] = synScoreArray(sharedScoresO,gn1Ar[st:end],gn2Ar[st:end],neighborAr,numSynToTake)
         
-    return outL
+    return edgeAr,synScAr
+
+def synScoreArray(sharedScoresO,gn1Ar,gn2Ar,neighborAr,numSynToTake):
+    '''Batched, vectorized version of synScore. gn1Ar and gn2Ar give the
+end genes of a batch of edges, and neighborAr is a two dimensional
+array with the neighbors of each gene (rows padded with -1). Returns
+an array of synteny scores identical to what synScore gives for each
+edge.
+
+For each edge we build a matrix of raw scores between the neighbors of
+gn1 (rows) and gn2 (columns). We then repeatedly take the maximum,
+and knock out its row and column. Taking the first maximum in row
+major order matches the tie breaking in topScore.
+    '''
+    numEdges = len(gn1Ar)
+    neighbors1Ar = neighborAr[gn1Ar]
+    neighbors2Ar = neighborAr[gn2Ar]
+    width = neighborAr.shape[1]
+    if width == 0 or numEdges == 0:
+        return numpy.zeros(numEdges,dtype=numpy.float64)
+
+    # raw scores between all pairs of neighbors. -inf for padding or
+    # where there is no edge.
+    rowGnAr = numpy.broadcast_to(neighbors1Ar[:,:,None],(numEdges,width,width))
+    colGnAr = numpy.broadcast_to(neighbors2Ar[:,None,:],(numEdges,width,width))
+    validAr = (rowGnAr >= 0) & (colGnAr >= 0)
+    scCubeAr = numpy.full((numEdges,width,width),-numpy.inf)
+    scCubeAr[validAr] = sharedScoresO.getScoreByEndNodesArray(rowGnAr[validAr],colGnAr[validAr],'rawSc')
+    scCubeAr[numpy.isnan(scCubeAr)] = -numpy.inf
+    scFlatAr = scCubeAr.reshape(numEdges,width*width)
+
+    # greedy selection. Scores are summed in the same order as
+    # synScore, so the results are identical.
+    edgeIndAr = numpy.arange(numEdges)
+    totalAr = numpy.zeros(numEdges,dtype=numpy.float64)
+    doneAr = numpy.zeros(numEdges,dtype=bool)
+    for i in range(numSynToTake):
+        bestIndAr = scFlatAr.argmax(axis=1)
+        bestScAr = scFlatAr[edgeIndAr,bestIndAr]
+        doneAr |= bestScAr == -numpy.inf
+        totalAr += numpy.where(doneAr,0,bestScAr)
+        # remove row and column of the chosen pair
+        scCubeAr[edgeIndAr,bestIndAr // width,:] = -numpy.inf
+        scCubeAr[edgeIndAr,:,bestIndAr % width] = -numpy.inf
+
+    return totalAr / numSynToTake
         
-def synScore(sharedScoresO,gn1,gn2,neighborTD,numSynToTake):
+def synScore(sharedScoresO,gn1,gn2,neighborsO,numSynToTake):
     '''Given two genes, calculate a synteny score for them. We are given
-    the genes, neighborTD, which contains lists of neighbors for each
-    gene. For the two sets of neighbors, we find the numSynToTake top
-    pairs, and return the average of their scores. The approach is
-    greedy. We find the pair with the best score, add it, then remove
-    those genes and iterate.
+    the genes, and neighborsO, a sharedNeighbors object which gives
+    the neighbors of each gene. For the two sets of neighbors, we find
+    the numSynToTake top pairs, and return the average of their
+    scores. The approach is greedy. We find the pair with the best
+    score, add it, then remove those genes and iterate. This is the
+    pure python version. calcSynScores uses the batched synScoreArray,
+    which gives identical results.
     '''
 
-    L1 = list(neighborTD[gn1])
-    L2 = list(neighborTD[gn2])
+    L1 = list(neighborsO.getNeighbors(gn1))
+    L2 = list(neighborsO.getNeighbors(gn2))
 
     topScL= [0] * numSynToTake # min raw score is 0
 
@@ -208,20 +375,15 @@ each and the score.'''
 #### Calculating the set of all around best reciprocal hit homologs
 #    (used in core synteny scores below)
 
-def createAabrhL(blastFilePath,strainNamesL,evalueThresh,alignCoverThresh,percIdentThresh,aabrhFN):
-    '''Get the sets of all around best reciprocal hits.'''
+def createAabrhL(blastFilePath,strainNamesL,evalueThresh,alignCoverThresh,percIdentThresh,aabrhFN,hitCacheDir=None):
+    '''Get the sets of all around best reciprocal hits, write them to
+aabrhFN and return them as a list of tuples (one gene per strain, in
+the order of strainNamesL). If hitCacheDir is given, blast hits are
+read via the binary hit cache there.'''
 
-    blastDir = blastFilePath.split("*")[0]
-    rHitsL=getAllReciprocalHits(blastDir,strainNamesL,evalueThresh,alignCoverThresh,percIdentThresh)
+    aabrhAr = createAabrhArray(blastFilePath,strainNamesL,evalueThresh,alignCoverThresh,percIdentThresh,hitCacheDir)
+    aabrhHardCoreL = [tuple(row) for row in aabrhAr.tolist()]
     
-    # get sets of genes in first species that have a reciprocal best
-    # hit in each other species. this is to save time in next step.
-    possibleGenesD = getPossibleGenesD(rHitsL)
-
-    # then, out of the possible genes, get those that are all
-    # pairwise reciprocal bets hits
-    aabrhHardCoreL = getAllAroundBRHL(possibleGenesD, rHitsL)
-
     # write it to file
     f=open(aabrhFN,'w')
     for orthoT in aabrhHardCoreL:
@@ -230,6 +392,79 @@ def createAabrhL(blastFilePath,strainNamesL,evalueThresh,alignCoverThresh,percId
         
     return aabrhHardCoreL
 
+def createAabrhArray(blastFilePath,strainNamesL,evalueThresh,alignCoverThresh,percIdentThresh,hitCacheDir=None):
+    '''Return the all around best reciprocal hit sets as an int32 array
+with one row per set and one column per strain (in the order of
+strainNamesL). Rows are sorted by the gene in the first strain. A set
+consists of genes which are all pairwise reciprocal best hits.'''
+
+    blastDir = blastFilePath.split("*")[0]
+    numStrains = len(strainNamesL)
+
+    # best hits for each ordered pair of strains, loaded once
+    bestHitD = {}
+    for i in range(numStrains):
+        for j in range(numStrains):
+            if i != j:
+                bestHitD[(i,j)] = getBestHitArrays(blastDir+strainNamesL[i]+'_-VS-_'+strainNamesL[j]+'.out',evalueThresh,alignCoverThresh,percIdentThresh,hitCacheDir)
+
+    # Candidates are the genes in the first strain with a reciprocal
+    # best hit in every other strain. Columns hold their partners.
+    candAr = None
+    for j in range(1,numStrains):
+        gene0Ar,geneJAr = getReciprocalHitArrays(bestHitD[(0,j)],bestHitD[(j,0)])
+        if candAr is None:
+            candAr = numpy.full((len(gene0Ar),numStrains),-1,dtype=numpy.int64)
+            candAr[:,0] = gene0Ar
+        candAr[:,j] = lookupHits(gene0Ar,geneJAr,candAr[:,0])
+        candAr = candAr[candAr[:,j] != -1]
+    if candAr is None:
+        return numpy.zeros((0,numStrains),dtype=numpy.int32)
+
+    # then keep only those where every other pair of genes are also
+    # reciprocal best hits
+    for i in range(1,numStrains):
+        for j in range(i+1,numStrains):
+            geneIAr,geneJAr = getReciprocalHitArrays(bestHitD[(i,j)],bestHitD[(j,i)])
+            candAr = candAr[lookupHits(geneIAr,geneJAr,candAr[:,i]) == candAr[:,j]]
+
+    return candAr.astype(numpy.int32)
+
+def getBestHitArrays(fileName,evalueThresh,alignCoverThresh,percIdentThresh,hitCacheDir=None):
+    '''Given a BLAST output file, return a pair of arrays (queryAr,
+subjectAr) giving the best hit (lowest evalue) for each query gene
+with any hits passing the thresholds. queryAr is sorted. Among hits
+with equal evalues, the first in the file is taken. If hitCacheDir
+is given, hits are read via the binary hit cache there.'''
+    hitsAr = blast.loadBlastHits(fileName,evalueThresh,alignCoverThresh,percIdentThresh,hitCacheDir)
+    queryAr = hitsAr['queryGene'].astype(numpy.int64)
+    subjectAr = hitsAr['subjectGene'].astype(numpy.int64)
+
+    # stable sort by query then evalue, and take the first hit for
+    # each query
+    orderAr = numpy.lexsort((hitsAr['evalue'],queryAr))
+    queryAr = queryAr[orderAr]
+    firstAr = numpy.ones(len(queryAr),dtype=bool)
+    firstAr[1:] = queryAr[1:] != queryAr[:-1]
+    return queryAr[firstAr],subjectAr[orderAr][firstAr]
+
+def lookupHits(queryAr,subjectAr,geneAr):
+    '''Given best hit arrays (queryAr sorted), return an array with the
+best hit of each gene in geneAr, or -1 if it has none.'''
+    if len(queryAr) == 0:
+        return numpy.full(len(geneAr),-1,dtype=numpy.int64)
+    indAr = numpy.minimum(numpy.searchsorted(queryAr,geneAr),len(queryAr)-1)
+    return numpy.where(queryAr[indAr] == geneAr,subjectAr[indAr],-1)
+
+def getReciprocalHitArrays(bestHits1T,bestHits2T):
+    '''Given the best hits of strain 1 against strain 2, and of 2 against
+1 (each a (queryAr,subjectAr) pair from getBestHitArrays), return
+arrays (gene1Ar,gene2Ar) of the reciprocal best hits, sorted by
+gene1Ar.'''
+    query1Ar,subject1Ar = bestHits1T
+    query2Ar,subject2Ar = bestHits2T
+    recipAr = lookupHits(query2Ar,subject2Ar,subject1Ar) == query1Ar
+    return query1Ar[recipAr],subject1Ar[recipAr]
 
 def loadOrthos(aabrhFN):
     '''Reads the all around best reciprocal hits orthologs file. One set
@@ -247,131 +482,13 @@ per line.'''
     f.close()
     return orthoL
 
-def getAllReciprocalHits(blastDir,strainNamesL,evalueThresh,alignCoverThresh,percIdentThresh):
-    '''return an upper-diagonal (N-1)xN matrix where each entry
-    [i][j] (j > i) contains a dictionary of best reciprocal hits
-    between species i and species j, as indexed in list strainNamesL;
-    key is always gene in species i, and value gene in species j'''
-
-    rHitsL = []
-    
-    for i in range(len(strainNamesL)): 
-        rHitsL.append([])
-        # fill in the rest of the row with the dictionary of best
-        # reciprocal hits between species i and j (keyed by species i)
-        for j in range(len(strainNamesL)):
-            if j > i:
-                rHitsL[i].append(getReciprocalHits(strainNamesL[i],strainNamesL[j],blastDir,evalueThresh,alignCoverThresh,percIdentThresh))
-            else:
-                rHitsL[i].append(None)
-    return rHitsL
-
-
-def getReciprocalHits(strainName1,strainName2,blastDir,evalueThresh,alignCoverThresh,percIdentThresh):
-    '''Given strain names and blast file directory name, load hits between
-two strains in each direction, then go through and keep only the
-reciprocal hits. Returns dictionary where keys are genes in strain 1
-and values are corresponding genes in strain 2.'''
-    # get best hits of 1 blasted against 2...
-    hits1D = getHits(blastDir+strainName1+'_-VS-_'+strainName2+'.out',evalueThresh,alignCoverThresh,percIdentThresh)
-    # ...and 2 blasted against 1
-    hits2D = getHits(blastDir+strainName2+'_-VS-_'+strainName1+'.out',evalueThresh,alignCoverThresh,percIdentThresh)
-
-    # then store only the reciprocal best hits
-    recipHitsD = {}
-    for query in hits1D:
-        hit = hits1D[query]
-        nextHit = hits2D.get(hit)
-        if nextHit == query:
-            recipHitsD[query] = hit
-
-    return recipHitsD
-
-def getHits(fileName, evalueThresh,alignCoverThresh,percIdentThresh):
+def getHits(fileName, evalueThresh,alignCoverThresh,percIdentThresh,hitCacheDir=None):
     """Given a BLAST output file, returns a dictionary keyed by the genes
     in the query species, with the values being the top hit (if any)
-    for those genes. Assumes the blast hits for each query are given
-    from most to least significant. which appears to be the
-    case. Thresholds for minimum similarity and maximum length
-    difference are globally defined.
+    for those genes (see getBestHitArrays).
     """
-    hitsD = {}
-    tempEvalueD = {} # just to help us get the hit with the best evalue
-    for queryGene,subjectGene,evalue,alCov,pident,score in blast.parseBlastFile(fileName,evalueThresh,alignCoverThresh,percIdentThresh):
-
-        if not queryGene in hitsD or evalue < tempEvalueD[queryGene]:
-            # if it isn't there, or if new hit has a better evalue, record
-            tempEvalueD[queryGene] = evalue
-            hitsD[queryGene] = subjectGene
-
-    return hitsD           
-
-def getPossibleGenesD(rHitsL):
-    '''return dict containing an entry for each gene in species 0 that has
-    a best reciprocal hit in all other species.  format of an entry is
-    gene:(tuple of recip hit genes in other species). We do this to
-    quickly eliminate things we aren't interested in.
-    '''
-    possibleGenesD = {}
-    firstRow = rHitsL[0]
-    firstDict = firstRow[1]
-    # we just look at first dict, since the all around brh sets will
-    # have a gene in this with matches in all strains.
-    for gene in firstDict:
-        isPossible = True
-        hitsL = [firstDict[gene]]
-        for colInd in range(2, len(firstRow)):
-            compareDict = firstRow[colInd]
-            hit = compareDict.get(gene)
-            if hit == None:
-                isPossible = False
-                break
-            else:
-                hitsL.append(hit)
-        if isPossible:
-            possibleGenesD[gene] = tuple(hitsL)
-    return possibleGenesD
-
-
-def getAllAroundBRHL(possibleGenesD, rHitsL):
-    '''Given a matrix of reciprocal hit dictionaries in rHitsL, and a dict
-of possible hits, return a list of all around best reciprocal hits. In
-the form of a list of lists, where each sublist is one set of
-orthologs.'''
-    
-    aabrhHardCoreL = []
-
-    genesL = list(possibleGenesD.keys())
-    genesL.sort() # sort so we get consistent order
-    
-    for gene in genesL:
-        hitsT = possibleGenesD[gene]
-
-        # check that each gene in the list of hitsT is best reciprocal 
-        # hit of all following genes
-        isOrth = True
-        for hit1Index in range(len(hitsT)):
-            hit1 = hitsT[hit1Index]
-
-            # check that current gene in list is best reciprocal hit
-            # of all following genes in list
-            for hit2Index in range(hit1Index+1, len(hitsT)): # j always > i
-                hit2 = hitsT[hit2Index]
-                sp1sp2Dict = rHitsL[hit1Index+1][hit2Index+1]
-                match = sp1sp2Dict.get(hit1)
-                if match != hit2: # oh noes! not reciprocal!
-                    isOrth = False
-                    break
-
-            # if any pair not reciprocal best hits, then we fail
-            if not isOrth:
-                break
-
-        # if we get through all genes without finding that some aren't
-        # reciprocal best hits, then we keep this list of genes
-        if isOrth:
-            aabrhHardCoreL.append((gene,)+hitsT)
-    return aabrhHardCoreL
+    queryAr,subjectAr = getBestHitArrays(fileName,evalueThresh,alignCoverThresh,percIdentThresh,hitCacheDir)
+    return dict(zip(queryAr.tolist(),subjectAr.tolist()))
 
 
 #### Core synteny scores
@@ -387,22 +504,47 @@ genes shared.'''
     percIdentThresh = paramD['percIdentThresh']
     aabrhFN = paramD['aabrhFN']
     coreSynWsize = paramD['coreSynWsize']
+    hitCacheDir = paramD['blastHitCacheDir']
     
-    aabrhHardCoreL = createAabrhL(blastFilePath,strainNamesL,evalueThresh,alignCoverThresh,percIdentThresh,aabrhFN)
+    aabrhHardCoreL = createAabrhL(blastFilePath,strainNamesL,evalueThresh,alignCoverThresh,percIdentThresh,aabrhFN,hitCacheDir)
 
     geneToAabrhD = createGeneToAabrhD(aabrhHardCoreL)
-    coreSyntenyD = createCoreSyntenyD(geneToAabrhD,geneOrderD,coreSynWsize)
-
-    # Not parallelized. Pretty fast already.
 
-    # loop over all edges in scoresO, adding corresponding core syn score
+    # core synteny context of every gene
+    coreSyntenyAr = createCoreSyntenyArray(geneToAabrhD,geneOrderD,coreSynWsize)
+    
     scoresO.initializeScoreArray('coreSynSc') # create array
-    for gn1,gn2 in scoresO.iterateEdgesByEndNodes():
-        coreSynSc=coreSynScore(coreSyntenyD[gn1],coreSyntenyD[gn2])
-        scoresO.addScoreByEndNodes(gn1,gn2,coreSynSc,'coreSynSc')
+    edgeAr = numpy.arange(scoresO.numEdges,dtype=numpy.uint32)
+    calcCoreSynScoresForEdges(scoresO,coreSyntenyAr,edgeAr,paramD)
         
     return scoresO
 
+def calcCoreSynScoresForEdges(scoresO,coreSyntenyAr,edgeAr,paramD):
+    '''Given a core synteny array (from createCoreSyntenyArray),
+calculate core synteny scores for the edges in edgeAr and store them
+in the coreSynSc array of scoresO.'''
+
+    numProcesses = paramD['numProcesses']
+    
+    sharedCoreSyntenyO.createArraysFromMatrix(coreSyntenyAr)
+
+    # edges, in chunks
+    gn1ByEdgeAr,gn2ByEdgeAr = scoresO.getEndNodeArrays()
+    argumentL = []
+    for st in range(0,len(edgeAr),coreSynScoreBatchSize):
+        chunkEdgeAr = edgeAr[st:st+coreSynScoreBatchSize]
+        argumentL.append((chunkEdgeAr,gn1ByEdgeAr[chunkEdgeAr],gn2ByEdgeAr[chunkEdgeAr]))
+    
+    if paramD['parallelCoreSynScores']:
+        coreSyntenyRawAr,numRows,numCols = sharedCoreSyntenyO.returnArrays()
+        with Pool(processes=numProcesses,initializer=coreSynScoreGroupInit,initargs=(coreSyntenyRawAr,numRows,numCols)) as p:
+            for chunkEdgeAr,coreSynScAr in p.imap_unordered(coreSynScoreGroup, argumentL):
+                scoresO.addScoreByEdge(chunkEdgeAr,coreSynScAr,'coreSynSc')
+    else:
+        for argT in argumentL:
+            chunkEdgeAr,coreSynScAr = coreSynScoreGroup(argT)
+            scoresO.addScoreByEdge(chunkEdgeAr,coreSynScAr,'coreSynSc')
+
 def createGeneToAabrhD(aabrhHardCoreL):
     '''Create a dict where key corresponds to gene number and the
 value at that location is the number of the aabrh group to which the
@@ -414,45 +556,52 @@ the index where they occur in aabrhHardCoreL.'''
             geneToAabrhD[geneNum] = aabrhNum
     return geneToAabrhD
 
-def createCoreSyntenyD(geneToAabrhD,geneOrderD,coreSynWsize):
-    '''Create and return core synteny tuple. The index of this corresponds
-to gene number. The value at that index is a tuple of the aabrh
-numbers for the syntenic genes within coreSynWsize.'''
-
-    coreSyntenyD = {}
-    for geneNumT,aabrhNumT in iterateGeneAabrhPairsOnContig(geneToAabrhD,geneOrderD):
-        for pos in range(len(geneNumT)):
-            geneNum = geneNumT[pos]
-            coreSyntenyD[geneNum] = getAabrhContext(pos,aabrhNumT,coreSynWsize)
-    return coreSyntenyD
-                    
-def getAabrhContext(pos,aabrhNumT,coreSynWsize):
-    '''Starting at index pos in aabrhNumT, return the coreSynWsize/2 aabrh
-group numbers to each side (not including the gene at pos).'''
+def createCoreSyntenyArray(geneToAabrhD,geneOrderD,coreSynWsize):
+    '''Create and return a core synteny array. Row i corresponds to gene
+number i, and holds the aabrh numbers of the nearest coreSynWsize/2
+core genes on each side on its contig (not including the gene itself),
+first going forward, then going backward. Rows are padded on the right
+with -1.'''
 
     numToTakeEachSide = int(coreSynWsize/2)
-    coreSynL=[]
-
-    # go forward from gene
-    ct=0
-    j=pos+1
-    while j < len(aabrhNumT) and ct < numToTakeEachSide:
-        if aabrhNumT[j]!=None:
-            coreSynL.append(aabrhNumT[j])
-            ct+=1
-        j+=1
-
-    # go backward from gene
-    ct=0
-    j=pos-1
-    while j >= 0 and ct < numToTakeEachSide:
-        if aabrhNumT[j]!=None:
-            coreSynL.append(aabrhNumT[j])
-            ct+=1
-        j-=1
-
-    return tuple(coreSynL)
+    maxGeneNum = -1
+    for contigT in geneOrderD.values():
+        for geneNumT in contigT:
+            if len(geneNumT) > 0:
+                maxGeneNum = max(maxGeneNum,max(geneNumT))
+    coreSyntenyAr = numpy.full((maxGeneNum+1,2*numToTakeEachSide),-1,dtype=numpy.int32)
+    offsetAr = numpy.arange(numToTakeEachSide)
 
+    for geneNumT,aabrhNumT in iterateGeneAabrhPairsOnContig(geneToAabrhD,geneOrderD):
+        geneNumAr = numpy.array(geneNumT,dtype=numpy.int64)
+        aabrhNumAr = numpy.array([-1 if a == None else a for a in aabrhNumT],dtype=numpy.int32)
+        corePosAr = numpy.flatnonzero(aabrhNumAr != -1) # positions of core genes
+        if len(corePosAr) == 0:
+            continue # rows stay all -1
+        posAr = numpy.arange(len(geneNumAr))
+        lastCoreInd = len(corePosAr) - 1
+
+        # forward from each gene: the next numToTakeEachSide core
+        # genes after it
+        fwdIndAr = numpy.searchsorted(corePosAr,posAr,side='right')[:,None] + offsetAr
+        fwdValidAr = fwdIndAr <= lastCoreInd
+        fwdAr = numpy.where(fwdValidAr,aabrhNumAr[corePosAr[numpy.minimum(fwdIndAr,lastCoreInd)]],-1)
+
+        # backward from each gene: the core genes before it, nearest
+        # first
+        bwdIndAr = numpy.searchsorted(corePosAr,posAr,side='left')[:,None] - 1 - offsetAr
+        bwdValidAr = bwdIndAr >= 0
+        bwdAr = numpy.where(bwdValidAr,aabrhNumAr[corePosAr[numpy.maximum(bwdIndAr,0)]],-1)
+
+        # pack valid values to the left of each row, forward then
+        # backward
+        rowAr = numpy.concatenate((fwdAr,bwdAr),axis=1)
+        validAr = numpy.concatenate((fwdValidAr,bwdValidAr),axis=1)
+        packOrderAr = numpy.argsort(~validAr,axis=1,kind='stable')
+        coreSyntenyAr[geneNumAr] = numpy.take_along_axis(rowAr,packOrderAr,axis=1)
+
+    return coreSyntenyAr
+                    
 def iterateGeneAabrhPairsOnContig(geneToAabrhD,geneOrderD):
     '''Iterate over contigs in geneOrderD, yielding matching tuples, one
     with gene numbers, the other with aabrh numbers.
@@ -476,23 +625,104 @@ None if it has none.'''
             aabrhNumL.append(None)
     return tuple(aabrhNumL)
 
-def coreSynScore(synT1,synT2):
-    '''Given two tuples representing the core genes surrounding each of
-two genes, determine the number of shared core genes in each. Return
-this, divided by the minimum of the two tuple lengths. Values will be
-between 0 and 1.
+def coreSynScoreGroupInit(coreSyntenyRawAr,numRows,numCols):
+    '''Initializer for each separate process doing the coreSynSc
+calculation. Loads the global sharedCoreSyntenyO object with the
+shared array.'''
+    sharedCoreSyntenyO.insertArrays(coreSyntenyRawAr,numRows,numCols)
+
+def coreSynScoreGroup(argT):
+    '''Given an array of edges, and arrays of their end genes, return the
+edges and an array of core synteny scores.'''
+    edgeAr,gn1Ar,gn2Ar = argT
+    coreSyntenyAr = sharedCoreSyntenyO.getNeighborArray()
+    return edgeAr,coreSynScoreArray(coreSyntenyAr[gn1Ar],coreSyntenyAr[gn2Ar])
+
+def coreSynScoreArray(syn1Ar,syn2Ar):
+    '''Calculate core synteny scores. syn1Ar and syn2Ar are two
+dimensional arrays, with the core synteny context of the first and
+second gene of each edge in corresponding rows (padded with -1). The
+score for an edge is the number of core genes in the first context
+that are also in the second, divided by the smaller of the two context
+sizes (0 if either is empty). Returns an array of scores between 0
+and 1.'''
+    numSurrounding1Ar = (syn1Ar != -1).sum(axis=1)
+    numSurrounding2Ar = (syn2Ar != -1).sum(axis=1)
+    minNumSurroundingAr = numpy.minimum(numSurrounding1Ar,numSurrounding2Ar)
+
+    # count entries of syn1Ar that are somewhere in the same row of
+    # syn2Ar. Comparing one column of syn2Ar at a time is much faster
+    # than broadcasting over a third axis.
+    sharedAr = numpy.zeros(syn1Ar.shape,dtype=bool)
+    for j in range(syn2Ar.shape[1]):
+        sharedAr |= syn1Ar == syn2Ar[:,j:j+1]
+    sharedAr &= syn1Ar != -1
+    ctAr = sharedAr.sum(axis=1)
+
+    # avoid div by 0
+    scAr = numpy.zeros(len(ctAr),dtype=numpy.float64)
+    nonZeroAr = minNumSurroundingAr > 0
+    scAr[nonZeroAr] = ctAr[nonZeroAr] / minNumSurroundingAr[nonZeroAr]
+    return scAr
+
+#### Adding genomes to an existing data set
+
+def calcScoresForNewStrains(scoresO,newStrainNamesT,strainNamesT,oldAabrhHardCoreL,geneOrderD,paramD,aabrhOutFN):
+    '''Given scoresO, holding the scores for an existing set of strains,
+add edges and scores for the strain pairs involving the strains in
+newStrainNamesT. strainNamesT contains both old and new strains, and
+oldAabrhHardCoreL is the aabrh set from before the new strains were
+added. Only the new edges get raw and synteny scores. Core synteny
+scores are calculated for the new edges, and for any old edge where
+the core synteny context of one of its genes has changed. The new
+aabrh set is written to aabrhOutFN.'''
+
+    ## new edges and their raw scores
+    newScoresO = Score.Score()
+    blastFnByPairD = newScoresO.getBlastFnByPairD(glob.glob(paramD['blastFilePath']),paramD['blastFileJoinStr'],strainNamesT)
+    newBlastFnL = []
+    for strainPair,blastFnL in blastFnByPairD.items():
+        if strainPair[0] in newStrainNamesT or strainPair[1] in newStrainNamesT:
+            newBlastFnL.extend(blastFnL)
+    newScoresO.initializeDataAttributes(newBlastFnL,paramD,strainNamesT)
+    newScoresO = calcRawScores(paramD,newScoresO)
+
+    oldNumEdges = scoresO.numEdges
+    scoresO.appendEdges(newScoresO)
+    del newScoresO
+    newEdgeAr = numpy.arange(oldNumEdges,scoresO.numEdges,dtype=numpy.uint32)
+
+    ## synteny scores. Old genes keep their neighbors, and the raw
+    ## scores between old genes don't change, so only new edges need
+    ## these.
+    scoresO = calcSynScores(scoresO,geneOrderD,paramD,newEdgeAr)
+
+    ## core synteny scores. Adding strains changes the aabrh set, so
+    ## we compare the context of each gene before and after.
+    blastFilePath = paramD['blastFilePath']
+    coreSynWsize = paramD['coreSynWsize']
+    aabrhHardCoreL = createAabrhL(blastFilePath,strainNamesT,paramD['evalueThresh'],paramD['alignCoverThresh'],paramD['percIdentThresh'],aabrhOutFN,paramD['blastHitCacheDir'])
+    coreSyntenyAr = createCoreSyntenyArray(createGeneToAabrhD(aabrhHardCoreL),geneOrderD,coreSynWsize)
+    oldCoreSyntenyAr = createCoreSyntenyArray(createGeneToAabrhD(oldAabrhHardCoreL),geneOrderD,coreSynWsize)
+    changedGeneAr = getChangedCoreSyntenyGenes(oldCoreSyntenyAr,oldAabrhHardCoreL,coreSyntenyAr,aabrhHardCoreL)
+
+    gn1ByEdgeAr,gn2ByEdgeAr = scoresO.getEndNodeArrays()
+    updateEdgeAr = numpy.flatnonzero(changedGeneAr[gn1ByEdgeAr] | changedGeneAr[gn2ByEdgeAr])
+    updateEdgeAr = numpy.union1d(updateEdgeAr,newEdgeAr).astype(numpy.uint32)
+    calcCoreSynScoresForEdges(scoresO,coreSyntenyAr,updateEdgeAr,paramD)
+    
+    return scoresO
 
-    '''
-    minNumSurrounding = min(len(synT1),len(synT2))
-    if minNumSurrounding == 0:
-        # avoid div by 0
-        return 0
-    else:
-        ct=0
-        for cgene in synT1:
-            if cgene in synT2:
-                ct+=1
-        return ct/minNumSurrounding
+def getChangedCoreSyntenyGenes(oldCoreSyntenyAr,oldAabrhHardCoreL,coreSyntenyAr,aabrhHardCoreL):
+    '''Compare two core synteny arrays made with different aabrh
+sets. Returns a boolean array, indexed by gene, which is True where
+the core synteny context of a gene differs. Aabrh groups are
+numbered by their position in each list, so we compare them by their
+lowest numbered gene instead.'''
+    oldLowestGeneAr = numpy.array([min(T) for T in oldAabrhHardCoreL]+[-1],dtype=numpy.int64)
+    lowestGeneAr = numpy.array([min(T) for T in aabrhHardCoreL]+[-1],dtype=numpy.int64)
+    # -1 padding indexes the last element, which is -1
+    return (oldLowestGeneAr[oldCoreSyntenyAr] != lowestGeneAr[coreSyntenyAr]).any(axis=1)
 
 #### Plotting scores
 
@@ -0,0 +1,224 @@
+# module for keeping track of which xenoGI stages need to be rerun.
+import os, sys, json, glob, hashlib, shutil
+
+#### Stage definitions
+
+# For each stage we list:
+#   paramL: the parameters in paramD which can affect its output
+#   (parameters like numProcesses which can't are left out).
+#   inputL: parameters naming input files which are not made by
+#   another stage. We hash the contents of these.
+#   upstreamL: the stages whose output this stage reads.
+#   outputL: parameters naming the files this stage makes.
+#   snapshotL: outputs which a later stage overwrites (refine rewrites
+#   families and islands). We keep a copy of these, so they can be
+#   put back if a stage downstream of this one needs to be rerun.
+# Parameters naming files can be unix style paths with wildcards, or
+# None.
+
+familyParamL = ['geneInfoFN','blastFamilyFN','initFamilyFN','originFamilyFN','familyFormationSummaryFN','rootFocalClade','duplicationCost','transferCost','lossCost','originCost','rearrangeCost','reconcilePermissiveOriginGeneListPath','DTLRcostPermissiveOrigin','originCostPermissiveOrigin','scoreHistNumBins','homologRightPeakLimit','widthRelHeight','homologPeakWidthCase1','homologRequiredProminenceCase1','homologLeftPeakLimitCase1','homologPeakWidthCase2','homologRequiredProminenceCase2','homologLeftPeakLimitCase2','homologPeakWidthCase3','homologRequiredProminenceCase3','homologLeftPeakLimitCase3','nonHomologPeakWidth','nonHomologPeakProminence','nonHomologLeftPeakLimit','nonHomologRightPeakLimit','quantileForObtainingSplitThresholds','multiplierForObtainingSplitThresholds','maxBlastFamSizeMultiplier','maxInitialFamSizeMultiplier','forceSplitUtreeBalanceMultiplier','quantileForObtainingSynThresholds','multiplierForObtainingSynThresholds','geneFamilyTreesDir','aabrhHardCoreGeneTreeFileStem','blastFamGeneTreeFileStem','dnaBasedGeneTrees','musclePath','fastTreePath']
+
+islandParamL = ['islandOutFN','islandFormationSummaryFN','rootFocalClade','geneProximityRange','proximityThresholdMerge','rscThresholdMerge','maxClusterSize']
+
+stageD = {
+    'parseGenbank': {
+        'paramL': ['genbankFilePath','fileNameMapFN','fastaFilePath','seqStoreStem','dnaBasedGeneTrees','geneInfoFN','geneOrderFN','strainInfoFN','problemGenbankFN'],
+        'inputL': ['genbankFilePath','fileNameMapFN'],
+        'upstreamL': [],
+        'outputL': ['geneInfoFN','geneOrderFN','strainInfoFN','fastaFilePath'],
+        'snapshotL': []},
+    'runBlast': {
+        'paramL': ['fastaFilePath','strainInfoFN','blastFilePath','blastCLine','evalueThresh','blastExecutDirPath','blastFileJoinStr','blastCombinedDb','searchBackend','diamondPath','diamondCLine'],
+        'inputL': [],
+        'upstreamL': ['parseGenbank'],
+        'outputL': ['blastFilePath'],
+        'snapshotL': []},
+    'calcScores': {
+        'paramL': ['strainInfoFN','geneInfoFN','geneOrderFN','fastaFilePath','blastFilePath','blastFileJoinStr','evalueThresh','alignCoverThresh','percIdentThresh','gapOpen','gapExtend','matrix','synWSize','numSynToTake','coreSynWsize','scoresFN','aabrhFN'],
+        'inputL': [],
+        'upstreamL': ['parseGenbank','runBlast'],
+        'outputL': ['scoresFN','aabrhFN'],
+        'snapshotL': []},
+    'makeSpeciesTree': {
+        'paramL': ['aabrhFN','outGroup','speciesTreeFN','makeSpeciesTreeWorkingDir','aabrhHardCoreGeneTreesFN','astralTreeFN','astralPath','javaPath','geneFamilyTreesDir','aabrhHardCoreGeneTreeFileStem','dnaBasedGeneTrees','musclePath','fastTreePath'],
+        'inputL': [],
+        'upstreamL': ['parseGenbank','calcScores'],
+        'outputL': ['speciesTreeFN'],
+        'snapshotL': []},
+    'makeFamilies': {
+        'paramL': familyParamL,
+        'inputL': ['speciesTreeFN','reconcilePermissiveOriginGeneListPath'],
+        'upstreamL': ['parseGenbank','calcScores'],
+        'outputL': ['initFamilyFN','originFamilyFN','familyFormationSummaryFN'],
+        'snapshotL': ['initFamilyFN','originFamilyFN','familyFormationSummaryFN']},
+    'makeIslands': {
+        'paramL': islandParamL,
+        'inputL': ['speciesTreeFN'],
+        'upstreamL': ['parseGenbank','makeFamilies'],
+        'outputL': ['islandOutFN','islandFormationSummaryFN'],
+        'snapshotL': ['islandOutFN','islandFormationSummaryFN']},
+    'refine': {
+        'paramL': familyParamL + islandParamL + ['upperNumMprThreshold','geneProximityRangeRefineFamilies','islandLenThresholdRefineFamilies'],
+        'inputL': ['speciesTreeFN'],
+        'upstreamL': ['parseGenbank','makeFamilies','makeIslands'],
+        'outputL': ['initFamilyFN','originFamilyFN','familyFormationSummaryFN','islandOutFN','islandFormationSummaryFN'],
+        'snapshotL': []}
+    }
+
+manifestFN = 'manifest.json'
+hashChunkSize = 2**20
+
+#### Functions
+
+def runStage(stageName,paramD,stageFunc,*args):
+    '''Run stageFunc(paramD,*args), which carries out stage stageName,
+unless the stage was already run with the same input files and
+relevant parameters, its upstream stages haven't been rerun since, and
+its output files are still there. If paramD['stageCacheDir'] is None,
+we always run.'''
+
+    stageCacheDir = paramD.get('stageCacheDir')
+    if stageCacheDir == None:
+        stageFunc(paramD,*args)
+        return
+
+    manifestD = loadManifest(stageCacheDir)
+    key = stageKey(stageName,paramD,manifestD)
+    if isStageCurrent(stageName,key,paramD,manifestD):
+        print("Skipping "+stageName+", its inputs and parameters are unchanged since the last run.",file=sys.stderr)
+        saveManifest(stageCacheDir,manifestD)
+        return
+
+    # upstream outputs may have been overwritten by a later stage
+    # (e.g. refine), put back the versions this stage should read.
+    for upstreamName in stageD[stageName]['upstreamL']:
+        restoreSnapshots(upstreamName,paramD,manifestD)
+
+    # forget the old record before running, so if we fail part way
+    # this stage and those downstream of it will be rerun.
+    manifestD['stageD'].pop(stageName,None)
+    saveManifest(stageCacheDir,manifestD)
+
+    stageFunc(paramD,*args)
+
+    recordStage(stageName,paramD)
+
+def recordStage(stageName,paramD):
+    '''Record in the manifest that stageName has been completed with the
+current input files and parameters.'''
+    stageCacheDir = paramD.get('stageCacheDir')
+    if stageCacheDir == None:
+        return
+    manifestD = loadManifest(stageCacheDir)
+    key = stageKey(stageName,paramD,manifestD)
+
+    outputHashD = {}
+    for fnKey in stageD[stageName]['outputL']:
+        outputHashD[fnKey] = pathHash(paramD.get(fnKey),manifestD)
+
+    # keep copies of outputs a later stage will overwrite
+    snapshotDir = os.path.join(stageCacheDir,stageName)
+    if stageD[stageName]['snapshotL'] != [] and not os.path.isdir(snapshotDir):
+        os.makedirs(snapshotDir)
+    for fnKey in stageD[stageName]['snapshotL']:
+        shutil.copyfile(paramD[fnKey],os.path.join(snapshotDir,fnKey))
+
+    manifestD['stageD'][stageName] = {'key':key,'outputHashD':outputHashD}
+    saveManifest(stageCacheDir,manifestD)
+
+def isStageCurrent(stageName,key,paramD,manifestD):
+    '''Return True if stageName was last run with key, and its outputs
+are still present and unchanged. Outputs which have been overwritten
+by a later stage are ok if we have a snapshot of them.'''
+    recordD = manifestD['stageD'].get(stageName)
+    if recordD == None or recordD['key'] != key:
+        return False
+    snapshotDir = os.path.join(paramD['stageCacheDir'],stageName)
+    for fnKey,recordedHash in recordD['outputHashD'].items():
+        if paramD.get(fnKey) != None and expandPath(paramD[fnKey]) == []:
+            return False # missing
+        if pathHash(paramD.get(fnKey),manifestD) != recordedHash:
+            if fnKey not in stageD[stageName]['snapshotL'] or not os.path.isfile(os.path.join(snapshotDir,fnKey)):
+                return False
+    return True
+
+def restoreSnapshots(stageName,paramD,manifestD):
+    '''For outputs of stageName which have been overwritten since it ran,
+copy back the snapshot we kept.'''
+    recordD = manifestD['stageD'].get(stageName)
+    if recordD == None:
+        return
+    snapshotDir = os.path.join(paramD['stageCacheDir'],stageName)
+    for fnKey in stageD[stageName]['snapshotL']:
+        snapshotFN = os.path.join(snapshotDir,fnKey)
+        if pathHash(paramD[fnKey],manifestD) != recordD['outputHashD'][fnKey] and os.path.isfile(snapshotFN):
+            shutil.copyfile(snapshotFN,paramD[fnKey])
+
+def stageKey(stageName,paramD,manifestD):
+    '''Return a hash of the relevant parameters, input files and the keys
+of upstream stages for stageName.'''
+    h = hashlib.sha256()
+    for paramKey in stageD[stageName]['paramL']:
+        h.update(repr((paramKey,paramD.get(paramKey))).encode())
+    for fnKey in stageD[stageName]['inputL']:
+        h.update(repr((fnKey,pathHash(paramD.get(fnKey),manifestD))).encode())
+    for upstreamName in stageD[stageName]['upstreamL']:
+        upstreamRecordD = manifestD['stageD'].get(upstreamName,{})
+        h.update(repr((upstreamName,upstreamRecordD.get('key'))).encode())
+    return h.hexdigest()
+
+def expandPath(path):
+    '''Return a sorted list of the files matching path, which may contain
+wildcards.'''
+    return sorted(fn for fn in glob.glob(path) if os.path.isfile(fn))
+
+def pathHash(path,manifestD):
+    '''Return a hash of the names and contents of the files matching
+path. Returns None if path is None.'''
+    if path == None:
+        return None
+    h = hashlib.sha256()
+    for fn in expandPath(path):
+        h.update(repr((fn,fileHash(fn,manifestD))).encode())
+    return h.hexdigest()
+
+def fileHash(fn,manifestD):
+    '''Return a hash of the contents of file fn. We store hashes in
+manifestD along with the size and modification time of the file, and
+only rehash if these have changed.'''
+    statO = os.stat(fn)
+    fileHashD = manifestD['fileHashD']
+    if fn in fileHashD:
+        size,mtime,digest = fileHashD[fn]
+        if size == statO.st_size and mtime == statO.st_mtime_ns:
+            return digest
+    h = hashlib.sha256()
+    with open(fn,'rb') as f:
+        while True:
+            chunk = f.read(hashChunkSize)
+            if not chunk:
+                break
+            h.update(chunk)
+    digest = h.hexdigest()
+    fileHashD[fn] = [statO.st_size,statO.st_mtime_ns,digest]
+    return digest
+
+def loadManifest(stageCacheDir):
+    '''Load the manifest from stageCacheDir, or return an empty one if
+there isn't one.'''
+    fn = os.path.join(stageCacheDir,manifestFN)
+    if not os.path.isfile(fn):
+        return {'stageD':{},'fileHashD':{}}
+    with open(fn,'r') as f:
+        return json.load(f)
+
+def saveManifest(stageCacheDir,manifestD):
+    '''Write manifestD to stageCacheDir. We write to a temporary file and
+then rename, so an interrupted write can't leave a broken manifest.'''
+    if not os.path.isdir(stageCacheDir):
+        os.makedirs(stageCacheDir)
+    fn = os.path.join(stageCacheDir,manifestFN)
+    tempFN = fn + '.tmp'
+    with open(tempFN,'w') as f:
+        json.dump(manifestD,f)
+    os.replace(tempFN,fn)
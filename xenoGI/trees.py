@@ -276,7 +276,7 @@ dnaSeqD is empty, uses protein only.'''
     if dnaSeqD != {}:
         # back align to get dna alignment, overwriting protein alignment.
         protAlignL = []
-        for header,alignedProtSeq in fasta.load(outAlignFN):
+        for header,alignedProtSeq in fasta.iterLoad(outAlignFN):
             if strainHeader:
                 protAlignL.append((int(header.rstrip().split()[1]),header,alignedProtSeq))
             else:
@@ -1,7 +1,7 @@
 """Provides the entry point to xenoGI's functionality."""
 __version__ = "3.0.0"
 import sys, glob, os, readline, rlcompleter
-from . import parameters,genbank,blast,trees,genomes,Score,scores,families,islands,analysis,islandBed
+from . import parameters,genbank,blast,trees,genomes,Score,scores,families,islands,analysis,islandBed,stages
 from .Tree import *
 from .Family import *
 
@@ -12,14 +12,14 @@ def main():
         assert(len(sys.argv) == 3)
         paramFN=sys.argv[1]
         task = sys.argv[2]
-        assert(task in ['parseGenbank', 'runBlast', 'calcScores','makeSpeciesTree', 'makeFamilies', 'makeIslands','refine', 'printAnalysis', 'createIslandBed', 'plotScoreHists', 'interactiveAnalysis', 'runAll', 'version', 'debug'])
+        assert(task in ['parseGenbank', 'runBlast', 'calcScores', 'addGenomes','makeSpeciesTree', 'makeFamilies', 'makeIslands','refine', 'printAnalysis', 'createIslandBed', 'plotScoreHists', 'interactiveAnalysis', 'runAll', 'version', 'debug'])
     
     except:
         print(
             """
    Exactly two arguments required.
       1. A path to a parameter file.
-      2. The task to be run which must be one of: parseGenbank, runBlast, calcScores, makeSpeciesTree, makeFamilies, makeIslands, refine, printAnalysis, createIslandBed, plotScoreHists, interactiveAnalysis, runAll or version.
+      2. The task to be run which must be one of: parseGenbank, runBlast, calcScores, addGenomes, makeSpeciesTree, makeFamilies, makeIslands, refine, printAnalysis, createIslandBed, plotScoreHists, interactiveAnalysis, runAll or version.
 
    For example: 
       xenoGI params.py parseGenbank
@@ -33,32 +33,36 @@ def main():
         
     #### parseGenbank
     if task == 'parseGenbank':
-        parseGenbankWrapper(paramD)
+        stages.runStage('parseGenbank',paramD,parseGenbankWrapper)
         
     #### runBlast
     elif task == 'runBlast':
-        runBlastWrapper(paramD)
+        stages.runStage('runBlast',paramD,runBlastWrapper)
         
     #### calcScores
     elif task == 'calcScores':
         blastFnL=glob.glob(paramD['blastFilePath'])
-        calcScoresWrapper(paramD,blastFnL)
+        stages.runStage('calcScores',paramD,calcScoresWrapper,blastFnL)
+
+    #### addGenomes
+    elif task == 'addGenomes':
+        addGenomesWrapper(paramD)
 
     #### makeSpeciesTreeWrapper
     elif task == 'makeSpeciesTree':
-        makeSpeciesTreeWrapper(paramD)
+        stages.runStage('makeSpeciesTree',paramD,makeSpeciesTreeWrapper)
         
     #### makeFamilies
     elif task == 'makeFamilies':
-        makeFamiliesWrapper(paramD)
+        stages.runStage('makeFamilies',paramD,makeFamiliesWrapper)
         
     #### makeIslands
     elif task == 'makeIslands':
-        makeIslandsWrapper(paramD)
+        stages.runStage('makeIslands',paramD,makeIslandsWrapper)
 
     #### refineFamilies
     elif task == 'refine':
-        refineWrapper(paramD)
+        stages.runStage('refine',paramD,refineWrapper)
         
     #### printAnalysis
     elif task == 'printAnalysis':
@@ -78,13 +82,13 @@ def main():
         
     #### runAll
     elif task == 'runAll':
-        parseGenbankWrapper(paramD)
-        runBlastWrapper(paramD)
+        stages.runStage('parseGenbank',paramD,parseGenbankWrapper)
+        stages.runStage('runBlast',paramD,runBlastWrapper)
         blastFnL=glob.glob(paramD['blastFilePath'])
-        calcScoresWrapper(paramD,blastFnL)
-        makeFamiliesWrapper(paramD)
-        makeIslandsWrapper(paramD)
-        refineWrapper(paramD)
+        stages.runStage('calcScores',paramD,calcScoresWrapper,blastFnL)
+        stages.runStage('makeFamilies',paramD,makeFamiliesWrapper)
+        stages.runStage('makeIslands',paramD,makeIslandsWrapper)
+        stages.runStage('refine',paramD,refineWrapper)
         printAnalysisWrapper(paramD,paramD['speciesTreeFN'],paramD['rootFocalClade'])
         createIslandBedWrapper(paramD)
 
@@ -169,11 +173,76 @@ def calcScoresWrapper(paramD,blastFnL):
 
     # write scores to file
     scores.writeScores(scoresO,strainNamesT,paramD['scoresFN'])
+
+def addGenomesWrapper(paramD):
+    """Wrapper to add new genomes to a data set where parseGenbank,
+runBlast and calcScores have already been run. New genomes are those
+in genbankFilePath whose strains are not yet in strainInfoFN. We parse
+them (numbering their genes after the existing ones), blast only the
+strain pairs involving them, and add their edges to the existing
+scores. The later steps (makeFamilies etc.) must then be rerun, with
+a species tree that includes the new strains.
+
+strainInfoFN and aabrhFN are only updated once the new scores are in
+place. If we fail part way, they still describe the old data set, and
+addGenomes can simply be run again."""
+
+    oldStrainNamesT = readStrainInfoFN(paramD['strainInfoFN'])
+    oldGenesO = genomes.genes(paramD['geneInfoFN'])
+    oldAabrhHardCoreL = scores.loadOrthos(paramD['aabrhFN'])
+
+    # genes of the old strains. If an earlier attempt failed, geneInfoFN
+    # may also contain the genes it added.
+    oldNumGenes = max(oldGenesO.geneRangeByStrainD[strain][1] for strain in oldStrainNamesT)
+
+    genbankFileList=glob.glob(paramD['genbankFilePath'])
+    fileNameMapD,allStrainNamesT = parameters.loadFileNameMapD(paramD['fileNameMapFN'],genbankFileList)
+    newStrainNamesT = tuple(strain for strain in allStrainNamesT if strain not in oldStrainNamesT)
+    newGenbankFileList = [fn for fn in genbankFileList if fileNameMapD.get(os.path.split(fn)[-1]) in newStrainNamesT]
+    if newGenbankFileList == []:
+        print("No new genomes to add.",file=sys.stderr)
+        return
+
+    # new strains get numbers after the existing ones
+    newStrainNamesT = tuple(fileNameMapD[os.path.split(fn)[-1]] for fn in newGenbankFileList)
+    strainNamesT = oldStrainNamesT + newStrainNamesT
+
+    ## parse
+    fastaDir = paramD['fastaFilePath'].split('*')[0]
+    genbank.parseGenbank(paramD,fastaDir,newGenbankFileList,fileNameMapD,oldNumGenes)
+
+    ## blast new strains against everything, and old strains against new
+    oldDbFileL=blast.getDbFileL(paramD['fastaFilePath'],oldStrainNamesT)
+    newDbFileL=blast.getDbFileL(paramD['fastaFilePath'],newStrainNamesT)
+    blast.runBlast(newDbFileL,oldDbFileL+newDbFileL,paramD)
+    if oldDbFileL != []:
+        blast.runBlast(oldDbFileL,newDbFileL,paramD)
+
+    ## scores
+    geneOrderD=genomes.createGeneOrderD(paramD['geneOrderFN'],None)
+    scoresO = scores.readScores(oldStrainNamesT,paramD['scoresFN'])
+    tempAabrhFN = paramD['aabrhFN'] + '.tmp'
+    scoresO = scores.calcScoresForNewStrains(scoresO,newStrainNamesT,strainNamesT,oldAabrhHardCoreL,geneOrderD,paramD,tempAabrhFN)
+
+    # write to a temporary file first, since the old scores may be
+    # memory mapped from scoresFN
+    tempScoresFN = paramD['scoresFN'] + '.tmp.' + os.path.splitext(paramD['scoresFN'])[1][1:]
+    scores.writeScores(scoresO,strainNamesT,tempScoresFN)
+    os.replace(tempScoresFN,paramD['scoresFN'])
+
+    # the data set now includes the new strains
+    os.replace(tempAabrhFN,paramD['aabrhFN'])
+    writeStrainInfoFN(strainNamesT,paramD)
+
+    # the outputs of the first three stages now correspond to the
+    # full set of genomes
+    for stageName in ['parseGenbank','runBlast','calcScores']:
+        stages.recordStage(stageName,paramD)
     
 def makeSpeciesTreeWrapper(paramD):
     '''call makeTree to create the species tree '''
 
-    # need genesO should initializeGeneInfoD
+    # makeSpeciesTree needs genesO for gene names
     strainNamesT,genesO,geneOrderD = loadGenomeRelatedData(paramD)
     aabrhHardCoreL = scores.loadOrthos(paramD['aabrhFN'])
     trees.makeSpeciesTree(paramD,aabrhHardCoreL,genesO)
@@ -252,7 +321,6 @@ arguments so we can pass in different things in different contexts
     strainNamesT=speciesRtreeO.leaves()
     geneOrderD=genomes.createGeneOrderD(paramD['geneOrderFN'],strainNamesT)
     genesO = genomes.genes(paramD['geneInfoFN'])
-    genesO.initializeGeneInfoD(paramD['geneInfoFN'],strainNamesT)
     scoresO = scores.readScores(strainNamesT,paramD['scoresFN'])
     originFamiliesO = families.readFamilies(paramD['originFamilyFN'],speciesRtreeO,genesO,"origin")
     islandByNodeD=islands.readIslands(paramD['islandOutFN'],speciesRtreeO)
@@ -278,8 +346,6 @@ def createIslandBedWrapper(paramD):
     speciesRtreeO,subtreeD = loadTreeRelatedData(paramD['speciesTreeFN'])
     originFamiliesO = families.readFamilies(paramD['originFamilyFN'],speciesRtreeO,genesO,"origin")
     islandByNodeD = islands.readIslands(paramD['islandOutFN'],speciesRtreeO)
-    genesO.initializeGeneInfoD(paramD['geneInfoFN'],strainNamesT)
-    genesO.initializeGeneNumToNameD(paramD['geneInfoFN'],strainNamesT)
     
     # get islands organized by strain
     islandByStrainD = islandBed.createIslandByStrainD(strainNamesT,islandByNodeD,originFamiliesO,genesO)
@@ -379,14 +445,12 @@ def interactiveAnalysisWrapper(paramD):
     
     strainNamesT,genesO,geneOrderD = loadGenomeRelatedData(paramD)
     speciesRtreeO,subtreeD = loadTreeRelatedData(paramD['speciesTreeFN'])
-    genesO.initializeGeneInfoD(paramD['geneInfoFN'],strainNamesT)
-    genesO.initializeGeneNumToNameD(paramD['geneInfoFN'],strainNamesT)
     initialFamiliesO = families.readFamilies(paramD['initFamilyFN'],speciesRtreeO,genesO,"initial")
     originFamiliesO = families.readFamilies(paramD['originFamilyFN'],speciesRtreeO,genesO,"origin")
     islandByNodeD=islands.readIslands(paramD['islandOutFN'],speciesRtreeO)
     gene2FamIslandD = createGene2FamIslandD(islandByNodeD,originFamiliesO)
     scoresO = scores.readScores(strainNamesT,paramD['scoresFN'])
-    scoresO.createNodeConnectD() # make nodeConnectD attribute
+    scoresO.createNodeConnectArrays() # make node connection attributes
     
     # set up interactive console
     vars = globals()